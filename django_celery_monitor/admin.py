@@ -5,9 +5,14 @@ from __future__ import absolute_import, unicode_literals
 
 from django.contrib import admin
 from django.contrib.admin import helpers
+from django.contrib.admin.options import IncorrectLookupParameters
 from django.contrib.admin.views import main as main_views
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from django.urls import reverse
 from django.shortcuts import render_to_response
 from django.template import RequestContext
+from django.utils.dateparse import parse_datetime
 from django.utils.encoding import force_text
 from django.utils.html import escape
 from django.utils.translation import ugettext_lazy as _
@@ -17,8 +22,14 @@ from celery import states
 from celery.task.control import broadcast, revoke, rate_limit
 from celery.utils.text import abbrtask
 
-from .models import TaskState, WorkerState
+from .models import (
+    TASK_STATE_CHOICES, ExceptionGroup, TaskName, TaskRollup, TaskState,
+    WorkerState,
+)
 from .humanize import naturaldate
+from .managers import states_lookup
+from .pagination import EstimatedCountPaginator, estimate_count
+from .search import SearchIndex
 from .utils import action, display_field, fixedwidth, make_aware
 
 
@@ -31,6 +42,10 @@ TASK_STATE_COLORS = {states.SUCCESS: 'green',
 NODE_STATE_COLORS = {'ONLINE': 'green',
                      'OFFLINE': 'gray'}
 
+#: The query parameters of the keyset paginated changelist.
+AFTER_VAR = 'after'
+BEFORE_VAR = 'before'
+
 
 class MonitorList(main_views.ChangeList):
     """A custom changelist to set the page title automatically."""
@@ -39,6 +54,210 @@ class MonitorList(main_views.ChangeList):
         super(MonitorList, self).__init__(*args, **kwargs)
         self.title = self.model_admin.list_page_title
 
+    def get_queryset(self, request):
+        qs = super(MonitorList, self).get_queryset(request)
+        if self.model_admin.list_deferred_fields:
+            qs = qs.defer(*self.model_admin.list_deferred_fields)
+        return qs
+
+
+class EstimatedCountMonitorList(MonitorList):
+    """A changelist that shows estimated counts for large tables.
+
+    Expects the model admin to return an
+    :class:`~django_celery_monitor.pagination.EstimatedCountPaginator`
+    and doesn't count the unfiltered table, but estimates it.
+    """
+
+    def get_results(self, request):
+        paginator = self.model_admin.get_paginator(
+            request, self.queryset, self.list_per_page,
+        )
+        result_count = paginator.count
+        if self.model_admin.show_full_result_count:
+            full_result_count = estimate_count(
+                self.model, using=self.root_queryset.db,
+            )
+        else:
+            full_result_count = None
+        can_show_all = result_count <= self.list_max_show_all
+        if paginator.estimated:
+            can_show_all = False
+        multi_page = result_count > self.list_per_page
+
+        if (self.show_all and can_show_all) or not multi_page:
+            result_list = self.queryset._clone()
+        else:
+            try:
+                result_list = paginator.page(self.page_num + 1).object_list
+            except InvalidPage:
+                raise IncorrectLookupParameters
+
+        self.result_count = result_count
+        self.result_count_estimated = paginator.estimated
+        self.show_full_result_count = full_result_count is not None
+        self.show_admin_actions = True
+        self.full_result_count = full_result_count
+        self.result_list = result_list
+        self.can_show_all = can_show_all
+        self.multi_page = multi_page
+        self.paginator = paginator
+
+
+class KeysetMonitorList(MonitorList):
+    """A changelist paginated by ``(tstamp, id)`` cursors.
+
+    Instead of counting and skipping rows with ``OFFSET``, every page
+    starts right after (or before) the last (or first) row of the
+    previous page, which is as fast for deep pages as for the first.
+    Lists sorted by other columns fall back to page numbers.
+    """
+
+    def get_filters_params(self, params=None):
+        lookup_params = super(KeysetMonitorList, self).get_filters_params(
+            params,
+        )
+        lookup_params.pop(AFTER_VAR, None)
+        lookup_params.pop(BEFORE_VAR, None)
+        return lookup_params
+
+    def get_query_string(self, new_params=None, remove=None):
+        # filters, search and sorting start from the first page again.
+        new_params = dict({AFTER_VAR: None, BEFORE_VAR: None},
+                          **(new_params or {}))
+        return super(KeysetMonitorList, self).get_query_string(
+            new_params, remove,
+        )
+
+    @property
+    def keyset(self):
+        """Return whether the list is paginated by cursors."""
+        return main_views.ORDER_VAR not in self.params
+
+    def encode_cursor(self, obj):
+        return '{0}_{1}'.format(obj.tstamp.isoformat(), obj.pk)
+
+    def decode_cursor(self, cursor):
+        tstamp, _, pk = cursor.rpartition('_')
+        try:
+            tstamp, pk = parse_datetime(tstamp), int(pk)
+        except ValueError:
+            raise IncorrectLookupParameters
+        if tstamp is None:
+            raise IncorrectLookupParameters
+        return tstamp, pk
+
+    def get_results(self, request):
+        if not self.keyset:
+            return super(KeysetMonitorList, self).get_results(request)
+        queryset = self.queryset
+        after = self.params.get(AFTER_VAR)
+        before = self.params.get(BEFORE_VAR)
+        if before:
+            tstamp, pk = self.decode_cursor(before)
+            queryset = queryset.filter(
+                Q(tstamp__gt=tstamp) | Q(tstamp=tstamp, pk__gt=pk),
+            ).order_by('tstamp', 'pk')
+        else:
+            if after:
+                tstamp, pk = self.decode_cursor(after)
+                queryset = queryset.filter(
+                    Q(tstamp__lt=tstamp) | Q(tstamp=tstamp, pk__lt=pk),
+                )
+            queryset = queryset.order_by('-tstamp', '-pk')
+        result_list = list(queryset[:self.list_per_page + 1])
+        has_more = len(result_list) > self.list_per_page
+        result_list = result_list[:self.list_per_page]
+        if before:
+            result_list.reverse()
+
+        self.next_cursor = self.previous_cursor = None
+        if result_list:
+            if has_more or before:
+                self.next_cursor = self.encode_cursor(result_list[-1])
+            if after or (before and has_more):
+                self.previous_cursor = self.encode_cursor(result_list[0])
+
+        self.result_count = len(result_list)
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.full_result_count = None
+        self.result_list = result_list
+        self.can_show_all = False
+        self.multi_page = False
+        self.paginator = self.model_admin.paginator(
+            result_list, self.list_per_page,
+        )
+
+
+class StateListFilter(admin.SimpleListFilter):
+    """A task state filter filtering by the indexed state rank."""
+
+    title = _('state')
+    parameter_name = 'state'
+
+    def lookups(self, request, model_admin):
+        return TASK_STATE_CHOICES
+
+    def queryset(self, request, queryset):
+        if self.value() is not None:
+            return queryset.filter(**states_lookup([self.value()]))
+        return queryset
+
+
+class TaskNameListFilter(admin.SimpleListFilter):
+    """A task name filter listing the names from the task name catalog."""
+
+    title = _('name')
+    parameter_name = 'name'
+
+    def lookups(self, request, model_admin):
+        return [(name, name) for name in
+                TaskName.objects.values_list('name', flat=True)]
+
+    def has_output(self):
+        # Keep filtering by names missing from the catalog.
+        if self.value() is not None:
+            return True
+        return super(TaskNameListFilter, self).has_output()
+
+    def queryset(self, request, queryset):
+        if self.value() is None:
+            return queryset
+        ids = list(TaskName.objects.filter(
+            name=self.value(),
+        ).values_list('pk', flat=True))
+        if ids:
+            return queryset.filter(task_name__in=ids)
+        return queryset.filter(name=self.value())
+
+
+class QueueWaitListFilter(admin.SimpleListFilter):
+    """A filter of the tasks by how long they waited to be started."""
+
+    title = _('queue wait')
+    parameter_name = 'queue_wait'
+    #: The ``(value, label, minimum, maximum)`` seconds of the choices.
+    buckets = (
+        ('0-1', _('under a second'), None, 1),
+        ('1-10', _('1 to 10 seconds'), 1, 10),
+        ('10-60', _('10 seconds to a minute'), 10, 60),
+        ('60-', _('over a minute'), 60, None),
+    )
+
+    def lookups(self, request, model_admin):
+        return [(bucket[0], bucket[1]) for bucket in self.buckets]
+
+    def queryset(self, request, queryset):
+        for value, label, low, high in self.buckets:
+            if value != self.value():
+                continue
+            if low is not None:
+                queryset = queryset.filter(queue_wait__gte=low)
+            if high is not None:
+                queryset = queryset.filter(queue_wait__lt=high)
+        return queryset
+
 
 @display_field(_('state'), 'state')
 def colored_state(task):
@@ -92,16 +311,74 @@ def name(task):
     )
 
 
+@display_field(_('count'), 'count')
+def failed_tasks(group):
+    """Link the count of an exception group to the list of its tasks."""
+    return '<a href="{0}?exception_group__id__exact={1}">{2}</a>'.format(
+        reverse('admin:celery_monitor_taskstate_changelist'),
+        group.pk, group.count,
+    )
+
+
+@display_field(_('mean runtime'), 'runtime_sum')
+def mean_runtime(rollup):
+    """Return the mean runtime of the tasks of a rollup."""
+    if not rollup.count or rollup.runtime_min is None:
+        return ''
+    return '{0:.3f}'.format(rollup.runtime_sum / rollup.count)
+
+
+@display_field(_('mean queue wait'), 'queue_wait_sum')
+def mean_queue_wait(rollup):
+    """Return the mean queue wait of the tasks of a rollup."""
+    if not rollup.count or rollup.queue_wait_min is None:
+        return ''
+    return '{0:.3f}'.format(rollup.queue_wait_sum / rollup.count)
+
+
 class ModelMonitor(admin.ModelAdmin):
     """Base class for task and worker monitors."""
 
     can_add = False
     can_delete = False
+    #: The fields not loaded by the change list.
+    list_deferred_fields = ()
 
     def get_changelist(self, request, **kwargs):
         """Return the custom change list class we defined above."""
+        if self.keyset_pagination:
+            return KeysetMonitorList
+        if self.estimate_counts:
+            return EstimatedCountMonitorList
         return MonitorList
 
+    def get_paginator(self, request, queryset, per_page, orphans=0,
+                      allow_empty_first_page=True):
+        """Return a paginator estimating the counts if enabled."""
+        paginator = self.paginator
+        if self.estimate_counts:
+            paginator = EstimatedCountPaginator
+        return paginator(queryset, per_page, orphans, allow_empty_first_page)
+
+    @property
+    def estimate_counts(self):
+        """Return whether to estimate the counts of large lists.
+
+        Enabled with the ``monitors_estimate_counts`` Celery setting.
+        """
+        return current_app.conf.get('monitors_estimate_counts', False)
+
+    @property
+    def keyset_pagination(self):
+        """Return whether to paginate lists by cursors instead of pages.
+
+        Enabled with the ``monitors_keyset_pagination`` Celery setting,
+        only used by models with a ``tstamp`` field.
+        """
+        if not any(f.name == 'tstamp' for f in self.opts.fields):
+            return False
+        return current_app.conf.get('monitors_keyset_pagination', False)
+
     def change_view(self, request, object_id, extra_context=None):
         """Make sure the title is set correctly."""
         extra_context = extra_context or {}
@@ -129,6 +406,7 @@ class TaskMonitor(ModelMonitor):
 
     detail_title = _('Task detail')
     list_page_title = _('Tasks')
+    change_list_template = 'django_celery_monitor/change_list.html'
     rate_limit_confirmation_template = (
         'django_celery_monitor/confirm_rate_limit.html'
     )
@@ -136,30 +414,36 @@ class TaskMonitor(ModelMonitor):
     fieldsets = (
         (None, {
             'fields': ('state', 'task_id', 'name', 'args', 'kwargs',
-                       'eta', 'runtime', 'worker', 'tstamp'),
+                       'eta', 'runtime', 'queue_wait', 'worker', 'tstamp'),
             'classes': ('extrapretty', ),
         }),
         ('Details', {
             'classes': ('collapse', 'extrapretty'),
-            'fields': ('result', 'traceback', 'expires'),
+            'fields': ('result', 'traceback', 'exception_group', 'expires',
+                       'received', 'started', 'succeeded', 'failed'),
         }),
     )
     list_display = (
         fixedwidth('task_id', name=_('UUID'), pt=8),
         colored_state,
         name,
-        fixedwidth('args', pretty=True),
-        fixedwidth('kwargs', pretty=True),
+        fixedwidth('args_preview', name=_('Arguments'), pretty=True),
+        fixedwidth('kwargs_preview', name=_('Keyword arguments'),
+                   pretty=True),
         eta,
         tstamp,
         'worker',
     )
     readonly_fields = (
         'state', 'task_id', 'name', 'args', 'kwargs',
-        'eta', 'runtime', 'worker', 'result', 'traceback',
-        'expires', 'tstamp',
+        'eta', 'runtime', 'queue_wait', 'worker', 'result', 'traceback',
+        'exception_group', 'expires', 'tstamp', 'received', 'started',
+        'succeeded', 'failed',
     )
-    list_filter = ('state', 'name', 'tstamp', 'eta', 'worker')
+    #: Lists only load the previews of the large text fields.
+    list_deferred_fields = ('args', 'kwargs', 'result', 'traceback')
+    list_filter = (StateListFilter, TaskNameListFilter, QueueWaitListFilter,
+                   'tstamp', 'eta', 'received', 'started', 'worker')
     search_fields = ('name', 'task_id', 'args', 'kwargs', 'worker__hostname')
     actions = ['revoke_tasks',
                'terminate_tasks',
@@ -192,7 +476,9 @@ class TaskMonitor(ModelMonitor):
 
     @action(_('Rate limit selected tasks'))
     def rate_limit_tasks(self, request, queryset):
-        tasks = set([task.name for task in queryset])
+        tasks = set(
+            queryset.order_by().values_list('name', flat=True).distinct()
+        )
         opts = self.model._meta
         app_label = opts.app_label
         if request.POST.get('post'):
@@ -225,6 +511,29 @@ class TaskMonitor(ModelMonitor):
         qs = super(TaskMonitor, self).get_queryset(request)
         return qs.select_related('worker')
 
+    @property
+    def search_index(self):
+        """Return the full-text search index if enabled and installed."""
+        if not current_app.conf.get('monitors_search_index', False):
+            return None
+        index = SearchIndex(self.model)
+        if not index.installed():
+            return None
+        return index
+
+    def get_search_results(self, request, queryset, search_term):
+        index = search_term.split() and self.search_index
+        if not index:
+            return super(TaskMonitor, self).get_search_results(
+                request, queryset, search_term,
+            )
+        workers = WorkerState.objects.filter(
+            hostname__icontains=search_term.strip(),
+        )
+        return queryset.filter(
+            Q(pk__in=index.matching(search_term)) | Q(worker__in=workers),
+        ), False
+
 
 @admin.register(WorkerState)
 class WorkerMonitor(ModelMonitor):
@@ -257,3 +566,51 @@ class WorkerMonitor(ModelMonitor):
         actions = super(WorkerMonitor, self).get_actions(request)
         actions.pop('delete_selected', None)
         return actions
+
+
+@admin.register(ExceptionGroup)
+class ExceptionGroupMonitor(ModelMonitor):
+    """The monitor of the task failures grouped by traceback fingerprint."""
+
+    detail_title = _('Failure detail')
+    list_page_title = _('Failures')
+    date_hierarchy = 'last_seen'
+    fieldsets = (
+        (None, {
+            'fields': ('exception', 'fingerprint', 'count',
+                       'first_seen', 'last_seen', 'traceback'),
+            'classes': ('extrapretty', ),
+        }),
+    )
+    list_display = ('exception', failed_tasks, 'first_seen', 'last_seen')
+    readonly_fields = ('exception', 'fingerprint', 'count',
+                       'first_seen', 'last_seen', 'traceback')
+    list_filter = ('exception', 'last_seen')
+    search_fields = ('exception', 'fingerprint')
+
+    def get_actions(self, request):
+        actions = super(ExceptionGroupMonitor, self).get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+
+@admin.register(TaskRollup)
+class TaskRollupMonitor(ModelMonitor):
+    """The monitor of the task counts per name, state and minute."""
+
+    detail_title = _('Task rollup detail')
+    list_page_title = _('Task rollups')
+    date_hierarchy = 'minute'
+    list_display = ('minute', 'name', colored_state, 'count', mean_runtime,
+                    'runtime_min', 'runtime_max', mean_queue_wait,
+                    'queue_wait_max')
+    readonly_fields = ('name', 'state', 'minute', 'count', 'runtime_sum',
+                       'runtime_min', 'runtime_max', 'queue_wait_sum',
+                       'queue_wait_min', 'queue_wait_max')
+    list_filter = ('state', 'minute')
+    search_fields = ('name', )
+
+    def get_actions(self, request):
+        actions = super(TaskRollupMonitor, self).get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
@@ -2,14 +2,33 @@
 from __future__ import absolute_import, unicode_literals
 
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 from django.utils.translation import ugettext_lazy as _
 
 __all__ = ['CeleryMonitorConfig']
 
 
+def update_row_counts(sender, using, **kwargs):
+    """Maintain the task state row count used to estimate list sizes.
+
+    Only while the ``monitors_estimate_counts`` setting is enabled,
+    the row count is dropped otherwise.
+    """
+    from celery import current_app
+    from .pagination import drop_row_count, install_row_count
+    TaskState = sender.get_model('TaskState')
+    if current_app.conf.get('monitors_estimate_counts', False):
+        install_row_count(TaskState, using)
+    else:
+        drop_row_count(TaskState, using)
+
+
 class CeleryMonitorConfig(AppConfig):
     """Default configuration for the django_celery_monitor app."""
 
     name = 'django_celery_monitor'
     label = 'celery_monitor'
     verbose_name = _('Celery Monitor')
+
+    def ready(self):
+        post_migrate.connect(update_row_counts, sender=self)
@@ -1,38 +1,139 @@
 """The Celery events camera."""
 from __future__ import absolute_import, unicode_literals
 
+import threading
+from collections import defaultdict
+from copy import copy
 from datetime import timedelta
 
 from celery import states
 from celery.events.snapshot import Polaroid
+from celery.five import monotonic
+from celery.utils.functional import LRUCache
 from celery.utils.imports import symbol_by_name
 from celery.utils.log import get_logger
 from celery.utils.time import maybe_iso8601
+from django.db import connections, router
+from django.utils import timezone
+from kombu.utils.objects import cached_property
 
-from .utils import fromtimestamp, correct_awareness
+from .fields import Uncompressed
+from .fingerprints import exception_name, fingerprint
+from .instrumentation import NO_PHASE, Phase, hooks_connected
+from .metrics import REGISTRY, CameraMetrics, MetricsServer
+from .partitions import Partitions
+from .payload import PayloadLimits
+from .purge import Purger
+from .search import SearchIndex
+from .sketches import RELATIVE_ACCURACY, DDSketch
+from .utils import fromtimestamp, correct_awareness, preview, shard_of
+from .writers import Writers
 
 WORKER_UPDATE_FREQ = 60  # limit worker timestamp write freq.
+WORKER_CACHE_SIZE = 1000  # limit number of workers cached in memory.
+TASK_CACHE_SIZE = 100000  # limit number of tasks cached in memory.
+EXCEPTION_GROUP_CACHE_SIZE = 10000  # limit number of exception groups cached.
 SUCCESS_STATES = frozenset([states.SUCCESS])
 
-NOT_SAVED_ATTRIBUTES = frozenset(['name', 'args', 'kwargs', 'eta'])
+#: The timestamps of the task events stored in columns of their own.
+LIFECYCLE_FIELDS = ('received', 'started', 'succeeded', 'failed')
+
+NOT_SAVED_ATTRIBUTES = frozenset([
+    'name', 'task_name_id', 'args', 'kwargs', 'args_preview',
+    'kwargs_preview', 'eta', 'expires', 'queue_wait',
+]) | frozenset(LIFECYCLE_FIELDS)
 
 logger = get_logger(__name__)
 debug = logger.debug
 
 
+def _accumulate(totals, value):
+    # add a value to a ``(sum, min, max)`` tuple, skipping missing ones.
+    total, low, high = totals
+    if value is None:
+        return totals
+    return (
+        total + value,
+        value if low is None or value < low else low,
+        value if high is None or value > high else high,
+    )
+
+
 class Camera(Polaroid):
     """The Celery events Polaroid snapshot camera."""
 
     clear_after = True
     worker_update_freq = WORKER_UPDATE_FREQ
+    worker_cache_size = WORKER_CACHE_SIZE
+    task_cache_size = TASK_CACHE_SIZE
+    exception_group_cache_size = EXCEPTION_GROUP_CACHE_SIZE
+    #: The registry of the metrics, if enabled.
+    metrics_registry = REGISTRY
 
     def __init__(self, *args, **kwargs):
         super(Camera, self).__init__(*args, **kwargs)
+        #: Mapping of hostnames to ``(pk, heartbeat, write time)`` tuples
+        #: of the last worker states written to the database.
+        self.worker_cache = LRUCache(limit=self.worker_cache_size)
+        #: Mapping of task UUIDs to the versions of the task states
+        #: last written to the database, see :meth:`get_task_version`.
+        self.task_cache = LRUCache(limit=self.task_cache_size)
+        #: Mapping of task names to ``(count, first_seen, last_seen)``
+        #: tuples not yet added to the task name catalog.
+        self.task_names = {}
+        #: Mapping of ``(name, state, minute)`` tuples to ``(count,
+        #: runtime_sum, runtime_min, runtime_max, queue_wait_sum,
+        #: queue_wait_min, queue_wait_max)`` tuples not yet added to
+        #: the rollups.
+        self.rollups = {}
+        #: Mapping of ``(name, window)`` tuples to the runtime sketches
+        #: not yet merged into the stored ones.
+        self.runtime_sketches = {}
+        self._pending_lock = threading.Lock()
+        #: Mapping of task names to their primary keys in the catalog.
+        self.task_name_ids = {}
+        #: Mapping of traceback fingerprints to exception group primary keys.
+        self.exception_groups = LRUCache(
+            limit=self.exception_group_cache_size,
+        )
         # Expiry can be timedelta or None for never expire.
         self.app.add_defaults({
             'monitors_expire_success': timedelta(days=1),
             'monitors_expire_error': timedelta(days=3),
             'monitors_expire_pending': timedelta(days=5),
+            # Write whole snapshots with a few bulk upserts.
+            'monitors_batch_writes': False,
+            'monitors_batch_size': 1000,
+            # Purge expired tasks in chunks, optionally in a thread.
+            'monitors_purge_chunk_size': 1000,
+            'monitors_purge_time_budget': None,
+            'monitors_purge_in_background': False,
+            # Store task states in daily partitions dropped as a whole.
+            'monitors_partitioned': False,
+            'monitors_partition_retention': None,
+            # Keep a full-text index of the task states for the admin.
+            'monitors_search_index': False,
+            # Truncate or drop large payloads of tasks by name.
+            'monitors_payload_limits': None,
+            # Store the tracebacks of failed tasks once per fingerprint.
+            'monitors_group_exceptions': False,
+            # Write snapshots in background threads, sharded by task.
+            'monitors_writer_threads': 0,
+            'monitors_writer_queue_size': 10,
+            'monitors_writer_timeout': None,
+            # Count the tasks per name, state and minute.
+            'monitors_rollups': False,
+            # Keep runtime quantile sketches per name and time window.
+            'monitors_runtime_sketches': False,
+            'monitors_sketch_window': timedelta(hours=1),
+            'monitors_sketch_accuracy': RELATIVE_ACCURACY,
+            # Keep Prometheus metrics, optionally served on a port.
+            'monitors_metrics': False,
+            'monitors_metrics_port': None,
+            'monitors_metrics_addr': '',
+            # Split the tasks between cameras by UUID.
+            'monitors_shard_index': 0,
+            'monitors_shard_count': 1,
         })
 
     @property
@@ -45,13 +146,157 @@ class Camera(Polaroid):
         """Return the data model to store worker state in."""
         return symbol_by_name('django_celery_monitor.models.WorkerState')
 
+    @property
+    def TaskName(self):
+        """Return the data model to store the task name catalog in."""
+        return symbol_by_name('django_celery_monitor.models.TaskName')
+
+    @property
+    def ExceptionGroup(self):
+        """Return the data model to store the exception groups in."""
+        return symbol_by_name('django_celery_monitor.models.ExceptionGroup')
+
+    @property
+    def TaskRollup(self):
+        """Return the data model to store the task counts per minute in."""
+        return symbol_by_name('django_celery_monitor.models.TaskRollup')
+
+    @property
+    def RuntimeSketch(self):
+        """Return the data model to store the runtime sketches in."""
+        return symbol_by_name('django_celery_monitor.models.RuntimeSketch')
+
     def django_setup(self):
         import django
         django.setup()
 
+    @cached_property
+    def purger(self):
+        """Return the purger deleting expired task states."""
+        return Purger(
+            self.TaskState,
+            chunk_size=self.app.conf.monitors_purge_chunk_size,
+            time_budget=self.app.conf.monitors_purge_time_budget,
+        )
+
+    @cached_property
+    def partitions(self):
+        """Return the manager of the daily task state partitions."""
+        return Partitions(self.TaskState)
+
+    @cached_property
+    def upsert(self):
+        """Return whether task states are written with upserts.
+
+        Partitioned tables have no unique ``task_id`` index to upsert by.
+        """
+        return not self.partitions.is_partitioned()
+
+    @cached_property
+    def payload_limits(self):
+        """Return the limits of the payloads stored for tasks."""
+        return PayloadLimits(self.app.conf.monitors_payload_limits)
+
+    @cached_property
+    def search_index(self):
+        """Return the full-text search index of the task states."""
+        return SearchIndex(self.TaskState)
+
+    @cached_property
+    def writers(self):
+        """Return the pool of threads writing the snapshots."""
+        return Writers(
+            threads=self.app.conf.monitors_writer_threads,
+            queue_size=self.app.conf.monitors_writer_queue_size,
+            timeout=self.app.conf.monitors_writer_timeout,
+        )
+
+    @cached_property
+    def metrics(self):
+        """Return the metrics of the camera, or :const:`None` if disabled."""
+        if not self.app.conf.monitors_metrics:
+            return None
+        return CameraMetrics(self, registry=self.metrics_registry)
+
+    @cached_property
+    def metrics_server(self):
+        """Return the HTTP listener serving the metrics."""
+        return MetricsServer(
+            self.metrics_registry,
+            port=self.app.conf.monitors_metrics_port,
+            addr=self.app.conf.monitors_metrics_addr,
+        )
+
+    def phase(self, name, count=None, count_queries=True):
+        """Return a context timing a phase and counting its queries.
+
+        For the metrics and the receivers of the
+        :mod:`~django_celery_monitor.signals`, does nothing unless the
+        metrics are enabled or receivers are connected.
+        """
+        metrics = self.metrics
+        if metrics is None and not hooks_connected():
+            return NO_PHASE
+        connection = None
+        if count_queries:
+            connection = connections[router.db_for_write(self.TaskState)]
+        return Phase(
+            self, name, count, metrics=metrics, connection=connection,
+        )
+
+    @property
+    def owns_workers(self):
+        """Return whether this camera writes the worker heartbeats.
+
+        That is the first shard, which runs the cleanup as well.
+        """
+        return self.app.conf.monitors_shard_index == 0
+
+    def owns_task(self, uuid):
+        """Return whether this camera writes the task with the UUID."""
+        count = self.app.conf.monitors_shard_count
+        if count <= 1:
+            return True
+        return shard_of(uuid, count) == self.app.conf.monitors_shard_index
+
+    def get_owned_tasks(self, uuid_tasks):
+        """Return the tasks written by this camera."""
+        if self.app.conf.monitors_shard_count <= 1:
+            return list(uuid_tasks)
+        return [(uuid, task) for uuid, task in uuid_tasks
+                if self.owns_task(uuid)]
+
     def install(self):
+        self.setup()
         super(Camera, self).install()
+
+    def setup(self):
+        """Set up Django and the storage features enabled in the settings."""
+        index = self.app.conf.monitors_shard_index
+        count = self.app.conf.monitors_shard_count
+        if not 0 <= index < max(count, 1):
+            raise ValueError(
+                'monitors_shard_index must be between 0 and {0}, '
+                'got {1}'.format(count - 1, index))
         self.django_setup()
+        if self.app.conf.monitors_partitioned:
+            self.partitions.install()
+            self.partitions.ensure()
+        if self.app.conf.monitors_search_index:
+            self.search_index.install()
+        if self.app.conf.monitors_writer_threads:
+            self.writers.start()
+        if self.metrics is not None:
+            if self.app.conf.monitors_metrics_port is not None:
+                self.metrics_server.start()
+
+    def cancel(self):
+        super(Camera, self).cancel()
+        if self.app.conf.monitors_writer_threads:
+            # write the snapshots still queued.
+            self.writers.stop()
+        if self.metrics is not None:
+            self.metrics_server.stop()
 
     @property
     def expire_task_states(self):
@@ -71,22 +316,303 @@ class Camera(Polaroid):
 
     def handle_worker(self, hostname_worker):
         hostname, worker = hostname_worker
-        return self.WorkerState.objects.update_heartbeat(
+        obj = self.WorkerState.objects.update_heartbeat(
             hostname,
             heartbeat=self.get_heartbeat(worker),
             update_freq=self.worker_update_freq,
         )
+        self.worker_cache[hostname] = (
+            obj.pk, obj.last_heartbeat, monotonic(),
+        )
+        return obj
+
+    def handle_workers(self, hostname_workers):
+        """Handle many snapshotted workers with a single write.
+
+        Only the workers not seen before, and those whose heartbeat
+        changed more than ``worker_update_freq`` seconds after the last
+        write or that went offline are written to the database, and of
+        those only the ones not written by another camera in the last
+        ``worker_update_freq`` seconds.
+        Returns a mapping of the hostnames to the worker primary keys.
+
+        Cameras of other shards than the first only look up the workers.
+        """
+        hostname_workers = list(hostname_workers)
+        with self.phase('workers', len(hostname_workers)):
+            if not self.owns_workers:
+                return self.get_worker_ids(
+                    hostname for hostname, _ in hostname_workers
+                )
+            now = monotonic()
+            due, worker_ids = {}, {}
+            for hostname, worker in hostname_workers:
+                heartbeat = self.get_heartbeat(worker)
+                try:
+                    cached = self.worker_cache[hostname]
+                except KeyError:
+                    due[hostname] = heartbeat
+                    continue
+                pk, last_heartbeat, last_write = cached
+                worker_ids[hostname] = pk
+                if heartbeat == last_heartbeat:
+                    continue
+                went_offline = heartbeat is None or last_heartbeat is None
+                if went_offline or now - last_write >= self.worker_update_freq:
+                    due[hostname] = heartbeat
+            if due:
+                written = self.WorkerState.objects.update_heartbeats(
+                    due, update_freq=self.worker_update_freq,
+                )
+                for hostname, pk in written.items():
+                    self.worker_cache[hostname] = (pk, due[hostname], now)
+                worker_ids.update(written)
+            return worker_ids
+
+    def get_worker_ids(self, hostnames):
+        """Return the primary keys of the workers without writing them."""
+        worker_ids, missing = {}, []
+        for hostname in hostnames:
+            try:
+                worker_ids[hostname] = self.worker_cache[hostname][0]
+            except KeyError:
+                missing.append(hostname)
+        if missing:
+            now = monotonic()
+            written = self.WorkerState.objects.worker_ids(missing)
+            for hostname, pk in written.items():
+                self.worker_cache[hostname] = (pk, None, now)
+            worker_ids.update(written)
+        return worker_ids
+
+    def get_workers(self, state):
+        """Return all workers of the state, including those of its tasks."""
+        workers = self.get_task_workers(state.tasks.items())
+        workers.update(state.workers)
+        return workers
+
+    def get_task_workers(self, uuid_tasks):
+        """Return the workers of the given tasks by hostname."""
+        return dict(
+            (task.worker.hostname, task.worker)
+            for _, task in uuid_tasks
+            if task.worker and task.worker.hostname
+        )
 
     def handle_task(self, uuid_task, worker=None):
         """Handle snapshotted event."""
         uuid, task = uuid_task
-        if task.worker and task.worker.hostname:
+        if worker is None and task.worker and task.worker.hostname:
             worker = self.handle_worker(
                 (task.worker.hostname, task.worker),
             )
+        self.handle_task_names([uuid_task])
+        if self.app.conf.monitors_group_exceptions:
+            self.handle_exceptions([uuid_task])
+        defaults = self.get_task_defaults(task, worker)
+        obj = self.update_task(task.state, task_id=uuid, defaults=defaults)
+        if obj is not None:
+            self.note_task_name(
+                defaults['name'], defaults['tstamp'],
+                new=uuid not in self.task_cache,
+            )
+            self.note_stats(task, self.task_cache.get(uuid))
+            self.task_cache[uuid] = self.get_task_version(task)
+        return obj
+
+    def handle_tasks(self, uuid_tasks, workers=None):
+        """Handle many snapshotted events with a few bulk writes."""
+        uuid_tasks = list(uuid_tasks)
+        if workers is None:
+            workers = self.handle_workers(
+                self.get_task_workers(uuid_tasks).items(),
+            )
+        self.handle_task_names(uuid_tasks)
+        if self.app.conf.monitors_group_exceptions:
+            self.handle_exceptions(uuid_tasks)
+        batch, versions = [], {}
+        for uuid, task in uuid_tasks:
+            hostname = task.worker and task.worker.hostname
+            defaults = self.get_task_defaults(task, workers.get(hostname))
+            if defaults.get('name'):
+                batch.append((uuid, defaults))
+                versions[uuid] = self.get_task_version(task)
+                self.note_task_name(
+                    defaults['name'], defaults['tstamp'],
+                    new=uuid not in self.task_cache,
+                )
+                self.note_stats(task, self.task_cache.get(uuid))
+        written = self.TaskState.objects.bulk_update_state(
+            batch, batch_size=self.app.conf.monitors_batch_size,
+            upsert=self.upsert,
+        )
+        self.task_cache.update(versions)
+        return written
+
+    def handle_exceptions(self, uuid_tasks):
+        """Add the exceptions of failed tasks to their exception groups.
+
+        Every failure or retry counts once, when it is first written.
+        Groups missing from the cache are looked up as well, so the tasks
+        can refer to them. Returns the number of written groups.
+        """
+        groups = {}
+        for uuid, task in uuid_tasks:
+            if not task.traceback or task.state not in states.EXCEPTION_STATES:
+                continue
+            key = fingerprint(task.traceback)
+            version = self.task_cache.get(uuid)
+            new = version is None or (
+                version[:2] != self.get_task_version(task)[:2])
+            if not new and key in self.exception_groups:
+                continue
+            tstamp = fromtimestamp(task.timestamp)
+            exception, traceback, count, first_seen, last_seen = groups.get(
+                key, (exception_name(task.traceback), task.traceback,
+                      0, tstamp, tstamp),
+            )
+            groups[key] = (
+                exception, traceback, count + int(new),
+                min(first_seen, tstamp), max(last_seen, tstamp),
+            )
+        self.exception_groups.update(
+            self.ExceptionGroup.objects.update_groups(groups),
+        )
+        return len(groups)
+
+    def handle_task_names(self, uuid_tasks):
+        """Add the names of the tasks missing from the catalog to it.
+
+        So that the tasks can refer to their names in the catalog.
+        Returns the number of added names.
+        """
+        missing = {}
+        for _, task in uuid_tasks:
+            if task.name and task.name not in self.task_name_ids:
+                tstamp = fromtimestamp(task.timestamp)
+                missing[task.name] = (0, tstamp, tstamp)
+        if missing:
+            self.TaskName.objects.update_names(missing)
+            self.task_name_ids.update(self.TaskName.objects.filter(
+                name__in=list(missing),
+            ).values_list('name', 'pk'))
+        return len(missing)
+
+    def note_task_name(self, name, tstamp, new=False):
+        """Remember a seen task name for the next catalog update.
+
+        Tasks count once, the first time they are written, as far as
+        the task cache remembers them.
+        """
+        with self._pending_lock:
+            count, first_seen, last_seen = self.task_names.get(
+                name, (0, tstamp, tstamp),
+            )
+            self.task_names[name] = (
+                count + int(new),
+                min(first_seen, tstamp), max(last_seen, tstamp),
+            )
+
+    def flush_task_names(self):
+        """Add the task names seen since the last flush to the catalog."""
+        with self._pending_lock:
+            names, self.task_names = self.task_names, {}
+        return self.TaskName.objects.update_names(names)
+
+    def note_stats(self, task, version=None):
+        """Count a written task in the enabled statistics.
+
+        Tasks count once per state, when first written in that state,
+        given the ``version`` of the task last written.
+        """
+        if version is not None and version[0] == task.state:
+            return
+        if self.metrics is not None:
+            self.metrics.tasks.inc(labels=(task.name, task.state))
+        if self.app.conf.monitors_rollups:
+            self.note_rollup(task)
+        if self.app.conf.monitors_runtime_sketches:
+            self.note_runtime(task)
+
+    def flush_stats(self):
+        """Write the statistics counted since the last flush."""
+        if self.app.conf.monitors_rollups:
+            self.flush_rollups()
+        if self.app.conf.monitors_runtime_sketches:
+            self.flush_runtime_sketches()
+
+    def note_rollup(self, task):
+        """Count a task in the rollup of its state for the next flush."""
+        minute = fromtimestamp(task.timestamp).replace(
+            second=0, microsecond=0,
+        )
+        key = (task.name, task.state, minute)
+        runtime, queue_wait = task.runtime, self.get_queue_wait(task)
+        with self._pending_lock:
+            rollup = self.rollups.get(key)
+            if rollup is None:
+                rollup = (0, 0.0, None, None, 0.0, None, None)
+            runtimes = _accumulate(rollup[1:4], runtime)
+            queue_waits = _accumulate(rollup[4:], queue_wait)
+            self.rollups[key] = (rollup[0] + 1,) + runtimes + queue_waits
+
+    def flush_rollups(self):
+        """Add the tasks counted since the last flush to the rollups."""
+        with self._pending_lock:
+            rollups, self.rollups = self.rollups, {}
+        return self.TaskRollup.objects.update_rollups(rollups)
+
+    def note_runtime(self, task):
+        """Add the runtime of a task to the sketch of its time window."""
+        if task.runtime is None:
+            return
+        window = self.app.conf.monitors_sketch_window.total_seconds()
+        key = (task.name, fromtimestamp(
+            task.timestamp - task.timestamp % window,
+        ))
+        with self._pending_lock:
+            sketch = self.runtime_sketches.get(key)
+            if sketch is None:
+                sketch = self.runtime_sketches[key] = DDSketch(
+                    self.app.conf.monitors_sketch_accuracy,
+                )
+            sketch.add(task.runtime)
+
+    def flush_runtime_sketches(self):
+        """Merge the runtimes added since the last flush into the sketches."""
+        with self._pending_lock:
+            sketches, self.runtime_sketches = self.runtime_sketches, {}
+        return self.RuntimeSketch.objects.update_sketches(sketches)
+
+    def get_task_version(self, task):
+        """Return a value that changes with every event merged into a task.
+
+        Late events with a lower state precedence only merge some fields
+        like the name, without changing the state or clock of the task.
+        """
+        return (task.state, task.clock, task.timestamp, task.name)
 
+    def get_changed_tasks(self, uuid_tasks):
+        """Return the tasks that changed since they were last written."""
+        return [
+            (uuid, task) for uuid, task in uuid_tasks
+            if self.task_cache.get(uuid) != self.get_task_version(task)
+        ]
+
+    def get_queue_wait(self, task):
+        """Return the seconds the task waited between received and started.
+
+        Both timestamps are taken by the worker running the task.
+        """
+        if not task.received or not task.started:
+            return None
+        return max(task.started - task.received, 0.0)
+
+    def get_task_defaults(self, task, worker=None):
+        """Return the model field values to store for the given task."""
         defaults = {
             'name': task.name,
+            'task_name_id': self.task_name_ids.get(task.name),
             'args': task.args,
             'kwargs': task.kwargs,
             'eta': correct_awareness(maybe_iso8601(task.eta)),
@@ -96,14 +622,33 @@ class Camera(Polaroid):
             'result': task.result or task.exception,
             'traceback': task.traceback,
             'runtime': task.runtime,
-            'worker': worker
+            'worker_id': getattr(worker, 'pk', worker),
+            'queue_wait': self.get_queue_wait(task),
         }
+        for field in LIFECYCLE_FIELDS:
+            timestamp = getattr(task, field, None)
+            defaults[field] = fromtimestamp(timestamp) if timestamp else None
+        if self.payload_limits:
+            self.payload_limits.apply(task.name, defaults)
+        if self.app.conf.monitors_group_exceptions and task.traceback:
+            group = self.exception_groups.get(fingerprint(task.traceback))
+            if group is not None:
+                # the traceback is stored in the group instead.
+                defaults['exception_group_id'] = group
+                defaults['traceback'] = None
+        if self.app.conf.monitors_search_index:
+            # the search index is built from the stored text.
+            for field in ('result', 'traceback'):
+                if defaults[field]:
+                    defaults[field] = Uncompressed(defaults[field])
+        defaults['args_preview'] = preview(defaults['args'])
+        defaults['kwargs_preview'] = preview(defaults['kwargs'])
         # Some fields are only stored in the RECEIVED event,
         # so we should remove these from default values,
         # so that they are not overwritten by subsequent states.
         [defaults.pop(attr, None) for attr in NOT_SAVED_ATTRIBUTES
          if defaults[attr] is None]
-        return self.update_task(task.state, task_id=uuid, defaults=defaults)
+        return defaults
 
     def update_task(self, state, task_id, defaults=None):
         defaults = defaults or {}
@@ -113,27 +658,100 @@ class Camera(Polaroid):
             state=state,
             task_id=task_id,
             defaults=defaults,
+            upsert=self.upsert,
         )
 
     def on_shutter(self, state):
+        # the queries are counted by the phases of the snapshot.
+        with self.phase('shutter', len(state.tasks), count_queries=False):
+            if self.app.conf.monitors_writer_threads:
+                skipped = self.submit_snapshot(state)
+            else:
+                skipped = self.take_snapshot(state)
+        if self.metrics is not None:
+            self.metrics.tasks_skipped.inc(skipped)
+        return skipped
 
-        def _handle_tasks():
-            for i, task in enumerate(state.tasks.items()):
-                self.handle_task(task)
+    def take_snapshot(self, state):
+        """Write the changed tasks and the workers of the snapshot.
 
-        for worker in state.workers.items():
-            self.handle_worker(worker)
-        _handle_tasks()
+        Returns the number of skipped unchanged tasks.
+        """
+        owned = self.get_owned_tasks(state.tasks.items())
+        if self.owns_workers:
+            workers = self.get_workers(state)
+        else:
+            workers = self.get_task_workers(owned)
+        workers = self.handle_workers(workers.items())
+        tasks = self.get_changed_tasks(owned)
+        skipped = len(owned) - len(tasks)
+        if skipped:
+            debug('Shutter: Skipped %s unchanged tasks.', skipped)
+        self.write_tasks(tasks, workers)
+        return skipped
 
-    def on_cleanup(self):
-        expired = (
-            self.TaskState.objects.expire_by_states(states, expires)
-            for states, expires in self.expire_task_states
+    def write_tasks(self, uuid_tasks, workers):
+        """Write the snapshotted tasks, given the worker primary keys."""
+        uuid_tasks = list(uuid_tasks)
+        with self.phase('tasks', len(uuid_tasks)):
+            if self.app.conf.monitors_batch_writes:
+                self.handle_tasks(uuid_tasks, workers=workers)
+            else:
+                for uuid, task in uuid_tasks:
+                    hostname = task.worker and task.worker.hostname
+                    self.handle_task(
+                        (uuid, task), worker=workers.get(hostname),
+                    )
+            self.flush_task_names()
+            self.flush_stats()
+        if self.metrics is not None:
+            self.metrics.tasks_written.inc(len(uuid_tasks))
+
+    def submit_snapshot(self, state):
+        """Hand the changed tasks of the snapshot to the writer threads.
+
+        The tasks are sharded by UUID and copied, since the state keeps
+        changing while they are written. The first writer thread writes
+        the worker heartbeats too.
+        """
+        owned = self.get_owned_tasks(state.tasks.items())
+        tasks = self.get_changed_tasks(owned)
+        skipped = len(owned) - len(tasks)
+        if skipped:
+            debug('Shutter: Skipped %s unchanged tasks.', skipped)
+        shards = defaultdict(list)
+        for uuid, task in tasks:
+            shards[self.writers.shard(uuid)].append((uuid, copy(task)))
+        if self.owns_workers:
+            self.writers.submit(
+                0, self.handle_workers, list(state.workers.items()),
+            )
+        for shard, uuid_tasks in sorted(shards.items()):
+            self.writers.submit(shard, self.write_snapshot, uuid_tasks)
+        debug('Shutter: Writer queue depths %r.', self.writers.depths())
+        return skipped
+
+    def write_snapshot(self, uuid_tasks):
+        """Write a shard of the tasks of a snapshot in a writer thread."""
+        workers = self.handle_workers(
+            self.get_task_workers(uuid_tasks).items(),
         )
-        dirty = sum(item for item in expired if item is not None)
-        if dirty:
-            debug('Cleanup: Marked %s objects as dirty.', dirty)
-            self.TaskState.objects.purge()
-            debug('Cleanup: %s objects purged.', dirty)
-            return dirty
-        return 0
+        # skip tasks already written by a previous snapshot.
+        self.write_tasks(self.get_changed_tasks(uuid_tasks), workers)
+
+    def on_cleanup(self):
+        if not self.owns_workers:
+            return 0
+        with self.phase('cleanup') as phase:
+            retention = self.app.conf.monitors_partition_retention
+            if self.app.conf.monitors_partitioned:
+                self.partitions.ensure()
+                if retention is not None:
+                    self.partitions.drop_before(timezone.now() - retention)
+            if self.app.conf.monitors_purge_in_background:
+                self.purger.start(self.expire_task_states)
+                deleted = 0
+            else:
+                deleted = self.purger.purge(self.expire_task_states)
+            phase.count = deleted
+        return deleted
@@ -0,0 +1,119 @@
+"""Custom model fields."""
+from __future__ import absolute_import, unicode_literals
+
+import base64
+import zlib
+
+from celery import states
+from celery.five import text_t
+from django.db import models
+
+#: The first character of compressed values, which text values
+#: of tasks never start with.
+COMPRESSED_HEADER = '\x02'
+
+#: The length from which text values are compressed.
+COMPRESS_THRESHOLD = 1024
+
+
+class Uncompressed(text_t):
+    """A text value stored as is by :class:`CompressedTextField`.
+
+    Used for values which have to stay readable in the database,
+    e.g. those the full-text search index is built from.
+    """
+
+
+def compress(value, threshold=COMPRESS_THRESHOLD):
+    """Return the compressed form of the text if long and worth it."""
+    if isinstance(value, Uncompressed) or len(value) < threshold:
+        return value
+    if value.startswith(COMPRESSED_HEADER):
+        return value
+    compressed = COMPRESSED_HEADER + base64.b64encode(
+        zlib.compress(value.encode('utf-8')),
+    ).decode('ascii')
+    if len(compressed) >= len(value):
+        return value
+    return compressed
+
+
+def decompress(value):
+    """Return the text of a value returned by :func:`compress`."""
+    if not value.startswith(COMPRESSED_HEADER):
+        return value
+    try:
+        return zlib.decompress(base64.b64decode(
+            value[len(COMPRESSED_HEADER):].encode('ascii'),
+        )).decode('utf-8')
+    except (ValueError, zlib.error):
+        # not compressed after all.
+        return value
+
+
+class CompressedTextField(models.TextField):
+    """A text field storing long values compressed.
+
+    Values of at least ``threshold`` characters are stored zlib
+    compressed and base64 encoded behind :data:`COMPRESSED_HEADER`,
+    so the column stays a text column and short values stay readable
+    and searchable in the database. :class:`Uncompressed` values are
+    never compressed. Values are decompressed when loaded.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.threshold = kwargs.pop('threshold', COMPRESS_THRESHOLD)
+        super(CompressedTextField, self).__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super(
+            CompressedTextField, self).deconstruct()
+        if self.threshold != COMPRESS_THRESHOLD:
+            kwargs['threshold'] = self.threshold
+        return name, path, args, kwargs
+
+    def from_db_value(self, value, expression, connection, *args):
+        if value is None:
+            return value
+        return decompress(value)
+
+    def to_python(self, value):
+        value = super(CompressedTextField, self).to_python(value)
+        if value is None:
+            return value
+        return decompress(value)
+
+    def get_prep_value(self, value):
+        value = super(CompressedTextField, self).get_prep_value(value)
+        if value is None:
+            return value
+        return compress(value, self.threshold)
+
+
+class StateRankField(models.PositiveSmallIntegerField):
+    """A small integer field of the precedence of a task state field.
+
+    Holds :func:`celery.states.precedence` of the state in the ``source``
+    field, lower meaning higher precedence, computed whenever the model
+    is saved, or by the queryset updating the state of many rows. Queries
+    filtering by the rank use smaller indexes than those filtering by the
+    state name.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.source = kwargs.pop('source', 'state')
+        kwargs.setdefault('editable', False)
+        super(StateRankField, self).__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super(StateRankField, self).deconstruct()
+        if self.source != 'state':
+            kwargs['source'] = self.source
+        del kwargs['editable']
+        return name, path, args, kwargs
+
+    def pre_save(self, model_instance, add):
+        state = getattr(model_instance, self.source)
+        value = None if state is None else states.precedence(state)
+        setattr(model_instance, self.attname, value)
+        return value
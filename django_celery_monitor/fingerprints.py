@@ -0,0 +1,40 @@
+"""Fingerprints of task tracebacks."""
+from __future__ import absolute_import, unicode_literals
+
+import hashlib
+import re
+
+#: Matches the frame lines of Python tracebacks.
+FRAME_RE = re.compile(r'^\s*File "(?P<file>.+)", line (?P<line>\d+)'
+                      r'(?:, in (?P<function>.+))?$')
+#: Matches the exception line at the end of Python tracebacks.
+EXCEPTION_RE = re.compile(r'^(?P<exception>[\w.]+)(?::|$)')
+#: Matches memory addresses in reprs.
+ADDRESS_RE = re.compile(r'\b0x[0-9a-fA-F]+\b')
+
+
+def exception_name(traceback):
+    """Return the name of the exception raised in the traceback."""
+    for line in reversed(traceback.strip().splitlines()):
+        match = EXCEPTION_RE.match(line)
+        if match:
+            return match.group('exception')
+    return ''
+
+
+def normalize(traceback):
+    """Return the parts of the traceback identifying where it comes from.
+
+    That is the frames of the traceback and the name of the exception,
+    without the exception message or any memory addresses.
+    """
+    frames = [
+        ADDRESS_RE.sub('0x', line.strip())
+        for line in traceback.splitlines() if FRAME_RE.match(line)
+    ]
+    return '\n'.join(frames + [exception_name(traceback)])
+
+
+def fingerprint(traceback):
+    """Return the SHA1 hex digest of the normalized traceback."""
+    return hashlib.sha1(normalize(traceback).encode('utf-8')).hexdigest()
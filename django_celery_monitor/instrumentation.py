@@ -0,0 +1,267 @@
+"""Instrumentation of the phases of the camera."""
+from __future__ import absolute_import, unicode_literals
+
+import json
+import logging
+import sys
+import threading
+from collections import Counter
+
+from celery.five import monotonic
+from celery.utils.log import get_logger
+
+from .metrics import QueryCounter
+from .signals import phase_finished, phase_started
+
+PROFILER_INTERVAL = 0.005  # seconds between stack samples.
+PROFILER_DEPTH = 50  # number of frames kept per stack sample.
+
+logger = get_logger(__name__)
+
+
+def hooks_connected():
+    """Return whether any receivers of the phase signals are connected."""
+    return bool(phase_started.receivers or phase_finished.receivers)
+
+
+class Phase(object):
+    """Time a phase of the camera for its metrics and the phase signals.
+
+    Arguments:
+        camera (~.camera.Camera): The camera, sender of the signals.
+        name (str): The name of the phase, e.g. ``tasks``.
+        count (int): The number of handled tasks or workers, can be set
+            within the phase too, e.g. to the number of purged rows.
+        metrics (~.metrics.CameraMetrics): The metrics of the camera,
+            if enabled.
+        connection (~django.db.backends.base.base.BaseDatabaseWrapper):
+            The database connection to count the queries of, if any.
+    """
+
+    def __init__(self, camera, name, count=None, metrics=None,
+                 connection=None):
+        self.camera = camera
+        self.name = name
+        self.count = count
+        self.metrics = metrics
+        self.queries = None
+        if connection is not None:
+            self.queries = QueryCounter(connection)
+        self._start = None
+
+    def __enter__(self):
+        if phase_started.receivers:
+            phase_started.send(
+                sender=self.camera, phase=self.name, count=self.count,
+            )
+        if self.queries is not None:
+            self.queries.__enter__()
+        self._start = monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = monotonic() - self._start
+        queries = None
+        if self.queries is not None:
+            self.queries.__exit__(exc_type, exc_value, traceback)
+            queries = self.queries.count
+        if self.metrics is not None:
+            self.metrics.observe_phase(self.name, duration, queries)
+        if phase_finished.receivers:
+            phase_finished.send(
+                sender=self.camera, phase=self.name, count=self.count,
+                duration=duration, queries=queries, exception=exc_value,
+            )
+
+
+class NoPhase(object):
+    """Stand-in for :class:`Phase` without metrics and receivers."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    @property
+    def count(self):
+        return None
+
+    @count.setter
+    def count(self, value):
+        pass
+
+
+#: The phase used while nothing is instrumented.
+NO_PHASE = NoPhase()
+
+
+class Hooks(object):
+    """Base class of the receivers of the phase signals."""
+
+    def install(self):
+        """Connect to the phase signals."""
+        phase_started.connect(self.on_phase_started, weak=False)
+        phase_finished.connect(self.on_phase_finished, weak=False)
+        return self
+
+    def uninstall(self):
+        """Disconnect from the phase signals."""
+        phase_started.disconnect(self.on_phase_started)
+        phase_finished.disconnect(self.on_phase_finished)
+
+    def __enter__(self):
+        return self.install()
+
+    def __exit__(self, *exc_info):
+        self.uninstall()
+
+    def on_phase_started(self, sender, phase, count=None, **kwargs):
+        """Handle a starting phase of the camera ``sender``."""
+        pass
+
+    def on_phase_finished(self, sender, phase, count=None, duration=None,
+                          queries=None, exception=None, **kwargs):
+        """Handle a finished phase of the camera ``sender``."""
+        pass
+
+
+class PhaseLogger(Hooks):
+    """Log every finished phase as a line of JSON.
+
+    The fields are passed as the ``camera_phase`` attribute of the log
+    records too, for structured log handlers.
+
+    Arguments:
+        logger (logging.Logger): The logger, the one of this module
+            by default.
+        level (int): The level of the log records.
+    """
+
+    def __init__(self, logger=logger, level=logging.INFO):
+        self.logger = logger
+        self.level = level
+
+    def on_phase_finished(self, sender, phase, count=None, duration=None,
+                          queries=None, exception=None, **kwargs):
+        fields = {
+            'event': 'camera.phase',
+            'phase': phase,
+            'count': count,
+            'duration': duration,
+            'queries': queries,
+        }
+        if exception is not None:
+            fields['exception'] = repr(exception)
+        self.logger.log(
+            self.level, '%s', json.dumps(fields, sort_keys=True),
+            extra={'camera_phase': fields},
+        )
+
+
+class SamplingProfiler(Hooks):
+    """Sample the stacks of the threads running phases of the camera.
+
+    A background thread samples the stacks of the threads within a phase
+    every ``interval`` seconds and counts them per phase, so that
+    :meth:`functions` tells where the camera spends its time, e.g. in
+    looking up models or converting timestamps, without tracing every
+    call. Nested phases count for the innermost one.
+
+    Arguments:
+        interval (float): The number of seconds between samples.
+        depth (int): The maximum number of frames kept per sample.
+    """
+
+    def __init__(self, interval=PROFILER_INTERVAL, depth=PROFILER_DEPTH):
+        self.interval = interval
+        self.depth = depth
+        #: Mapping of ``(phase, stack)`` tuples to sample counts, with
+        #: the stacks as tuples of ``(filename, line, function)`` from
+        #: the innermost frame.
+        self.samples = Counter()
+        self._phases = {}
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def install(self):
+        """Connect to the phase signals and start sampling."""
+        super(SamplingProfiler, self).install()
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run, name='celery-monitor-profiler',
+        )
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def uninstall(self):
+        """Stop sampling and disconnect from the phase signals."""
+        super(SamplingProfiler, self).uninstall()
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def on_phase_started(self, sender, phase, count=None, **kwargs):
+        ident = threading.current_thread().ident
+        self._phases.setdefault(ident, []).append(phase)
+
+    def on_phase_finished(self, sender, phase, count=None, duration=None,
+                          queries=None, exception=None, **kwargs):
+        phases = self._phases.get(threading.current_thread().ident)
+        if phases:
+            phases.pop()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        """Take a sample of the stacks of the threads within a phase."""
+        frames = sys._current_frames()
+        for ident, phases in list(self._phases.items()):
+            frame = frames.get(ident)
+            if not phases or frame is None:
+                continue
+            stack = []
+            while frame is not None and len(stack) < self.depth:
+                code = frame.f_code
+                stack.append((code.co_filename, frame.f_lineno, code.co_name))
+                frame = frame.f_back
+            self.samples[(phases[-1], tuple(stack))] += 1
+
+    def functions(self, phase=None):
+        """Return the sample counts of the functions of a phase.
+
+        Returns a list of ``(function, own, total)`` tuples, with the
+        functions as ``filename:function`` strings, the samples in the
+        function itself and those in it or its callees. The functions
+        with the most own samples come first, since the callers shared
+        by every sample, like the main loop, have the most in total.
+        """
+        own, total = Counter(), Counter()
+        for (sample_phase, stack), count in list(self.samples.items()):
+            if phase is not None and sample_phase != phase:
+                continue
+            names = ['{0}:{1}'.format(filename, function)
+                     for filename, _, function in stack]
+            if names:
+                own[names[0]] += count
+            for name in set(names):
+                total[name] += count
+        return sorted(
+            ((name, own[name], count) for name, count in total.items()),
+            key=lambda function: (-function[1], -function[2], function[0]),
+        )
+
+    def report(self, phase=None, limit=20):
+        """Return a text table of the functions with the most samples."""
+        lines = ['{0:>8} {1:>8}  {2}'.format('own', 'total', 'function')]
+        lines.extend(
+            '{0:>8} {1:>8}  {2}'.format(own, total, name)
+            for name, own, total in self.functions(phase)[:limit]
+        )
+        return '\n'.join(lines)
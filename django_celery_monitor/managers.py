@@ -1,14 +1,108 @@
 """The model managers."""
 from __future__ import absolute_import, unicode_literals
+from collections import OrderedDict, defaultdict
 from datetime import timedelta
 
 from celery import states
 from celery.events.state import Task
+from celery.five import string_t
+from celery.utils.functional import chunks
 from celery.utils.time import maybe_timedelta
-from django.db import models, router, transaction
+from django.db import (
+    IntegrityError, connections, models, router, transaction,
+)
+from django.db.models import Case, F, Q, Value, When, sql
+from django.db.models.sql.constants import CURSOR
+from django.utils import timezone
 
+from .sketches import DDSketch
 from .utils import Now
 
+#: The fields not overwritten by events of a lower state precedence,
+#: see ``Task.merge_rules``, including the previews of the arguments.
+MERGE_FIELDS = frozenset(Task.merge_rules[states.RECEIVED]) | frozenset([
+    'args_preview', 'kwargs_preview', 'task_name_id',
+])
+
+#: The number of query parameters SQLite allows before 3.32.
+SQLITE_MAX_QUERY_PARAMS = 999
+
+
+def supports_upsert(connection):
+    """Return whether the database supports ``INSERT ... ON CONFLICT``."""
+    if connection.vendor == 'postgresql':
+        return connection.pg_version >= 90500
+    elif connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version_info >= (3, 24, 0)
+    return False
+
+
+def supports_returning(connection):
+    """Return whether the database supports ``INSERT ... RETURNING``."""
+    if connection.vendor == 'postgresql':
+        return True
+    elif connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version_info >= (3, 35, 0)
+    return False
+
+
+def max_query_params(connection):
+    """Return the number of parameters a query may have, if limited.
+
+    Django 1.x only knows the limit of SQLite when sizing batches,
+    999 before SQLite 3.32.
+    """
+    limit = getattr(connection.features, 'max_query_params', None)
+    if limit is None and connection.vendor == 'sqlite':
+        limit = SQLITE_MAX_QUERY_PARAMS
+    return limit
+
+
+def states_lookup(names):
+    """Return the lookups filtering task states by the given states.
+
+    Filters by the indexed state rank, and only by the state names
+    too if some share a rank, like states unknown to Celery.
+    """
+    names = list(names)
+    lookup = {'state_rank__in': sorted(set(
+        states.precedence(name) for name in names
+    ))}
+    if any(name not in states.PRECEDENCE for name in names):
+        lookup['state__in'] = names
+    return lookup
+
+
+#: The fields of the task rollups added up when updating them.
+ROLLUP_FIELDS = (
+    'count', 'runtime_sum', 'runtime_min', 'runtime_max',
+    'queue_wait_sum', 'queue_wait_min', 'queue_wait_max',
+)
+
+#: The SQL merging the rollup fields by their suffix in upserts.
+ROLLUP_SQL = {
+    'count': '{table}.{column} + excluded.{column}',
+    'sum': '{table}.{column} + excluded.{column}',
+    'min': (
+        'CASE WHEN {table}.{column} IS NULL OR '
+        'excluded.{column} < {table}.{column} '
+        'THEN excluded.{column} ELSE {table}.{column} END'
+    ),
+    'max': (
+        'CASE WHEN {table}.{column} IS NULL OR '
+        'excluded.{column} > {table}.{column} '
+        'THEN excluded.{column} ELSE {table}.{column} END'
+    ),
+}
+
+#: The functions merging the rollup fields by their suffix otherwise.
+ROLLUP_FUNCTIONS = {'count': sum, 'sum': sum, 'min': min, 'max': max}
+
+
+def _bound(function, *values):
+    values = [value for value in values if value is not None]
+    return function(values) if values else None
+
 
 class ExtendedQuerySet(models.QuerySet):
     """A custom model queryset that implements a few helpful methods."""
@@ -40,6 +134,168 @@ class ExtendedQuerySet(models.QuerySet):
             obj.save(using=self.db)
         return obj, False
 
+    def bulk_upsert(self, objs, unique_field, fields, batch_size=None,
+                    update_sql=None, update_params=None, returning=None):
+        """Insert the given objects, updating rows that already exist.
+
+        Uses multi-row ``INSERT ... ON CONFLICT (unique_field) DO UPDATE``
+        statements that set the given fields to the inserted values,
+        or to the SQL expressions in ``update_sql`` (a mapping of field
+        names to templates with ``{table}`` and ``{column}``
+        placeholders, and the query parameters of their ``%s``
+        placeholders in ``update_params``). ``unique_field`` may be a
+        sequence of fields for composite unique constraints. Only works
+        if :func:`supports_upsert` is true for the database.
+        Returns the number of written rows, or the values of the
+        ``returning`` field of the written rows if given, tuples of
+        values for a sequence of fields, which needs
+        :func:`supports_returning`.
+        """
+        objs = list(objs)
+        if not objs:
+            return [] if returning else 0
+        opts = self.model._meta
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+        table = qn(opts.db_table)
+        update_sql = update_sql or {}
+        update_params = update_params or {}
+        unique_fields = unique_field
+        if isinstance(unique_field, string_t):
+            unique_fields = [unique_field]
+        columns = [
+            field for field in opts.concrete_fields if not field.primary_key
+        ]
+        assignments, assignment_params = [], []
+        for name in fields:
+            column = qn(opts.get_field(name).column)
+            assignments.append('{0} = {1}'.format(column, update_sql.get(
+                name, 'excluded.{column}',
+            ).format(table=table, column=column)))
+            assignment_params.extend(update_params.get(name, ()))
+        max_batch_size = connection.ops.bulk_batch_size(columns, objs)
+        limit = max_query_params(connection)
+        if limit is not None:
+            # the parameters of the assignments count against it too.
+            max_batch_size = min(max_batch_size, max(
+                (limit - len(assignment_params)) // len(columns), 1,
+            ))
+        batch_size = min(batch_size or max_batch_size, max_batch_size)
+        row = '({0})'.format(', '.join(['%s'] * len(columns)))
+        suffix = ''
+        if returning:
+            names = returning
+            if isinstance(returning, string_t):
+                names = [returning]
+            suffix = ' RETURNING {0}'.format(', '.join(
+                qn((opts.pk if name == 'pk' else opts.get_field(name)).column)
+                for name in names
+            ))
+        written, values = 0, []
+        with connection.cursor() as cursor:
+            for batch in chunks(iter(objs), batch_size):
+                params = [
+                    field.get_db_prep_save(
+                        field.pre_save(obj, True), connection,
+                    )
+                    for obj in batch for field in columns
+                ] + assignment_params
+                cursor.execute(
+                    'INSERT INTO {0} ({1}) VALUES {2} '
+                    'ON CONFLICT ({3}) DO UPDATE SET {4}{5}'.format(
+                        table,
+                        ', '.join(qn(field.column) for field in columns),
+                        ', '.join([row] * len(batch)),
+                        ', '.join(qn(opts.get_field(name).column)
+                                  for name in unique_fields),
+                        ', '.join(assignments),
+                        suffix,
+                    ),
+                    params,
+                )
+                if isinstance(returning, string_t):
+                    values.extend(result[0] for result in cursor.fetchall())
+                elif returning:
+                    values.extend(map(tuple, cursor.fetchall()))
+                else:
+                    written += cursor.rowcount
+        return values if returning else written
+
+    def accumulate(self, objs, unique_field):
+        """Insert the given objects, adding them up with existing rows.
+
+        For models counting occurrences of something in ``count``
+        between ``first_seen`` and ``last_seen`` fields. The counts are
+        added to the stored ones and the seen timestamps widened, with
+        a single upsert where the database supports it.
+        Returns the number of written rows.
+        """
+        objs = list(objs)
+        if not objs:
+            return 0
+        fields = ['count', 'first_seen', 'last_seen']
+        db = self._db or router.db_for_write(self.model)
+        qs = self.using(db)
+        with transaction.atomic(using=db):
+            if supports_upsert(connections[db]):
+                return qs.bulk_upsert(objs, unique_field, fields, update_sql={
+                    'count': '{table}.{column} + excluded.{column}',
+                    'first_seen': (
+                        'CASE WHEN excluded.{column} < {table}.{column} '
+                        'THEN excluded.{column} ELSE {table}.{column} END'
+                    ),
+                    'last_seen': (
+                        'CASE WHEN excluded.{column} > {table}.{column} '
+                        'THEN excluded.{column} ELSE {table}.{column} END'
+                    ),
+                })
+            new = dict((getattr(obj, unique_field), obj) for obj in objs)
+            existing = qs.select_for_update().filter(**{
+                unique_field + '__in': list(new),
+            })
+            updated = []
+            for obj in existing:
+                seen = new.pop(getattr(obj, unique_field))
+                obj.count += seen.count
+                obj.first_seen = min(obj.first_seen, seen.first_seen)
+                obj.last_seen = max(obj.last_seen, seen.last_seen)
+                updated.append(obj)
+            qs.bulk_update(updated, fields)
+            qs.bulk_create(new.values())
+        return len(updated) + len(new)
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        """Update the given fields of the given objects in few queries.
+
+        This is a backport from Django 2.2
+        (https://code.djangoproject.com/ticket/23646) using a
+        ``CASE`` expression per field for every batch of objects.
+        """
+        objs = list(objs)
+        if not objs or not fields:
+            return 0
+        fields = [self.model._meta.get_field(name) for name in fields]
+        connection = connections[self.db]
+        max_batch_size = connection.ops.bulk_batch_size(
+            ['pk', 'pk'] + fields, objs,
+        )
+        batch_size = min(batch_size or max_batch_size, max_batch_size)
+        updated = 0
+        with transaction.atomic(using=self.db, savepoint=False):
+            for batch in chunks(iter(objs), batch_size):
+                updates = {
+                    field.name: Case(*[
+                        When(pk=obj.pk, then=Value(
+                            getattr(obj, field.attname), output_field=field,
+                        )) for obj in batch
+                    ], output_field=field)
+                    for field in fields
+                }
+                updated += self.filter(
+                    pk__in=[obj.pk for obj in batch],
+                ).update(**updates)
+        return updated
+
 
 class WorkerStateQuerySet(ExtendedQuerySet):
     """A custom model queryset for the WorkerState model with some helpers."""
@@ -63,6 +319,301 @@ class WorkerStateQuerySet(ExtendedQuerySet):
                 )
         return obj
 
+    def update_heartbeats(self, heartbeats, update_freq=None):
+        """Update the heartbeats of many workers at once.
+
+        Takes a mapping of hostnames to heartbeats, e.g. of all the
+        workers of a ``state.workers`` snapshot, and writes them with a
+        single upsert returning the primary keys where the database
+        supports it. With ``update_freq`` only the workers last updated
+        more than that many seconds ago, or that went online or offline,
+        are written.
+        Returns a mapping of the hostnames to the worker primary keys.
+        """
+        if not heartbeats:
+            return {}
+        db = router.db_for_write(self.model)
+        connection = connections[db]
+        qs = self.using(db)
+        fields = ['last_heartbeat', 'last_update']
+        cutoff = None
+        if update_freq is not None:
+            cutoff = timezone.now() - timedelta(seconds=update_freq)
+        with transaction.atomic(using=db):
+            if supports_upsert(connection):
+                update_sql, update_params = {}, {}
+                if cutoff is not None:
+                    qn = connection.ops.quote_name
+                    stale = (
+                        '{{table}}.{0} < %s OR ({{table}}.{1} IS NULL) <> '
+                        '(excluded.{1} IS NULL)'.format(
+                            qn('last_update'), qn('last_heartbeat'),
+                        )
+                    )
+                    cutoff_param = self.model._meta.get_field(
+                        'last_update',
+                    ).get_db_prep_value(cutoff, connection)
+                    for name in fields:
+                        update_sql[name] = (
+                            'CASE WHEN {0} THEN excluded.{{column}} '
+                            'ELSE {{table}}.{{column}} END'.format(stale)
+                        )
+                        update_params[name] = [cutoff_param]
+                returning = supports_returning(connection)
+                rows = qs.bulk_upsert(
+                    [self.model(hostname=hostname, last_heartbeat=heartbeat)
+                     for hostname, heartbeat in heartbeats.items()],
+                    'hostname', fields,
+                    update_sql=update_sql, update_params=update_params,
+                    returning=('hostname', 'pk') if returning else None,
+                )
+                if returning:
+                    return dict(rows)
+            else:
+                existing = qs.select_for_update().filter(
+                    hostname__in=list(heartbeats),
+                )
+                updated, seen = [], set()
+                for obj in existing:
+                    seen.add(obj.hostname)
+                    heartbeat = heartbeats[obj.hostname]
+                    went_offline = (
+                        (heartbeat is None) != (obj.last_heartbeat is None)
+                    )
+                    if cutoff is None or went_offline or (
+                            obj.last_update < cutoff):
+                        obj.last_heartbeat = heartbeat
+                        obj.last_update = timezone.now()
+                        updated.append(obj)
+                qs.bulk_update(updated, fields)
+                qs.bulk_create([
+                    self.model(hostname=hostname, last_heartbeat=heartbeat)
+                    for hostname, heartbeat in heartbeats.items()
+                    if hostname not in seen
+                ])
+            return dict(qs.filter(
+                hostname__in=list(heartbeats),
+            ).values_list('hostname', 'pk'))
+
+    def worker_ids(self, hostnames):
+        """Return a mapping of the hostnames to the worker primary keys.
+
+        Adds the workers missing from the database without a heartbeat,
+        without writing the existing ones.
+        """
+        hostnames = set(hostnames)
+        if not hostnames:
+            return {}
+        db = router.db_for_write(self.model)
+        qs = self.using(db)
+        ids = dict(qs.filter(
+            hostname__in=list(hostnames),
+        ).values_list('hostname', 'pk'))
+        for hostname in hostnames.difference(ids):
+            ids[hostname] = qs.get_or_create(hostname=hostname)[0].pk
+        return ids
+
+
+class TaskNameQuerySet(ExtendedQuerySet):
+    """A custom model queryset for the TaskName model with some helpers."""
+
+    def update_names(self, names):
+        """Add the given task names to the catalog.
+
+        Takes a mapping of task names to ``(count, first_seen, last_seen)``
+        tuples, see :meth:`~ExtendedQuerySet.accumulate`.
+        Returns the number of written rows.
+        """
+        return self.accumulate([
+            self.model(name=name, count=count,
+                       first_seen=first_seen, last_seen=last_seen)
+            for name, (count, first_seen, last_seen) in names.items()
+        ], 'name')
+
+
+class ExceptionGroupQuerySet(ExtendedQuerySet):
+    """A custom model queryset for the ExceptionGroup model."""
+
+    def update_groups(self, groups):
+        """Add the given exception occurrences to their groups.
+
+        Takes a mapping of fingerprints to ``(exception, traceback,
+        count, first_seen, last_seen)`` tuples, see
+        :meth:`~ExtendedQuerySet.accumulate`. The exception and traceback
+        of existing groups are kept. Returns a mapping of the
+        fingerprints to the group primary keys.
+        """
+        if not groups:
+            return {}
+        db = router.db_for_write(self.model)
+        self.using(db).accumulate([
+            self.model(fingerprint=fingerprint, exception=exception,
+                       traceback=traceback, count=count,
+                       first_seen=first_seen, last_seen=last_seen)
+            for fingerprint, (exception, traceback, count, first_seen,
+                              last_seen) in groups.items()
+        ], 'fingerprint')
+        return dict(self.using(db).filter(
+            fingerprint__in=list(groups),
+        ).values_list('fingerprint', 'pk'))
+
+
+class TaskRollupQuerySet(ExtendedQuerySet):
+    """A custom model queryset for the TaskRollup model with some helpers."""
+
+    def update_rollups(self, rollups):
+        """Add the given task counts, runtimes and queue waits to the rollups.
+
+        Takes a mapping of ``(name, state, minute)`` tuples to ``(count,
+        runtime_sum, runtime_min, runtime_max, queue_wait_sum,
+        queue_wait_min, queue_wait_max)`` tuples. The counts and sums
+        are added to the stored ones and the bounds widened, with a
+        single upsert where the database supports it.
+        Returns the number of written rows.
+        """
+        if not rollups:
+            return 0
+        fields = ROLLUP_FIELDS
+        objs = [
+            self.model(name=name, state=state, minute=minute,
+                       **dict(zip(fields, values)))
+            for (name, state, minute), values in rollups.items()
+        ]
+        db = router.db_for_write(self.model)
+        qs = self.using(db)
+        with transaction.atomic(using=db):
+            if supports_upsert(connections[db]):
+                return qs.bulk_upsert(
+                    objs, ('name', 'state', 'minute'), fields, update_sql=dict(
+                        (name, ROLLUP_SQL[name.rpartition('_')[2]])
+                        for name in fields
+                    ),
+                )
+            new = dict(
+                ((obj.name, obj.state, obj.minute), obj) for obj in objs
+            )
+            existing = qs.select_for_update().filter(
+                name__in=set(obj.name for obj in objs),
+                minute__in=set(obj.minute for obj in objs),
+            )
+            updated = []
+            for obj in existing:
+                seen = new.pop((obj.name, obj.state, obj.minute), None)
+                if seen is None:
+                    continue
+                for name in fields:
+                    function = ROLLUP_FUNCTIONS[name.rpartition('_')[2]]
+                    setattr(obj, name, _bound(
+                        function, getattr(obj, name), getattr(seen, name),
+                    ))
+                updated.append(obj)
+            qs.bulk_update(updated, fields)
+            qs.bulk_create(new.values())
+        return len(updated) + len(new)
+
+    def between(self, start=None, end=None):
+        """Filter the rollups of the minutes from ``start`` until ``end``."""
+        qs = self
+        if start is not None:
+            qs = qs.filter(minute__gte=start)
+        if end is not None:
+            qs = qs.filter(minute__lt=end)
+        return qs
+
+    def totals(self, *fields):
+        """Return the counts and runtimes summed up by the given fields.
+
+        E.g. ``totals('name', 'state')`` for the number of ``tasks``
+        per name and state, with their ``total_runtime``,
+        ``min_runtime`` and ``max_runtime``, and likewise their
+        ``total_queue_wait``, ``min_queue_wait`` and ``max_queue_wait``.
+        """
+        return self.order_by().values(*fields).annotate(
+            tasks=models.Sum('count'),
+            total_runtime=models.Sum('runtime_sum'),
+            min_runtime=models.Min('runtime_min'),
+            max_runtime=models.Max('runtime_max'),
+            total_queue_wait=models.Sum('queue_wait_sum'),
+            min_queue_wait=models.Min('queue_wait_min'),
+            max_queue_wait=models.Max('queue_wait_max'),
+        ).order_by(*fields)
+
+
+class RuntimeSketchQuerySet(ExtendedQuerySet):
+    """A custom model queryset for the RuntimeSketch model."""
+
+    def update_sketches(self, sketches):
+        """Merge the given runtime sketches into the stored ones.
+
+        Takes a mapping of ``(name, window)`` tuples to
+        :class:`~django_celery_monitor.sketches.DDSketch` instances.
+        Returns the number of written rows.
+        """
+        if not sketches:
+            return 0
+        db = router.db_for_write(self.model)
+        try:
+            with transaction.atomic(using=db):
+                return self.using(db)._merge_sketches(sketches)
+        except IntegrityError:
+            # another camera added one of the windows in the meantime.
+            with transaction.atomic(using=db):
+                return self.using(db)._merge_sketches(sketches)
+
+    def _merge_sketches(self, sketches):
+        new = dict(sketches)
+        existing = self.select_for_update().filter(
+            name__in=set(name for name, _ in new),
+            window__in=set(window for _, window in new),
+        )
+        updated = []
+        for obj in existing:
+            sketch = new.pop((obj.name, obj.window), None)
+            if sketch is not None:
+                obj.set_sketch(obj.get_sketch().merge(sketch))
+                updated.append(obj)
+        self.bulk_update(updated, ['count', 'sketch'])
+        created = []
+        for (name, window), sketch in new.items():
+            obj = self.model(name=name, window=window)
+            obj.set_sketch(sketch)
+            created.append(obj)
+        self.bulk_create(created)
+        return len(updated) + len(created)
+
+    def between(self, start=None, end=None):
+        """Filter the sketches of the windows from ``start`` until ``end``."""
+        qs = self
+        if start is not None:
+            qs = qs.filter(window__gte=start)
+        if end is not None:
+            qs = qs.filter(window__lt=end)
+        return qs
+
+    def merged(self):
+        """Return the sketches merged into one, or :const:`None`."""
+        merged = None
+        for value in self.values_list('sketch', flat=True).iterator():
+            sketch = DDSketch.from_json(value)
+            merged = sketch if merged is None else merged.merge(sketch)
+        return merged
+
+    def quantiles(self, quantiles=(0.5, 0.95, 0.99)):
+        """Return a mapping of the given quantiles to runtimes.
+
+        Merges the sketches, e.g. of a task name and a time range::
+
+            RuntimeSketch.objects.filter(name='proj.add').between(
+                start, end).quantiles([0.5, 0.99])
+
+        The runtimes are :const:`None` without any sketches.
+        """
+        merged = self.merged()
+        return dict(
+            (q, merged.quantile(q) if merged is not None else None)
+            for q in quantiles
+        )
+
 
 class TaskStateQuerySet(ExtendedQuerySet):
     """A custom model queryset for the TaskState model with some helpers."""
@@ -71,11 +622,41 @@ class TaskStateQuerySet(ExtendedQuerySet):
         """Return all active task states."""
         return self.filter(hidden=False)
 
+    def update(self, **kwargs):
+        """Update the task states, ranking a new state too.
+
+        The state rank is only computed when saving the model, so it's
+        passed along here, or the rows would keep the rank of their old
+        state.
+        """
+        if 'state' in kwargs and 'state_rank' not in kwargs:
+            if hasattr(kwargs['state'], 'resolve_expression'):
+                raise ValueError(
+                    'Pass the state_rank when updating the state with '
+                    'an expression.'
+                )
+            kwargs['state_rank'] = states.precedence(kwargs['state'])
+        return super(TaskStateQuerySet, self).update(**kwargs)
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        """Update the given fields of the given task states.
+
+        Like :meth:`update`, updating the state updates the state rank.
+        """
+        objs, fields = list(objs), list(fields)
+        if 'state' in fields and 'state_rank' not in fields:
+            for obj in objs:
+                obj.state_rank = states.precedence(obj.state)
+            fields.append('state_rank')
+        return super(TaskStateQuerySet, self).bulk_update(
+            objs, fields, batch_size=batch_size,
+        )
+
     def expired(self, states, expires):
         """Return all expired task states."""
         return self.filter(
-            state__in=states,
             tstamp__lte=Now() - maybe_timedelta(expires),
+            **states_lookup(states)
         )
 
     def expire_by_states(self, states, expires):
@@ -90,21 +671,165 @@ class TaskStateQuerySet(ExtendedQuerySet):
                 router.db_for_write(self.model)
             ).filter(hidden=True).delete()
 
-    def update_state(self, state, task_id, defaults):
-        with transaction.atomic():
-            obj, created = self.select_for_update_or_create(
-                task_id=task_id,
-                defaults=defaults,
+    def delete_chunk(self, chunk_size):
+        """Delete up to ``chunk_size`` task states.
+
+        Uses a single set-based ``DELETE`` of the ids selected by a
+        subquery with a ``LIMIT`` but no ``ORDER BY``, so the ids are
+        read from the index of the filter as they come instead of
+        sorting all matching rows for every chunk, and without loading
+        the rows into memory like
+        :meth:`~django.db.models.query.QuerySet.delete` does. Databases
+        without sliced subqueries, like MySQL, select the ids first.
+        Returns the number of deleted rows.
+        """
+        db = router.db_for_write(self.model)
+        pks = self.using(db).order_by().values('pk')[:chunk_size]
+        if not connections[db].features.allow_sliced_subqueries:
+            pks = [row['pk'] for row in pks]
+        qs = self.model._base_manager.using(db).filter(pk__in=pks)
+        with transaction.atomic(using=db):
+            return qs._raw_delete(db)
+
+    def update_state(self, state, task_id, defaults, upsert=True):
+        """Insert or update the state of a task without locking its row.
+
+        Fields in :data:`MERGE_FIELDS` are not overwritten when the new
+        state has a lower precedence than the stored one, which is
+        decided by the database comparing the stored ``state_rank``.
+        Uses a single ``INSERT ... ON CONFLICT`` statement where the
+        database supports it and ``upsert`` is true, and a conditional
+        ``UPDATE``, followed by an ``INSERT`` for new tasks, otherwise.
+        Returns the task state with the given values.
+        """
+        defaults = dict(defaults, state_rank=states.precedence(state))
+        obj = self.model(task_id=task_id, **defaults)
+        db = router.db_for_write(self.model)
+        connection = connections[db]
+        qs = self.using(db)
+        with transaction.atomic(using=db):
+            if upsert and supports_upsert(connection):
+                pks = qs._upsert_states(
+                    connection, sorted(defaults), {task_id: defaults}, None,
+                    returning=supports_returning(connection),
+                )
+                if pks:
+                    obj.pk = pks[0]
+                    return obj
+            elif not qs._merge_state(task_id, defaults):
+                try:
+                    with transaction.atomic(using=db):
+                        obj.save(force_insert=True, using=db)
+                        return obj
+                except IntegrityError:
+                    # inserted by another camera in the meantime.
+                    qs._merge_state(task_id, defaults)
+        obj.pk = qs.filter(task_id=task_id).values_list('pk', flat=True)[0]
+        return obj
+
+    def _merge_state(self, task_id, defaults):
+        opts = self.model._meta
+        keep = Q(state_rank__lt=defaults['state_rank'])
+        values = []
+        # MySQL evaluates the assignments from left to right, so the
+        # merge fields are set before the state rank they depend on.
+        for name in sorted(defaults, key=lambda name: (
+                name not in MERGE_FIELDS, name == 'state_rank', name)):
+            field = opts.get_field(name)
+            value = defaults[name]
+            if name in MERGE_FIELDS:
+                value = Case(
+                    When(keep, then=F(field.attname)),
+                    default=Value(value, output_field=field),
+                    output_field=field,
+                )
+            values.append((field, None, value))
+        query = self.filter(task_id=task_id).query.clone(sql.UpdateQuery)
+        query.add_update_fields(values)
+        return query.get_compiler(self.db).execute_sql(CURSOR)
+
+    def bulk_update_state(self, tasks, batch_size=None, upsert=True):
+        """Insert or update the states of many tasks at once.
+
+        Takes an iterable of ``(task_id, defaults)`` tuples, with the
+        task state in ``defaults['state']``. Fields listed in
+        ``Task.merge_rules[RECEIVED]`` are not overwritten when the new
+        state has a lower precedence than the stored one, just like in
+        :meth:`update_state`.
+
+        Uses multi-row ``INSERT ... ON CONFLICT`` statements where the
+        database supports them and ``upsert`` is true, and chunks of
+        ``bulk_create`` and ``bulk_update`` otherwise, e.g. for tables
+        without a unique ``task_id`` index like partitioned ones.
+        Returns the number of written rows.
+        """
+        # Group the tasks by the fields to write since fields missing
+        # from the defaults must not be overwritten.
+        groups = defaultdict(OrderedDict)
+        for task_id, defaults in tasks:
+            defaults = dict(
+                defaults, state_rank=states.precedence(defaults['state']),
             )
-            if created:
-                return obj
+            groups[frozenset(defaults)][task_id] = defaults
+        if not groups:
+            return 0
+        db = router.db_for_write(self.model)
+        connection = connections[db]
+        if upsert and supports_upsert(connection):
+            bulk_write = self._upsert_states
+        else:
+            bulk_write = self._create_or_update_states
+        written = 0
+        with transaction.atomic(using=db):
+            for fields, group in groups.items():
+                written += bulk_write(
+                    connection, sorted(fields), group, batch_size,
+                )
+        return written
 
-            if states.state(state) < states.state(obj.state):
-                keep = Task.merge_rules[states.RECEIVED]
-            else:
-                keep = {}
-            for key, value in defaults.items():
-                if key not in keep:
-                    setattr(obj, key, value)
-            obj.save(update_fields=tuple(defaults.keys()))
-            return obj
+    def _upsert_states(self, connection, fields, tasks, batch_size,
+                       returning=False):
+        keep = MERGE_FIELDS
+        is_lower = 'excluded.{column} > {{table}}.{column}'.format(
+            column=connection.ops.quote_name('state_rank'),
+        )
+        return self.using(connection.alias).bulk_upsert(
+            [self.model(task_id=task_id, **defaults)
+             for task_id, defaults in tasks.items()],
+            'task_id', fields, batch_size=batch_size,
+            returning='pk' if returning else None,
+            update_sql={
+                name: 'CASE WHEN {0} THEN {{table}}.{{column}} '
+                      'ELSE excluded.{{column}} END'.format(is_lower)
+                for name in fields if name in keep
+            },
+        )
+
+    def _create_or_update_states(self, connection, fields, tasks, batch_size):
+        keep = MERGE_FIELDS
+        qs = self.using(connection.alias)
+        written = 0
+        for batch in chunks(iter(tasks.items()), batch_size or 1000):
+            existing = {
+                obj.task_id: obj for obj in qs.select_for_update().filter(
+                    task_id__in=[task_id for task_id, _ in batch],
+                )
+            }
+            created, changed = [], defaultdict(list)
+            for task_id, defaults in batch:
+                obj = existing.get(task_id)
+                if obj is None:
+                    created.append(self.model(task_id=task_id, **defaults))
+                    continue
+                if states.state(defaults['state']) < states.state(obj.state):
+                    names = tuple(name for name in fields if name not in keep)
+                else:
+                    names = tuple(fields)
+                for name in names:
+                    setattr(obj, name, defaults[name])
+                changed[names].append(obj)
+            qs.bulk_create(created)
+            written += len(created)
+            for names, objs in changed.items():
+                written += qs.bulk_update(objs, names)
+        return written
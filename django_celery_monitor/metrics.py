@@ -0,0 +1,434 @@
+"""Prometheus metrics of the camera, kept in memory."""
+from __future__ import absolute_import, unicode_literals
+
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+
+from celery.utils.log import get_logger
+from django.db import connections
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:  # pragma: no cover
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+#: The content type of the Prometheus text exposition format.
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+#: The default upper bounds of the histogram buckets in seconds.
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+INF = float('inf')
+
+logger = get_logger(__name__)
+debug = logger.debug
+
+
+def format_value(value):
+    """Return a sample value in the exposition format."""
+    if value == INF:
+        return '+Inf'
+    elif value == -INF:
+        return '-Inf'
+    elif value != value:
+        return 'NaN'
+    return repr(float(value))
+
+
+def format_labels(names, values):
+    """Return the label set of a sample, e.g. ``{state="SUCCESS"}``."""
+    if not names:
+        return ''
+    return '{{{0}}}'.format(','.join(
+        '{0}="{1}"'.format(name, '{0}'.format(value).replace(
+            '\\', '\\\\').replace('\n', '\\n').replace('"', '\\"'))
+        for name, value in zip(names, values)
+    ))
+
+
+class Metric(object):
+    """A metric with a value per combination of label values.
+
+    Arguments:
+        name (str): The name of the metric.
+        documentation (str): The help text of the metric.
+        labelnames (Sequence[str]): The names of the labels.
+        function (Callable): Optionally called when collecting the
+            samples instead of keeping them, returning a value or a
+            mapping of label value tuples to values. For values read
+            from elsewhere, like queue sizes, without any upkeep.
+    """
+
+    #: The Prometheus type of the metric.
+    type = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def values(self):
+        """Return a mapping of label value tuples to the values."""
+        if self.function is None:
+            with self._lock:
+                return dict(self._values)
+        values = self.function()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return values
+
+    def samples(self):
+        """Yield the ``(name, labels, value)`` tuples of the samples."""
+        for labels, value in sorted(self.values().items()):
+            yield self.name, format_labels(self.labelnames, labels), value
+
+    def render(self):
+        """Return the metric in the exposition format."""
+        lines = [
+            '# HELP {0} {1}'.format(self.name, self.documentation),
+            '# TYPE {0} {1}'.format(self.name, self.type),
+        ]
+        lines.extend(
+            '{0}{1} {2}'.format(name, labels, format_value(value))
+            for name, labels, value in self.samples()
+        )
+        return '\n'.join(lines) + '\n'
+
+
+class Counter(Metric):
+    """A metric that only goes up, e.g. the number of written tasks."""
+
+    type = 'counter'
+
+    def inc(self, amount=1, labels=()):
+        """Add to the value of the given label values."""
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """A metric that goes up and down, e.g. the depth of a queue."""
+
+    type = 'gauge'
+
+    def set(self, value, labels=()):
+        """Set the value of the given label values."""
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    """A metric counting observations in buckets, e.g. durations.
+
+    Arguments:
+        buckets (Sequence[float]): The upper bounds of the buckets,
+            the ``+Inf`` bucket is added.
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (INF,)
+
+    def observe(self, value, labels=()):
+        """Count a value in the bucket it falls in."""
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * len(self.buckets)
+                counts.append(0.0)
+            counts[index] += 1
+            counts[-1] += value
+
+    def values(self):
+        with self._lock:
+            return dict(
+                (labels, list(counts))
+                for labels, counts in self._values.items()
+            )
+
+    def samples(self):
+        labelnames = self.labelnames + ('le',)
+        for labels, counts in sorted(self.values().items()):
+            total = 0
+            for bound, count in zip(self.buckets, counts):
+                total += count
+                yield (self.name + '_bucket', format_labels(
+                    labelnames, labels + (format_value(bound),),
+                ), total)
+            labels = format_labels(self.labelnames, labels)
+            yield self.name + '_sum', labels, counts[-1]
+            yield self.name + '_count', labels, total
+
+
+class Registry(object):
+    """The metrics exposed together, by name."""
+
+    def __init__(self):
+        self.metrics = OrderedDict()
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """Add a metric, replacing the one of the same name if any.
+
+        So that a new camera takes over the metrics of the process.
+        """
+        with self._lock:
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, *args, **kwargs):
+        """Register and return a new :class:`Counter`."""
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs):
+        """Register and return a new :class:`Gauge`."""
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        """Register and return a new :class:`Histogram`."""
+        return self.register(Histogram(*args, **kwargs))
+
+    def render(self):
+        """Return all metrics in the exposition format."""
+        with self._lock:
+            metrics = list(self.metrics.values())
+        return ''.join(metric.render() for metric in metrics)
+
+
+#: The registry of the metrics of the cameras of the process.
+REGISTRY = Registry()
+
+
+class CountingCursor(object):
+    """A cursor wrapper counting the queries run with it."""
+
+    def __init__(self, cursor, counter):
+        self.cursor = cursor
+        self.counter = counter
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return self.cursor.__exit__(*exc_info)
+
+    def callproc(self, *args, **kwargs):
+        self.counter.count += 1
+        return self.cursor.callproc(*args, **kwargs)
+
+    def execute(self, *args, **kwargs):
+        self.counter.count += 1
+        return self.cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self.counter.count += 1
+        return self.cursor.executemany(*args, **kwargs)
+
+
+class QueryCounter(object):
+    """Count the queries run on a database connection in a block.
+
+    Uses the execution wrappers of the connection where Django has them,
+    and wraps the cursors made by the connection in the block with
+    :class:`CountingCursor` otherwise.
+    """
+
+    #: The methods of the connection wrapping new cursors.
+    cursor_factories = ('make_cursor', 'make_debug_cursor')
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.count = 0
+        self._wrapper = self._connection = None
+        self._factories = {}
+
+    def __enter__(self):
+        connection = self.connection
+        self.count = 0
+        if hasattr(connection, 'execute_wrapper'):
+            self._wrapper = connection.execute_wrapper(self._execute)
+            self._wrapper.__enter__()
+            return self
+        # the connection itself, not a proxy like django.db.connection.
+        self._connection = connection = connections[connection.alias]
+        for name in self.cursor_factories:
+            # the factories of enclosing counters are set on the instance.
+            self._factories[name] = connection.__dict__.get(name)
+            setattr(connection, name,
+                    self._counting(getattr(connection, name)))
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._wrapper is not None:
+            self._wrapper.__exit__(*exc_info)
+            self._wrapper = None
+            return
+        connection, self._connection = self._connection, None
+        for name, factory in self._factories.items():
+            if factory is None:
+                delattr(connection, name)
+            else:
+                setattr(connection, name, factory)
+        self._factories.clear()
+
+    def _counting(self, make_cursor):
+        def make_counting_cursor(cursor):
+            return CountingCursor(make_cursor(cursor), self)
+        return make_counting_cursor
+
+    def _execute(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class CameraMetrics(object):
+    """The metrics of a camera.
+
+    Counted as the camera goes, but for the values read from the camera
+    when collected, like the depths of the writer queues.
+
+    Arguments:
+        camera (~.camera.Camera): The camera.
+        registry (Registry): The registry to add the metrics to.
+    """
+
+    def __init__(self, camera, registry=REGISTRY):
+        self.camera = camera
+        self.registry = registry
+        self.shutter_duration = registry.histogram(
+            'celery_monitor_shutter_duration_seconds',
+            'Time taken by the snapshots of the camera.',
+        )
+        self.phase_duration = registry.histogram(
+            'celery_monitor_phase_duration_seconds',
+            'Time taken writing workers and tasks, and cleaning up.',
+            ['phase'],
+        )
+        self.queries = registry.counter(
+            'celery_monitor_db_queries_total',
+            'Database queries run by the camera.', ['phase'],
+        )
+        self.tasks_written = registry.counter(
+            'celery_monitor_tasks_written_total',
+            'Task states written to the database.',
+        )
+        self.tasks_skipped = registry.counter(
+            'celery_monitor_tasks_skipped_total',
+            'Unchanged task states skipped by snapshots.',
+        )
+        self.tasks = registry.counter(
+            'celery_monitor_tasks_total',
+            'Tasks seen per name and state, once per state.',
+            ['name', 'state'],
+        )
+        self.writer_queue_depth = registry.gauge(
+            'celery_monitor_writer_queue_depth',
+            'Snapshots queued per writer thread.', ['shard'],
+            function=self.writer_queue_depths,
+        )
+        self.writer_dropped = registry.counter(
+            'celery_monitor_writer_dropped_total',
+            'Snapshots dropped because their writer queue was full.',
+            function=lambda: self.writers.dropped if self.writers else 0,
+        )
+        self.cleanup_rows = registry.counter(
+            'celery_monitor_cleanup_rows_total',
+            'Expired task states purged.',
+            function=lambda: self.camera.purger.deleted,
+        )
+
+    @property
+    def writers(self):
+        if self.camera.app.conf.monitors_writer_threads:
+            return self.camera.writers
+
+    def writer_queue_depths(self):
+        """Return the depths of the writer queues by shard."""
+        if not self.writers:
+            return {}
+        return dict(
+            (('{0}'.format(shard),), depth)
+            for shard, depth in enumerate(self.writers.depths())
+        )
+
+    def observe_phase(self, phase, duration, queries=None):
+        """Count a finished phase of the camera, with its queries if known."""
+        if phase == 'shutter':
+            self.shutter_duration.observe(duration)
+            return
+        labels = (phase,)
+        self.phase_duration.observe(duration, labels=labels)
+        if queries is not None:
+            self.queries.inc(queries, labels=labels)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serve the metrics of the registry of the server."""
+
+    def do_GET(self):
+        body = self.server.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', '{0}'.format(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        debug('Metrics: ' + format, *args)
+
+
+class MetricsServer(object):
+    """A lightweight HTTP listener serving the metrics in a thread.
+
+    Arguments:
+        registry (Registry): The registry of the served metrics.
+        port (int): The port to listen on, ``0`` for any free port.
+        addr (str): The address to listen on, all by default.
+    """
+
+    def __init__(self, registry=REGISTRY, port=0, addr=''):
+        self.registry = registry
+        self.port = port
+        self.addr = addr
+        self._server = self._thread = None
+
+    def start(self):
+        """Start listening, returns the bound ``(addr, port)`` tuple."""
+        self._server = HTTPServer((self.addr, self.port), MetricsHandler)
+        self._server.registry = self.registry
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name='celery-monitor-metrics',
+        )
+        self._thread.daemon = True
+        self._thread.start()
+        debug('Metrics: Listening on %s:%s.', *self.address)
+        return self.address
+
+    @property
+    def address(self):
+        """Return the bound ``(addr, port)`` tuple."""
+        return self._server.server_address[:2]
+
+    def stop(self):
+        """Stop listening."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = self._thread = None
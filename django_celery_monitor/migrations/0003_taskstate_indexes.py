@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from django.db import migrations, models
+
+ETA_INDEX_NAME = 'celery_mon_eta_partial_idx'
+
+
+def create_eta_index(apps, schema_editor):
+    # Partial indexes can't be declared in the model options before
+    # Django 2.2, so create it only on the backends supporting them.
+    # Later migrations rebuilding the table on SQLite restore it.
+    if schema_editor.connection.vendor not in ('postgresql', 'sqlite'):
+        return
+    TaskState = apps.get_model('celery_monitor', 'TaskState')
+    schema_editor.execute(
+        'CREATE INDEX {0} ON {1} ({2}) WHERE {2} IS NOT NULL'.format(
+            schema_editor.quote_name(ETA_INDEX_NAME),
+            schema_editor.quote_name(TaskState._meta.db_table),
+            schema_editor.quote_name('eta'),
+        )
+    )
+
+
+def drop_eta_index(apps, schema_editor):
+    if schema_editor.connection.vendor not in ('postgresql', 'sqlite'):
+        return
+    # Unapplying the later migrations rebuilding the table on SQLite
+    # dropped it already.
+    schema_editor.execute('DROP INDEX IF EXISTS {0}'.format(
+        schema_editor.quote_name(ETA_INDEX_NAME)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('celery_monitor', '0002_workerstate_last_update'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='taskstate',
+            name='hidden',
+            field=models.BooleanField(
+                default=False,
+                editable=False,
+            ),
+        ),
+        migrations.AlterField(
+            model_name='taskstate',
+            name='name',
+            field=models.CharField(
+                max_length=200,
+                null=True,
+                verbose_name='name',
+            ),
+        ),
+        migrations.AlterField(
+            model_name='taskstate',
+            name='state',
+            field=models.CharField(
+                choices=[('FAILURE', 'FAILURE'),
+                         ('PENDING', 'PENDING'),
+                         ('RECEIVED', 'RECEIVED'),
+                         ('RETRY', 'RETRY'),
+                         ('REVOKED', 'REVOKED'),
+                         ('STARTED', 'STARTED'),
+                         ('SUCCESS', 'SUCCESS')],
+                max_length=64,
+                verbose_name='state',
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='taskstate',
+            index=models.Index(
+                fields=['state', 'tstamp'],
+                name='celery_mon_state_tstamp_idx',
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='taskstate',
+            index=models.Index(
+                fields=['name', 'tstamp'],
+                name='celery_mon_name_tstamp_idx',
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='taskstate',
+            index=models.Index(
+                fields=['worker', 'tstamp'],
+                name='celery_mon_worker_tstamp_idx',
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='taskstate',
+            index=models.Index(
+                fields=['hidden', 'id'],
+                name='celery_mon_hidden_id_idx',
+            ),
+        ),
+        migrations.RunPython(create_eta_index, drop_eta_index),
+    ]
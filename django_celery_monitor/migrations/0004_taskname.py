@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from django.db import migrations, models
+
+
+def populate_task_names(apps, schema_editor):
+    # Fill the catalog from the task states stored so far.
+    TaskName = apps.get_model('celery_monitor', 'TaskName')
+    TaskState = apps.get_model('celery_monitor', 'TaskState')
+    db = schema_editor.connection.alias
+    names = (
+        TaskState.objects.using(db)
+        .order_by().values('name')
+        .annotate(count=models.Count('pk'),
+                  first_seen=models.Min('tstamp'),
+                  last_seen=models.Max('tstamp'))
+    )
+    TaskName.objects.using(db).bulk_create(
+        [TaskName(**name) for name in names if name['name']],
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('celery_monitor', '0003_taskstate_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskName',
+            fields=[
+                ('id', models.AutoField(
+                    auto_created=True,
+                    primary_key=True,
+                    serialize=False,
+                    verbose_name='ID',
+                )),
+                ('name', models.CharField(
+                    max_length=200,
+                    unique=True,
+                    verbose_name='name',
+                )),
+                ('first_seen', models.DateTimeField(
+                    verbose_name='first seen',
+                )),
+                ('last_seen', models.DateTimeField(
+                    verbose_name='last seen',
+                )),
+                ('count', models.PositiveIntegerField(
+                    default=0,
+                    verbose_name='count',
+                )),
+            ],
+            options={
+                'verbose_name': 'task name',
+                'verbose_name_plural': 'task names',
+                'ordering': ['name'],
+                'get_latest_by': 'last_seen',
+            },
+        ),
+        migrations.RunPython(populate_task_names, migrations.RunPython.noop),
+    ]
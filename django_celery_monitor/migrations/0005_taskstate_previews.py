@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from django.db import migrations, models
+from django.db.models.functions import Substr
+
+PREVIEW_LENGTH = 255
+ETA_INDEX_NAME = 'celery_mon_eta_partial_idx'
+
+
+def fill_previews(apps, schema_editor):
+    # Truncate the arguments of the existing tasks in a single query.
+    TaskState = apps.get_model('celery_monitor', 'TaskState')
+    TaskState.objects.using(schema_editor.connection.alias).update(
+        args_preview=Substr('args', 1, PREVIEW_LENGTH),
+        kwargs_preview=Substr('kwargs', 1, PREVIEW_LENGTH),
+    )
+
+
+def restore_eta_index(apps, schema_editor):
+    # SQLite rebuilds the table to add columns, which drops the partial
+    # index created by the 0003 migration: Django before 2.2 can't
+    # declare it in Meta.indexes, so the rebuild doesn't know about it.
+    # Migrations don't share code that may change later, so every
+    # migration rebuilding the table has a copy of this function.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    TaskState = apps.get_model('celery_monitor', 'TaskState')
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS {0} ON {1} ({2}) '
+        'WHERE {2} IS NOT NULL'.format(
+            schema_editor.quote_name(ETA_INDEX_NAME),
+            schema_editor.quote_name(TaskState._meta.db_table),
+            schema_editor.quote_name('eta'),
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('celery_monitor', '0004_taskname'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='taskstate',
+            name='args_preview',
+            field=models.CharField(
+                editable=False,
+                max_length=PREVIEW_LENGTH,
+                null=True,
+                verbose_name='Arguments',
+            ),
+        ),
+        migrations.AddField(
+            model_name='taskstate',
+            name='kwargs_preview',
+            field=models.CharField(
+                editable=False,
+                max_length=PREVIEW_LENGTH,
+                null=True,
+                verbose_name='Keyword arguments',
+            ),
+        ),
+        migrations.RunPython(restore_eta_index, migrations.RunPython.noop),
+        migrations.RunPython(fill_previews, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import base64
+import zlib
+
+from django.db import migrations
+
+import django_celery_monitor.fields
+
+# Migrations don't share code that may change later, so the format of
+# the compressed values is copied from django_celery_monitor.fields.
+COMPRESSED_HEADER = '\x02'
+COMPRESS_THRESHOLD = 1024
+COMPRESS_CHUNK_SIZE = 1000
+COMPRESSED_COLUMNS = ('result', 'traceback')
+SEARCH_SUFFIX = '_search'
+
+
+def compress(value):
+    if value is None or len(value) < COMPRESS_THRESHOLD:
+        return value
+    if value.startswith(COMPRESSED_HEADER):
+        return value
+    compressed = COMPRESSED_HEADER + base64.b64encode(
+        zlib.compress(value.encode('utf-8')),
+    ).decode('ascii')
+    return compressed if len(compressed) < len(value) else value
+
+
+def decompress(value):
+    if value is None or not value.startswith(COMPRESSED_HEADER):
+        return value
+    try:
+        return zlib.decompress(base64.b64decode(
+            value[len(COMPRESSED_HEADER):].encode('ascii'),
+        )).decode('utf-8')
+    except (ValueError, zlib.error):
+        # not compressed after all.
+        return value
+
+
+def search_index_installed(schema_editor, table):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'trigger' "
+                "AND name = %s", [table + SEARCH_SUFFIX + '_update'],
+            )
+        elif connection.vendor == 'postgresql':
+            cursor.execute(
+                'SELECT 1 FROM pg_class WHERE relname = %s',
+                [table + SEARCH_SUFFIX],
+            )
+        else:
+            return False
+        return cursor.fetchone() is not None
+
+
+def rewrite_task_states(apps, schema_editor, condition, params, convert):
+    # Converts the columns of the tasks matching the condition with raw
+    # SQL, one chunk of tasks at a time, since the compressed fields of
+    # the model would compress or decompress the values again.
+    TaskState = apps.get_model('celery_monitor', 'TaskState')
+    qn = schema_editor.quote_name
+    columns = [qn(column) for column in COMPRESSED_COLUMNS]
+    select = (
+        'SELECT {id}, {columns} FROM {table} WHERE {id} > %s AND ({where}) '
+        'ORDER BY {id} LIMIT {limit}'.format(
+            id=qn('id'), columns=', '.join(columns),
+            table=qn(TaskState._meta.db_table),
+            where=' OR '.join(condition.format(column) for column in columns),
+            limit=COMPRESS_CHUNK_SIZE,
+        )
+    )
+    update = 'UPDATE {table} SET {assignments} WHERE {id} = %s'.format(
+        table=qn(TaskState._meta.db_table), id=qn('id'),
+        assignments=', '.join('{0} = %s'.format(column) for column in columns),
+    )
+    last_pk = 0
+    with schema_editor.connection.cursor() as cursor:
+        while True:
+            cursor.execute(select, [last_pk] + params * len(columns))
+            tasks = cursor.fetchall()
+            if not tasks:
+                break
+            last_pk = tasks[-1][0]
+            for task in tasks:
+                values = [convert(value) for value in task[1:]]
+                if values != list(task[1:]):
+                    cursor.execute(update, values + [task[0]])
+
+
+def compress_task_states(apps, schema_editor):
+    # The search index is built from the stored result and traceback,
+    # which have to stay readable when it's installed already.
+    TaskState = apps.get_model('celery_monitor', 'TaskState')
+    if search_index_installed(schema_editor, TaskState._meta.db_table):
+        return
+    rewrite_task_states(
+        apps, schema_editor, 'LENGTH({0}) >= %s', [COMPRESS_THRESHOLD],
+        compress,
+    )
+
+
+def decompress_task_states(apps, schema_editor):
+    rewrite_task_states(
+        apps, schema_editor, '{0} LIKE %s', [COMPRESSED_HEADER + '%'],
+        decompress,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('celery_monitor', '0005_taskstate_previews'),
+    ]
+
+    operations = [
+        # The columns stay text columns, so there is nothing to alter,
+        # which would rebuild the table on SQLite.
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.AlterField(
+                model_name='taskstate',
+                name='result',
+                field=django_celery_monitor.fields.CompressedTextField(
+                    null=True,
+                    verbose_name='result',
+                ),
+            ),
+            migrations.AlterField(
+                model_name='taskstate',
+                name='traceback',
+                field=django_celery_monitor.fields.CompressedTextField(
+                    null=True,
+                    verbose_name='traceback',
+                ),
+            ),
+        ]),
+        migrations.RunPython(compress_task_states, decompress_task_states),
+    ]
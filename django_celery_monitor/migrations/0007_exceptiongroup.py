@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+import django_celery_monitor.fields
+
+ETA_INDEX_NAME = 'celery_mon_eta_partial_idx'
+
+
+def restore_eta_index(apps, schema_editor):
+    # SQLite rebuilds the table to add columns, which drops the partial
+    # index created by the 0003 migration: Django before 2.2 can't
+    # declare it in Meta.indexes, so the rebuild doesn't know about it.
+    # Migrations don't share code that may change later, so every
+    # migration rebuilding the table has a copy of this function.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    TaskState = apps.get_model('celery_monitor', 'TaskState')
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS {0} ON {1} ({2}) '
+        'WHERE {2} IS NOT NULL'.format(
+            schema_editor.quote_name(ETA_INDEX_NAME),
+            schema_editor.quote_name(TaskState._meta.db_table),
+            schema_editor.quote_name('eta'),
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('celery_monitor', '0006_taskstate_compressed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExceptionGroup',
+            fields=[
+                ('id', models.AutoField(
+                    auto_created=True,
+                    primary_key=True,
+                    serialize=False,
+                    verbose_name='ID',
+                )),
+                ('fingerprint', models.CharField(
+                    max_length=40,
+                    unique=True,
+                    verbose_name='fingerprint',
+                )),
+                ('exception', models.CharField(
+                    max_length=255,
+                    verbose_name='exception',
+                )),
+                ('traceback', django_celery_monitor.fields.CompressedTextField(
+                    verbose_name='traceback',
+                )),
+                ('count', models.PositiveIntegerField(
+                    default=0,
+                    verbose_name='count',
+                )),
+                ('first_seen', models.DateTimeField(
+                    verbose_name='first seen',
+                )),
+                ('last_seen', models.DateTimeField(
+                    verbose_name='last seen',
+                )),
+            ],
+            options={
+                'verbose_name': 'failure',
+                'verbose_name_plural': 'failures',
+                'ordering': ['-last_seen'],
+                'get_latest_by': 'last_seen',
+            },
+        ),
+        migrations.AddField(
+            model_name='taskstate',
+            name='exception_group',
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                to='celery_monitor.ExceptionGroup',
+                verbose_name='failure',
+            ),
+        ),
+        migrations.RunPython(restore_eta_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from celery import states
+from django.db import migrations, models
+from django.db.models import Case, OuterRef, Subquery, Value, When
+import django.db.models.deletion
+
+import django_celery_monitor.fields
+
+ETA_INDEX_NAME = 'celery_mon_eta_partial_idx'
+
+
+def restore_eta_index(apps, schema_editor):
+    # SQLite rebuilds the table to add columns, which drops the partial
+    # index created by the 0003 migration: Django before 2.2 can't
+    # declare it in Meta.indexes, so the rebuild doesn't know about it.
+    # Migrations don't share code that may change later, so every
+    # migration rebuilding the table has a copy of this function.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    TaskState = apps.get_model('celery_monitor', 'TaskState')
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS {0} ON {1} ({2}) '
+        'WHERE {2} IS NOT NULL'.format(
+            schema_editor.quote_name(ETA_INDEX_NAME),
+            schema_editor.quote_name(TaskState._meta.db_table),
+            schema_editor.quote_name('eta'),
+        )
+    )
+
+
+def fill_codes(apps, schema_editor):
+    # Code the states and names of the existing tasks in a single query.
+    TaskName = apps.get_model('celery_monitor', 'TaskName')
+    TaskState = apps.get_model('celery_monitor', 'TaskState')
+    db = schema_editor.connection.alias
+    TaskState.objects.using(db).update(
+        state_rank=Case(*[
+            When(state=state, then=Value(states.precedence(state)))
+            for state in sorted(states.ALL_STATES)
+        ], default=Value(states.precedence(None))),
+        task_name=Subquery(TaskName.objects.using(db).filter(
+            name=OuterRef('name'),
+        ).values('pk')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('celery_monitor', '0007_exceptiongroup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='taskstate',
+            name='state_rank',
+            field=django_celery_monitor.fields.StateRankField(
+                null=True,
+                verbose_name='state rank',
+            ),
+        ),
+        migrations.AddField(
+            model_name='taskstate',
+            name='task_name',
+            field=models.ForeignKey(
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                to='celery_monitor.TaskName',
+                verbose_name='name',
+            ),
+        ),
+        migrations.RemoveIndex(
+            model_name='taskstate',
+            name='celery_mon_state_tstamp_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='taskstate',
+            name='celery_mon_name_tstamp_idx',
+        ),
+        migrations.AddIndex(
+            model_name='taskstate',
+            index=models.Index(
+                fields=['state_rank', 'tstamp'],
+                name='celery_mon_rank_tstamp_idx',
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='taskstate',
+            index=models.Index(
+                fields=['task_name', 'tstamp'],
+                name='celery_mon_tname_tstamp_idx',
+            ),
+        ),
+        migrations.RunPython(restore_eta_index, migrations.RunPython.noop),
+        migrations.RunPython(fill_codes, migrations.RunPython.noop),
+    ]
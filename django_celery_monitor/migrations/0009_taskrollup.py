@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('celery_monitor', '0008_taskstate_codes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskRollup',
+            fields=[
+                ('id', models.AutoField(
+                    auto_created=True,
+                    primary_key=True,
+                    serialize=False,
+                    verbose_name='ID',
+                )),
+                ('name', models.CharField(
+                    max_length=200,
+                    verbose_name='name',
+                )),
+                ('state', models.CharField(
+                    choices=[('FAILURE', 'FAILURE'),
+                             ('PENDING', 'PENDING'),
+                             ('RECEIVED', 'RECEIVED'),
+                             ('RETRY', 'RETRY'),
+                             ('REVOKED', 'REVOKED'),
+                             ('STARTED', 'STARTED'),
+                             ('SUCCESS', 'SUCCESS')],
+                    max_length=64,
+                    verbose_name='state',
+                )),
+                ('minute', models.DateTimeField(
+                    verbose_name='minute',
+                )),
+                ('count', models.PositiveIntegerField(
+                    default=0,
+                    verbose_name='count',
+                )),
+                ('runtime_sum', models.FloatField(
+                    default=0,
+                    verbose_name='total runtime',
+                )),
+                ('runtime_min', models.FloatField(
+                    null=True,
+                    verbose_name='minimum runtime',
+                )),
+                ('runtime_max', models.FloatField(
+                    null=True,
+                    verbose_name='maximum runtime',
+                )),
+            ],
+            options={
+                'verbose_name': 'task rollup',
+                'verbose_name_plural': 'task rollups',
+                'ordering': ['-minute'],
+                'get_latest_by': 'minute',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='taskrollup',
+            index=models.Index(
+                fields=['minute'],
+                name='celery_mon_rollup_minute_idx',
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name='taskrollup',
+            unique_together=set([('name', 'state', 'minute')]),
+        ),
+    ]
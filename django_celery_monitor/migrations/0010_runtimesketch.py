@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('celery_monitor', '0009_taskrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RuntimeSketch',
+            fields=[
+                ('id', models.AutoField(
+                    auto_created=True,
+                    primary_key=True,
+                    serialize=False,
+                    verbose_name='ID',
+                )),
+                ('name', models.CharField(
+                    max_length=200,
+                    verbose_name='name',
+                )),
+                ('window', models.DateTimeField(
+                    verbose_name='window',
+                )),
+                ('count', models.PositiveIntegerField(
+                    default=0,
+                    verbose_name='count',
+                )),
+                ('sketch', models.TextField(
+                    verbose_name='sketch',
+                )),
+            ],
+            options={
+                'verbose_name': 'runtime sketch',
+                'verbose_name_plural': 'runtime sketches',
+                'ordering': ['-window'],
+                'get_latest_by': 'window',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='runtimesketch',
+            unique_together=set([('name', 'window')]),
+        ),
+    ]
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from django.db import migrations, models
+
+ETA_INDEX_NAME = 'celery_mon_eta_partial_idx'
+
+
+def restore_eta_index(apps, schema_editor):
+    # SQLite rebuilds the table to add columns, which drops the partial
+    # index created by the 0003 migration: Django before 2.2 can't
+    # declare it in Meta.indexes, so the rebuild doesn't know about it.
+    # Migrations don't share code that may change later, so every
+    # migration rebuilding the table has a copy of this function.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    TaskState = apps.get_model('celery_monitor', 'TaskState')
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS {0} ON {1} ({2}) '
+        'WHERE {2} IS NOT NULL'.format(
+            schema_editor.quote_name(ETA_INDEX_NAME),
+            schema_editor.quote_name(TaskState._meta.db_table),
+            schema_editor.quote_name('eta'),
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('celery_monitor', '0010_runtimesketch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='taskstate',
+            name='received',
+            field=models.DateTimeField(
+                null=True,
+                verbose_name='received at',
+            ),
+        ),
+        migrations.AddField(
+            model_name='taskstate',
+            name='started',
+            field=models.DateTimeField(
+                null=True,
+                verbose_name='started at',
+            ),
+        ),
+        migrations.AddField(
+            model_name='taskstate',
+            name='succeeded',
+            field=models.DateTimeField(
+                null=True,
+                verbose_name='succeeded at',
+            ),
+        ),
+        migrations.AddField(
+            model_name='taskstate',
+            name='failed',
+            field=models.DateTimeField(
+                null=True,
+                verbose_name='failed at',
+            ),
+        ),
+        migrations.AddField(
+            model_name='taskstate',
+            name='queue_wait',
+            field=models.FloatField(
+                help_text='in seconds from received to started',
+                null=True,
+                verbose_name='queue wait',
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='taskstate',
+            index=models.Index(
+                fields=['received'],
+                name='celery_mon_received_idx',
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='taskstate',
+            index=models.Index(
+                fields=['started'],
+                name='celery_mon_started_idx',
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='taskstate',
+            index=models.Index(
+                fields=['succeeded'],
+                name='celery_mon_succeeded_idx',
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='taskstate',
+            index=models.Index(
+                fields=['failed'],
+                name='celery_mon_failed_idx',
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='taskstate',
+            index=models.Index(
+                fields=['queue_wait'],
+                name='celery_mon_queue_wait_idx',
+            ),
+        ),
+        migrations.AddField(
+            model_name='taskrollup',
+            name='queue_wait_sum',
+            field=models.FloatField(
+                default=0,
+                verbose_name='total queue wait',
+            ),
+        ),
+        migrations.AddField(
+            model_name='taskrollup',
+            name='queue_wait_min',
+            field=models.FloatField(
+                null=True,
+                verbose_name='minimum queue wait',
+            ),
+        ),
+        migrations.AddField(
+            model_name='taskrollup',
+            name='queue_wait_max',
+            field=models.FloatField(
+                null=True,
+                verbose_name='maximum queue wait',
+            ),
+        ),
+        migrations.RunPython(restore_eta_index, migrations.RunPython.noop),
+    ]
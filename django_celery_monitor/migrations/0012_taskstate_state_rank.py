@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from celery import states
+from django.db import migrations
+from django.db.models import Case, Value, When
+
+import django_celery_monitor.fields
+
+ETA_INDEX_NAME = 'celery_mon_eta_partial_idx'
+
+
+def restore_eta_index(apps, schema_editor):
+    # SQLite rebuilds the table to add columns, which drops the partial
+    # index created by the 0003 migration: Django before 2.2 can't
+    # declare it in Meta.indexes, so the rebuild doesn't know about it.
+    # Migrations don't share code that may change later, so every
+    # migration rebuilding the table has a copy of this function.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    TaskState = apps.get_model('celery_monitor', 'TaskState')
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS {0} ON {1} ({2}) '
+        'WHERE {2} IS NOT NULL'.format(
+            schema_editor.quote_name(ETA_INDEX_NAME),
+            schema_editor.quote_name(TaskState._meta.db_table),
+            schema_editor.quote_name('eta'),
+        )
+    )
+
+
+def fill_state_ranks(apps, schema_editor):
+    # Rank the states of the tasks updated without a rank, e.g. by
+    # QuerySet.update(), before the column becomes required.
+    TaskState = apps.get_model('celery_monitor', 'TaskState')
+    db = schema_editor.connection.alias
+    TaskState.objects.using(db).filter(state_rank__isnull=True).update(
+        state_rank=Case(*[
+            When(state=state, then=Value(states.precedence(state)))
+            for state in sorted(states.ALL_STATES)
+        ], default=Value(states.precedence(None))),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('celery_monitor', '0011_taskstate_lifecycle'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_state_ranks, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='taskstate',
+            name='state_rank',
+            field=django_celery_monitor.fields.StateRankField(
+                verbose_name='state rank',
+            ),
+        ),
+        migrations.RunPython(restore_eta_index, migrations.RunPython.noop),
+    ]
@@ -12,6 +12,9 @@ from celery.events.state import heartbeat_expires
 from celery.five import python_2_unicode_compatible
 
 from . import managers
+from .fields import CompressedTextField, StateRankField
+from .sketches import DDSketch
+from .utils import PREVIEW_LENGTH
 
 ALL_STATES = sorted(states.ALL_STATES)
 TASK_STATE_CHOICES = sorted(zip(ALL_STATES, ALL_STATES))
@@ -59,19 +62,65 @@ class WorkerState(models.Model):
         return mktime(self.last_heartbeat.timetuple())
 
 
+@python_2_unicode_compatible
+class ExceptionGroup(models.Model):
+    """The data model to store the tracebacks of failed tasks once in."""
+
+    #: The SHA1 hex digest of the normalized traceback.
+    fingerprint = models.CharField(
+        _('fingerprint'), max_length=40, unique=True,
+    )
+    #: The name of the raised exception.
+    exception = models.CharField(_('exception'), max_length=255)
+    #: The first seen traceback with the fingerprint.
+    traceback = CompressedTextField(_('traceback'))
+    #: The number of times the exception was seen.
+    count = models.PositiveIntegerField(_('count'), default=0)
+    #: A :class:`~datetime.datetime` describing when it was first seen.
+    first_seen = models.DateTimeField(_('first seen'))
+    #: A :class:`~datetime.datetime` describing when it was last seen.
+    last_seen = models.DateTimeField(_('last seen'))
+
+    #: A :class:`~django_celery_monitor.managers.ExceptionGroupQuerySet`
+    #: instance to query the
+    #: :class:`~django_celery_monitor.models.ExceptionGroup` model.
+    objects = managers.ExceptionGroupQuerySet.as_manager()
+
+    class Meta:
+        """Model meta-data."""
+
+        verbose_name = _('failure')
+        verbose_name_plural = _('failures')
+        get_latest_by = 'last_seen'
+        ordering = ['-last_seen']
+
+    def __str__(self):
+        return '{0.exception} {1}'.format(self, self.fingerprint[:8])
+
+    def __repr__(self):
+        return '<ExceptionGroup: {0.exception} {0.fingerprint}>'.format(
+            self,
+        )
+
+
 @python_2_unicode_compatible
 class TaskState(models.Model):
     """The data model to store the task state in."""
 
     #: The :mod:`task state <celery.states>` as returned by Celery.
     state = models.CharField(
-        _('state'), max_length=64, choices=TASK_STATE_CHOICES, db_index=True,
+        _('state'), max_length=64, choices=TASK_STATE_CHOICES,
     )
+    #: The :func:`precedence <celery.states.precedence>` of the state.
+    state_rank = StateRankField(_('state rank'))
     #: The task :func:`UUID <uuid.uuid4>`.
     task_id = models.CharField(_('UUID'), max_length=36, unique=True)
     #: The :ref:`task name <celery:task-names>`.
-    name = models.CharField(
-        _('name'), max_length=200, null=True, db_index=True,
+    name = models.CharField(_('name'), max_length=200, null=True)
+    #: The entry of the name in the task name catalog.
+    task_name = models.ForeignKey(
+        'TaskName', null=True, editable=False, verbose_name=_('name'),
+        on_delete=models.SET_NULL,
     )
     #: A :class:`~datetime.datetime` describing when the task was received.
     tstamp = models.DateTimeField(_('event received at'), db_index=True)
@@ -79,6 +128,15 @@ class TaskState(models.Model):
     args = models.TextField(_('Arguments'), null=True)
     #: The keyword :ref:`task arguments <celery:calling-basics>`.
     kwargs = models.TextField(_('Keyword arguments'), null=True)
+    #: The start of the positional arguments, shown in lists.
+    args_preview = models.CharField(
+        _('Arguments'), max_length=PREVIEW_LENGTH, null=True, editable=False,
+    )
+    #: The start of the keyword arguments, shown in lists.
+    kwargs_preview = models.CharField(
+        _('Keyword arguments'), max_length=PREVIEW_LENGTH, null=True,
+        editable=False,
+    )
     #: An optional :class:`~datetime.datetime` describing the
     #: :ref:`ETA <celery:calling-eta>` for its processing.
     eta = models.DateTimeField(_('ETA'), null=True)
@@ -86,9 +144,9 @@ class TaskState(models.Model):
     #: :ref:`expires <celery:calling-expiration>`.
     expires = models.DateTimeField(_('expires'), null=True)
     #: The result of the task.
-    result = models.TextField(_('result'), null=True)
+    result = CompressedTextField(_('result'), null=True)
     #: The Python error traceback if raised.
-    traceback = models.TextField(_('traceback'), null=True)
+    traceback = CompressedTextField(_('traceback'), null=True)
     #: The task runtime in seconds.
     runtime = models.FloatField(
         _('execution time'), null=True,
@@ -96,14 +154,34 @@ class TaskState(models.Model):
     )
     #: The number of retries.
     retries = models.IntegerField(_('number of retries'), default=0)
+    #: A :class:`~datetime.datetime` describing when a worker received
+    #: the task.
+    received = models.DateTimeField(_('received at'), null=True)
+    #: A :class:`~datetime.datetime` describing when the task started.
+    started = models.DateTimeField(_('started at'), null=True)
+    #: A :class:`~datetime.datetime` describing when the task succeeded.
+    succeeded = models.DateTimeField(_('succeeded at'), null=True)
+    #: A :class:`~datetime.datetime` describing when the task failed.
+    failed = models.DateTimeField(_('failed at'), null=True)
+    #: The number of seconds between receiving and starting the task.
+    queue_wait = models.FloatField(
+        _('queue wait'), null=True,
+        help_text=_('in seconds from received to started'),
+    )
     #: The worker responsible for the execution of the task.
     worker = models.ForeignKey(
         WorkerState, null=True, verbose_name=_('worker'),
         on_delete=models.CASCADE,
     )
+    #: The group of the raised exception, whose traceback is stored
+    #: instead of the traceback of the task.
+    exception_group = models.ForeignKey(
+        ExceptionGroup, null=True, verbose_name=_('failure'),
+        on_delete=models.SET_NULL,
+    )
     #: Whether the task has been expired and will be purged by the
     #: event framework.
-    hidden = models.BooleanField(editable=False, default=False, db_index=True)
+    hidden = models.BooleanField(editable=False, default=False)
 
     #: A :class:`~django_celery_monitor.managers.TaskStateManager` instance
     #: to query the :class:`~django_celery_monitor.models.TaskState` model.
@@ -116,6 +194,29 @@ class TaskState(models.Model):
         verbose_name_plural = _('tasks')
         get_latest_by = 'tstamp'
         ordering = ['-tstamp']
+        # See docs/indexes.rst for the queries these are tuned for,
+        # the partial index on the ETA of unready tasks is created
+        # by a migration on backends supporting it.
+        indexes = [
+            models.Index(fields=['state_rank', 'tstamp'],
+                         name='celery_mon_rank_tstamp_idx'),
+            models.Index(fields=['task_name', 'tstamp'],
+                         name='celery_mon_tname_tstamp_idx'),
+            models.Index(fields=['worker', 'tstamp'],
+                         name='celery_mon_worker_tstamp_idx'),
+            models.Index(fields=['hidden', 'id'],
+                         name='celery_mon_hidden_id_idx'),
+            models.Index(fields=['received'],
+                         name='celery_mon_received_idx'),
+            models.Index(fields=['started'],
+                         name='celery_mon_started_idx'),
+            models.Index(fields=['succeeded'],
+                         name='celery_mon_succeeded_idx'),
+            models.Index(fields=['failed'],
+                         name='celery_mon_failed_idx'),
+            models.Index(fields=['queue_wait'],
+                         name='celery_mon_queue_wait_idx'),
+        ]
 
     def __str__(self):
         name = self.name or 'UNKNOWN'
@@ -128,3 +229,138 @@ class TaskState(models.Model):
         return '<TaskState: {0.state} {1}[{0.task_id}] ts:{0.tstamp}>'.format(
             self, self.name or 'UNKNOWN',
         )
+
+
+@python_2_unicode_compatible
+class TaskName(models.Model):
+    """The data model to store the catalog of seen task names in."""
+
+    #: The :ref:`task name <celery:task-names>`.
+    name = models.CharField(_('name'), max_length=200, unique=True)
+    #: A :class:`~datetime.datetime` describing when the name was first seen.
+    first_seen = models.DateTimeField(_('first seen'))
+    #: A :class:`~datetime.datetime` describing when the name was last seen.
+    last_seen = models.DateTimeField(_('last seen'))
+    #: The number of tasks seen with the name.
+    count = models.PositiveIntegerField(_('count'), default=0)
+
+    #: A :class:`~django_celery_monitor.managers.TaskNameQuerySet` instance
+    #: to query the :class:`~django_celery_monitor.models.TaskName` model.
+    objects = managers.TaskNameQuerySet.as_manager()
+
+    class Meta:
+        """Model meta-data."""
+
+        verbose_name = _('task name')
+        verbose_name_plural = _('task names')
+        get_latest_by = 'last_seen'
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
+    def __repr__(self):
+        return '<TaskName: {0.name} count:{0.count}>'.format(self)
+
+
+@python_2_unicode_compatible
+class TaskRollup(models.Model):
+    """The data model to store the task counts per minute in."""
+
+    #: The :ref:`task name <celery:task-names>`.
+    name = models.CharField(_('name'), max_length=200)
+    #: The :mod:`task state <celery.states>` the tasks reached.
+    state = models.CharField(
+        _('state'), max_length=64, choices=TASK_STATE_CHOICES,
+    )
+    #: A :class:`~datetime.datetime` of the start of the minute the tasks
+    #: reached the state in.
+    minute = models.DateTimeField(_('minute'))
+    #: The number of tasks.
+    count = models.PositiveIntegerField(_('count'), default=0)
+    #: The sum of the runtimes of the tasks in seconds.
+    runtime_sum = models.FloatField(_('total runtime'), default=0)
+    #: The shortest runtime of the tasks in seconds.
+    runtime_min = models.FloatField(_('minimum runtime'), null=True)
+    #: The longest runtime of the tasks in seconds.
+    runtime_max = models.FloatField(_('maximum runtime'), null=True)
+    #: The sum of the queue waits of the tasks in seconds.
+    queue_wait_sum = models.FloatField(_('total queue wait'), default=0)
+    #: The shortest queue wait of the tasks in seconds.
+    queue_wait_min = models.FloatField(_('minimum queue wait'), null=True)
+    #: The longest queue wait of the tasks in seconds.
+    queue_wait_max = models.FloatField(_('maximum queue wait'), null=True)
+
+    #: A :class:`~django_celery_monitor.managers.TaskRollupQuerySet`
+    #: instance to query the
+    #: :class:`~django_celery_monitor.models.TaskRollup` model.
+    objects = managers.TaskRollupQuerySet.as_manager()
+
+    class Meta:
+        """Model meta-data."""
+
+        verbose_name = _('task rollup')
+        verbose_name_plural = _('task rollups')
+        get_latest_by = 'minute'
+        ordering = ['-minute']
+        unique_together = ('name', 'state', 'minute')
+        indexes = [
+            models.Index(
+                fields=['minute'], name='celery_mon_rollup_minute_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return '{0.name} {0.state} {0.minute}'.format(self)
+
+    def __repr__(self):
+        return '<TaskRollup: {0.name} {0.state} {0.minute} {1}>'.format(
+            self, 'count:{0}'.format(self.count),
+        )
+
+
+@python_2_unicode_compatible
+class RuntimeSketch(models.Model):
+    """The data model to store the runtime quantile sketches in."""
+
+    #: The :ref:`task name <celery:task-names>`.
+    name = models.CharField(_('name'), max_length=200)
+    #: A :class:`~datetime.datetime` of the start of the time window the
+    #: tasks finished in.
+    window = models.DateTimeField(_('window'))
+    #: The number of runtimes in the sketch.
+    count = models.PositiveIntegerField(_('count'), default=0)
+    #: The :class:`~django_celery_monitor.sketches.DDSketch` of the
+    #: runtimes serialized to JSON.
+    sketch = models.TextField(_('sketch'))
+
+    #: A :class:`~django_celery_monitor.managers.RuntimeSketchQuerySet`
+    #: instance to query the
+    #: :class:`~django_celery_monitor.models.RuntimeSketch` model.
+    objects = managers.RuntimeSketchQuerySet.as_manager()
+
+    class Meta:
+        """Model meta-data."""
+
+        verbose_name = _('runtime sketch')
+        verbose_name_plural = _('runtime sketches')
+        get_latest_by = 'window'
+        ordering = ['-window']
+        unique_together = ('name', 'window')
+
+    def __str__(self):
+        return '{0.name} {0.window}'.format(self)
+
+    def __repr__(self):
+        return '<RuntimeSketch: {0.name} {0.window} count:{0.count}>'.format(
+            self,
+        )
+
+    def get_sketch(self):
+        """Return the stored sketch."""
+        return DDSketch.from_json(self.sketch)
+
+    def set_sketch(self, sketch):
+        """Store the given sketch."""
+        self.sketch = sketch.to_json()
+        self.count = sketch.count
@@ -0,0 +1,176 @@
+"""Paginators for large task state tables."""
+from __future__ import absolute_import, unicode_literals
+
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.db import DatabaseError, connections, router
+from django.utils.functional import cached_property
+
+#: The table the row counts of SQLite databases are maintained in.
+ROW_COUNT_TABLE = 'celery_monitor_rowcount'
+
+#: The number of rows up to which filtered lists are counted exactly.
+EXACT_COUNT_LIMIT = 10000
+
+ESTIMATE_SQL = {
+    'postgresql': (
+        'SELECT SUM(GREATEST(c.reltuples, 0)) FROM pg_class c '
+        'WHERE c.oid = %s::regclass OR c.oid IN ('
+        'SELECT inhrelid FROM pg_inherits '
+        'WHERE inhparent = %s::regclass)'
+    ),
+    'mysql': (
+        'SELECT TABLE_ROWS FROM information_schema.TABLES '
+        'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s'
+    ),
+    'sqlite': (
+        'SELECT count FROM ' + ROW_COUNT_TABLE + ' WHERE name = %s'
+    ),
+}
+
+
+def estimate_count(model, using=None):
+    """Return the estimated number of rows in the table of the model.
+
+    Uses the planner statistics on PostgreSQL and MySQL and the row
+    counts maintained by triggers on SQLite. Returns :const:`None` if no
+    estimate is available.
+    """
+    using = using or router.db_for_read(model)
+    connection = connections[using]
+    sql = ESTIMATE_SQL.get(connection.vendor)
+    if sql is None:
+        return None
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                sql, [model._meta.db_table] * sql.count('%s'),
+            )
+            row = cursor.fetchone()
+    except DatabaseError:
+        # e.g. no row count table without the triggers on SQLite.
+        return None
+    if row is None or row[0] is None:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """A paginator that avoids counting all rows of large tables.
+
+    Unfiltered querysets are counted with :func:`estimate_count`, and
+    filtered ones are only counted up to ``exact_count_limit`` rows.
+    :attr:`estimated` tells whether :attr:`count` is exact or not.
+    """
+
+    exact_count_limit = EXACT_COUNT_LIMIT
+
+    def __init__(self, *args, **kwargs):
+        super(EstimatedCountPaginator, self).__init__(*args, **kwargs)
+        #: Whether the count is estimated.
+        self.estimated = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        limit = self.exact_count_limit
+        if not queryset.query.where:
+            estimate = estimate_count(queryset.model, using=queryset.db)
+            # small tables are counted exactly since stats may be stale.
+            if estimate is not None and estimate > limit:
+                self.estimated = True
+                return estimate
+        count = queryset.order_by()[:limit + 1].count()
+        if count > limit:
+            self.estimated = True
+            return limit
+        return count
+
+    def validate_number(self, number):
+        # counting tells whether the count is estimated or not.
+        self.count
+        if not self.estimated:
+            return super(EstimatedCountPaginator, self).validate_number(
+                number,
+            )
+        # Pages past the estimated end are just empty.
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('That page number is not an integer')
+        if number < 1:
+            raise EmptyPage('That page number is less than 1')
+        return number
+
+
+def _count_trigger(table, action):
+    return '{0}_count_{1}'.format(table, action)
+
+
+def _has_trigger(cursor, name):
+    cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'trigger' "
+        "AND name = %s", [name],
+    )
+    return cursor.fetchone() is not None
+
+
+def install_row_count(model, using):
+    """Maintain the row count of the model's table with SQLite triggers.
+
+    Creates the row count table and triggers if missing, e.g. after
+    migrations rebuilt the table, and recounts the rows in that case.
+    Does nothing on other databases.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return False
+    table = model._meta.db_table
+    if table not in connection.introspection.table_names():
+        return False
+    with connection.cursor() as cursor:
+        if _has_trigger(cursor, _count_trigger(table, 'insert')):
+            return False
+        cursor.execute(
+            'CREATE TABLE IF NOT EXISTS {0} ('
+            'name varchar(100) NOT NULL PRIMARY KEY, '
+            'count integer NOT NULL)'.format(ROW_COUNT_TABLE),
+        )
+        cursor.execute(
+            'INSERT OR REPLACE INTO {0} (name, count) '
+            'SELECT %s, COUNT(*) FROM "{1}"'.format(ROW_COUNT_TABLE, table),
+            [table],
+        )
+        for action, op in (('insert', '+'), ('delete', '-')):
+            cursor.execute(
+                'CREATE TRIGGER IF NOT EXISTS "{0}" AFTER {1} ON "{2}" '
+                "BEGIN UPDATE {3} SET count = count {4} 1 "
+                "WHERE name = '{2}'; END".format(
+                    _count_trigger(table, action), action.upper(), table,
+                    ROW_COUNT_TABLE, op,
+                ),
+            )
+    return True
+
+
+def drop_row_count(model, using):
+    """Stop maintaining the row count of the model's table.
+
+    Drops the triggers and the row count created by
+    :func:`install_row_count`, so writes to the table don't update it
+    anymore. Does nothing on other databases.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return False
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if not _has_trigger(cursor, _count_trigger(table, 'insert')):
+            return False
+        for action in ('insert', 'delete'):
+            cursor.execute('DROP TRIGGER IF EXISTS "{0}"'.format(
+                _count_trigger(table, action)))
+        cursor.execute(
+            'DELETE FROM {0} WHERE name = %s'.format(ROW_COUNT_TABLE),
+            [table],
+        )
+    return True
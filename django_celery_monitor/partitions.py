@@ -0,0 +1,250 @@
+"""Daily partitions of the task states table."""
+from __future__ import absolute_import, unicode_literals
+
+import re
+
+from datetime import datetime, timedelta
+
+from celery.utils.log import get_logger
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from .purge import PURGE_CHUNK_SIZE
+
+PARTITION_SUFFIX = '_p{0:%Y%m%d}'
+DEFAULT_SUFFIX = '_default'
+PARTITION_RE = re.compile(r'_p(\d{8})$')
+
+logger = get_logger(__name__)
+debug = logger.debug
+
+
+def day_start(value):
+    """Return the start of the UTC day of the given date or datetime."""
+    start = datetime(value.year, value.month, value.day)
+    if settings.USE_TZ:
+        start = timezone.make_aware(start, timezone.utc)
+    return start
+
+
+class Partitions(object):
+    """Manage daily partitions of the task states table by ``tstamp``.
+
+    On PostgreSQL the table is turned into a natively partitioned table
+    with one partition per day, so dropping the tasks of a whole day is
+    a single ``DROP TABLE``. Other databases keep a single table and
+    emulate dropping a day with chunked range deletes.
+
+    Partitioned tables can't have a unique index on ``task_id``, so task
+    states have to be written without ``INSERT ... ON CONFLICT``.
+
+    Arguments:
+        TaskState (Type[~django_celery_monitor.models.TaskState]):
+            The data model the task states are stored in.
+        days_ahead (int): The number of days to create partitions for
+            in advance.
+    """
+
+    def __init__(self, TaskState, days_ahead=2):
+        self.TaskState = TaskState
+        self.days_ahead = days_ahead
+        self.using = router.db_for_write(TaskState)
+
+    @property
+    def connection(self):
+        return connections[self.using]
+
+    @property
+    def native(self):
+        """Return whether the database supports native partitioning."""
+        connection = self.connection
+        if connection.vendor == 'postgresql':
+            return connection.pg_version >= 110000
+        return False
+
+    @property
+    def table(self):
+        return self.TaskState._meta.db_table
+
+    def is_partitioned(self):
+        """Return whether the table is partitioned already."""
+        if not self.native:
+            return False
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT 1 FROM pg_partitioned_table '
+                'WHERE partrelid = %s::regclass', [self.table],
+            )
+            return cursor.fetchone() is not None
+
+    def install(self, today=None):
+        """Turn the task states table into a partitioned table.
+
+        The existing table becomes the partition of the day of its
+        last task, or of today, reaching back to its first task, so
+        its rows stay queryable until that day is dropped. It is
+        scanned once when attached, and the partitions of the next
+        days don't overlap it. Tasks of days without partition, e.g.
+        late events of dropped days, go to an empty default partition.
+
+        The partitioned table gets the defaults, check constraints,
+        foreign keys and indexes of the existing table, named with a
+        ``_p`` suffix, e.g. the partial ``eta`` index too. Unique
+        indexes of partitioned tables have to include ``tstamp``, so
+        the primary key becomes ``(id, tstamp)`` and the unique
+        ``task_id`` index a plain one.
+        """
+        if not self.native:
+            debug('Partitions: %s has no native partitioning, '
+                  'emulating them.', self.connection.vendor)
+            return False
+        if self.is_partitioned():
+            return False
+        qn = self.connection.ops.quote_name
+        table = self.table
+        today = today or timezone.now().date()
+        with transaction.atomic(using=self.using):
+            with self.connection.cursor() as cursor:
+                cursor.execute('SELECT MAX({0}) FROM {1}'.format(
+                    qn('tstamp'), qn(table)))
+                last = cursor.fetchone()[0]
+                day = max(today, last.date()) if last else today
+                legacy = self.partition_name(day)
+                cursor.execute('ALTER TABLE {0} RENAME TO {1}'.format(
+                    qn(table), qn(legacy)))
+                cursor.execute(
+                    'CREATE TABLE {0} (LIKE {1} INCLUDING DEFAULTS '
+                    'INCLUDING CONSTRAINTS) PARTITION BY RANGE ({2})'.format(
+                        qn(table), qn(legacy), qn('tstamp')))
+                cursor.execute('ALTER TABLE {0} ADD PRIMARY KEY ({1})'.format(
+                    qn(table), ', '.join([qn('id'), qn('tstamp')])))
+                # the ids stay in use after the partition is dropped.
+                cursor.execute(
+                    'SELECT pg_get_serial_sequence(%s, %s)', [legacy, 'id'],
+                )
+                sequence = cursor.fetchone()[0]
+                if sequence:
+                    cursor.execute(
+                        'ALTER SEQUENCE {0} OWNED BY {1}.{2}'.format(
+                            sequence, qn(table), qn('id')))
+                for name, definition in self._foreign_keys(cursor, legacy):
+                    cursor.execute(
+                        'ALTER TABLE {0} ADD CONSTRAINT {1} {2}'.format(
+                            qn(table), qn(name + '_p'), definition))
+                for name, definition in self._indexes(cursor, legacy):
+                    # the method, columns and predicate of the index.
+                    cursor.execute('CREATE INDEX {0} ON {1} USING {2}'.format(
+                        qn(name + '_p'), qn(table),
+                        definition.split(' USING ', 1)[1]))
+                # the primary key of the partitioned table replaces it.
+                cursor.execute(
+                    "SELECT conname FROM pg_constraint "
+                    "WHERE conrelid = %s::regclass AND contype = 'p'",
+                    [legacy],
+                )
+                for name, in cursor.fetchall():
+                    cursor.execute(
+                        'ALTER TABLE {0} DROP CONSTRAINT {1}'.format(
+                            qn(legacy), qn(name)))
+                cursor.execute(
+                    'ALTER TABLE {0} ATTACH PARTITION {1} '
+                    'FOR VALUES FROM (MINVALUE) TO (%s)'.format(
+                        qn(table), qn(legacy)),
+                    [day_start(day + timedelta(days=1))],
+                )
+                cursor.execute(
+                    'CREATE TABLE {0} PARTITION OF {1} DEFAULT'.format(
+                        qn(table + DEFAULT_SUFFIX), qn(table)))
+        debug('Partitions: Partitioned %s.', table)
+        return True
+
+    def _foreign_keys(self, cursor, table):
+        cursor.execute(
+            'SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint '
+            "WHERE conrelid = %s::regclass AND contype = 'f'", [table],
+        )
+        return cursor.fetchall()
+
+    def _indexes(self, cursor, table):
+        # All but the primary key, unique ones included.
+        cursor.execute(
+            'SELECT c.relname, pg_get_indexdef(i.indexrelid) '
+            'FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid '
+            'WHERE i.indrelid = %s::regclass AND NOT i.indisprimary',
+            [table],
+        )
+        return cursor.fetchall()
+
+    def partition_name(self, day):
+        return self.table + PARTITION_SUFFIX.format(day)
+
+    def partitions(self):
+        """Return a sorted list of the days of the existing partitions."""
+        if not self.native:
+            return []
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT c.relname FROM pg_inherits i '
+                'JOIN pg_class c ON c.oid = i.inhrelid '
+                'WHERE i.inhparent = %s::regclass', [self.table],
+            )
+            names = [row[0] for row in cursor.fetchall()]
+        return sorted(
+            datetime.strptime(match.group(1), '%Y%m%d').date()
+            for match in map(PARTITION_RE.search, names) if match
+        )
+
+    def ensure(self, today=None):
+        """Create the partitions of today and the next days if missing.
+
+        Only days after the last existing partition are created, since
+        that of the existing table reaches back to its first task.
+        Returns the number of created partitions.
+        """
+        if not self.is_partitioned():
+            return 0
+        today = today or timezone.now().date()
+        existing = self.partitions()
+        first = max([today] + [day + timedelta(days=1)
+                               for day in existing[-1:]])
+        qn = self.connection.ops.quote_name
+        created = 0
+        with self.connection.cursor() as cursor:
+            for offset in range(self.days_ahead + 1):
+                day = today + timedelta(days=offset)
+                if day < first:
+                    continue
+                cursor.execute(
+                    'CREATE TABLE IF NOT EXISTS {0} PARTITION OF {1} '
+                    'FOR VALUES FROM (%s) TO (%s)'.format(
+                        qn(self.partition_name(day)), qn(self.table)),
+                    [day_start(day), day_start(day + timedelta(days=1))],
+                )
+                created += 1
+        return created
+
+    def drop_before(self, cutoff, chunk_size=PURGE_CHUNK_SIZE):
+        """Drop the task states of all days ending before the cutoff.
+
+        Returns the number of dropped days.
+        """
+        cutoff = day_start(cutoff)
+        if self.is_partitioned():
+            qn = self.connection.ops.quote_name
+            days = [
+                day for day in self.partitions()
+                if day_start(day + timedelta(days=1)) <= cutoff
+            ]
+            with self.connection.cursor() as cursor:
+                for day in days:
+                    cursor.execute('DROP TABLE {0}'.format(
+                        qn(self.partition_name(day))))
+        else:
+            objects = self.TaskState.objects.filter(tstamp__lt=cutoff)
+            days = list(objects.dates('tstamp', 'day'))
+            while objects.delete_chunk(chunk_size) >= chunk_size:
+                pass
+        if days:
+            debug('Partitions: Dropped %s days before %s.', len(days), cutoff)
+        return len(days)
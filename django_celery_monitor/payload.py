@@ -0,0 +1,82 @@
+"""Limits of the task payloads stored by the camera."""
+from __future__ import absolute_import, unicode_literals
+
+from fnmatch import fnmatchcase
+
+try:
+    from collections.abc import Mapping
+except ImportError:  # pragma: no cover
+    from collections import Mapping
+
+from celery.five import string_t
+
+#: The task state fields that can be limited.
+PAYLOAD_FIELDS = ('args', 'kwargs', 'result', 'traceback')
+
+TRUNCATED_MARKER = '... [truncated, {0} bytes]'
+DROPPED_MARKER = '[dropped, {0} bytes]'
+
+
+def truncate(value, limit):
+    """Return the text cut to ``limit`` UTF-8 bytes.
+
+    Cut values end with a marker recording their original size, and a
+    limit of ``0`` drops the whole value, leaving just the marker.
+    """
+    encoded = value.encode('utf-8')
+    if len(encoded) <= limit:
+        return value
+    if not limit:
+        return DROPPED_MARKER.format(len(encoded))
+    marker = TRUNCATED_MARKER.format(len(encoded))
+    return encoded[:limit].decode('utf-8', 'ignore') + marker
+
+
+class PayloadLimits(object):
+    """The maximum sizes of the payloads stored for tasks by name.
+
+    Arguments:
+        rules (Union[Mapping, Sequence]): Pairs of task name glob
+            patterns and mappings of the fields in :data:`PAYLOAD_FIELDS`
+            to their maximum size in bytes, ``0`` to not store the field
+            or ``None`` for no limit. The first matching pattern applies.
+    """
+
+    def __init__(self, rules=None):
+        if isinstance(rules, Mapping):
+            rules = rules.items()
+        self.rules = [(pattern, dict(limits))
+                      for pattern, limits in rules or ()]
+        self._limits = {}
+
+    def __bool__(self):
+        return bool(self.rules)
+    __nonzero__ = __bool__
+
+    def limits(self, name):
+        """Return the field limits of the tasks with the given name."""
+        try:
+            return self._limits[name]
+        except KeyError:
+            pass
+        limits = {}
+        for pattern, field_limits in self.rules:
+            if fnmatchcase(name, pattern):
+                limits = dict(
+                    (field, limit) for field, limit in field_limits.items()
+                    if field in PAYLOAD_FIELDS and limit is not None
+                )
+                break
+        # Task names are few, so they are cached for good.
+        self._limits[name] = limits
+        return limits
+
+    def apply(self, name, defaults):
+        """Truncate the payloads in the model field values of a task."""
+        if not name:
+            return defaults
+        for field, limit in self.limits(name).items():
+            value = defaults.get(field)
+            if isinstance(value, string_t):
+                defaults[field] = truncate(value, limit)
+        return defaults
@@ -0,0 +1,113 @@
+"""Chunked purging of expired task states."""
+from __future__ import absolute_import, unicode_literals
+
+import threading
+
+from celery.five import monotonic
+from celery.utils.log import get_logger
+from django.db import connections
+
+PURGE_CHUNK_SIZE = 1000  # number of task states deleted per statement.
+
+logger = get_logger(__name__)
+debug = logger.debug
+
+
+class Purger(object):
+    """Delete expired task states in chunks within a time budget.
+
+    Arguments:
+        TaskState (Type[~django_celery_monitor.models.TaskState]):
+            The data model the task states are stored in.
+        chunk_size (int): The maximum number of rows deleted
+            per ``DELETE`` statement.
+        time_budget (float): The number of seconds after which a purge
+            stops deleting chunks, or :const:`None` to purge everything.
+    """
+
+    def __init__(self, TaskState, chunk_size=PURGE_CHUNK_SIZE,
+                 time_budget=None):
+        self.TaskState = TaskState
+        self.chunk_size = chunk_size or PURGE_CHUNK_SIZE
+        self.time_budget = time_budget
+        #: The number of rows deleted per second by the last purge.
+        self.rate = None
+        #: The number of rows deleted by all purges.
+        self.deleted = 0
+        self._thread = None
+
+    def expired(self, expire_task_states):
+        """Return the querysets of the task states to purge."""
+        yield self.TaskState.objects.filter(hidden=True)
+        for states, expires in expire_task_states:
+            if expires is not None:
+                yield self.TaskState.objects.expired(states, expires)
+
+    def purge(self, expire_task_states):
+        """Purge the expired task states until done or out of time.
+
+        Takes a sequence of ``(states, expires)`` tuples like
+        :attr:`~django_celery_monitor.camera.Camera.expire_task_states`
+        and returns the number of deleted rows.
+        """
+        start = monotonic()
+        deadline = None
+        if self.time_budget is not None:
+            deadline = start + self.time_budget
+        deleted = 0
+        for queryset in self.expired(expire_task_states):
+            while True:
+                count = queryset.delete_chunk(self.chunk_size)
+                deleted += count
+                if count < self.chunk_size:
+                    break
+                if deadline is not None and monotonic() >= deadline:
+                    debug('Cleanup: Time budget of %ss exhausted.',
+                          self.time_budget)
+                    return self._done(deleted, start)
+        return self._done(deleted, start)
+
+    def _done(self, deleted, start):
+        elapsed = monotonic() - start
+        self.rate = deleted / elapsed if elapsed else float(deleted)
+        self.deleted += deleted
+        if deleted:
+            debug('Cleanup: %s objects purged in %.2fs (%.1f/s).',
+                  deleted, elapsed, self.rate)
+        return deleted
+
+    @property
+    def running(self):
+        """Return whether a background purge is running."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, expire_task_states):
+        """Run :meth:`purge` in a background thread.
+
+        Does nothing if a background purge is still running, returns
+        whether a new one was started.
+        """
+        if self.running:
+            debug('Cleanup: Previous purge still running.')
+            return False
+        self._thread = threading.Thread(
+            target=self._run, args=(expire_task_states,),
+            name='celery-monitor-purge',
+        )
+        self._thread.daemon = True
+        self._thread.start()
+        return True
+
+    def join(self, timeout=None):
+        """Wait for the background purge to finish."""
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self, expire_task_states):
+        try:
+            self.purge(expire_task_states)
+        except Exception:
+            logger.exception('Cleanup: Purging task states failed.')
+        finally:
+            # The thread has its own database connections.
+            connections.close_all()
@@ -0,0 +1,226 @@
+"""Streaming recorder of the Celery events, without snapshots."""
+from __future__ import absolute_import, unicode_literals
+
+import threading
+
+from celery import platforms, states
+from celery.app import app_or_default
+from celery.events.state import TASK_EVENT_TO_STATE, Task
+from celery.utils.functional import LRUCache
+from celery.utils.log import get_logger
+
+from .camera import LIFECYCLE_FIELDS, TASK_CACHE_SIZE, Camera
+
+RECORDER_BATCH_SIZE = 1000  # number of tasks written per flush.
+RECORDER_FLUSH_INTERVAL = 1.0  # seconds between flushes.
+
+logger = get_logger(__name__)
+debug = logger.debug
+
+
+class TaskRecord(object):
+    """The fields of a task merged from its events since the last flush.
+
+    A compact stand-in for :class:`celery.events.state.Task` with just
+    the fields written by the camera, merging events the same way.
+    """
+
+    __slots__ = (
+        'uuid', 'name', 'state', 'clock', 'timestamp', 'args', 'kwargs',
+        'eta', 'expires', 'retries', 'result', 'exception', 'traceback',
+        'runtime', 'worker',
+    ) + LIFECYCLE_FIELDS
+    merge_rules = Task.merge_rules
+
+    def __init__(self, uuid, name=None, worker=None):
+        self.uuid = uuid
+        self.name = name
+        self.state = states.PENDING
+        self.clock = 0
+        self.timestamp = self.args = self.kwargs = self.eta = None
+        self.expires = self.retries = self.result = self.exception = None
+        self.traceback = self.runtime = None
+        self.received = self.started = self.succeeded = self.failed = None
+        self.worker = worker
+
+    def event(self, type_, fields):
+        """Merge an event of the task, e.g. ``received`` or ``failed``."""
+        state = TASK_EVENT_TO_STATE.get(type_) or type_.upper()
+        if type_ in LIFECYCLE_FIELDS:
+            # like ``Task.event`` whatever the precedence of the state.
+            setattr(self, type_, fields.get('timestamp'))
+        retry = states.RETRY in (state, self.state)
+        if not retry and (
+                states.precedence(state) > states.precedence(self.state)):
+            # this state logically happens-before the current state.
+            keep = self.merge_rules.get(state)
+            if keep is not None:
+                fields = dict((key, value) for key, value in fields.items()
+                              if key in keep)
+        else:
+            fields = dict(fields, state=state)
+        for key, value in fields.items():
+            if key in RECORD_FIELDS:
+                setattr(self, key, value)
+
+
+#: The fields of task records set from the events.
+RECORD_FIELDS = frozenset(TaskRecord.__slots__) - frozenset(
+    ('uuid', 'worker') + LIFECYCLE_FIELDS,
+)
+
+
+class WorkerRecord(object):
+    """The last heartbeat of a worker, like a celery ``Worker``."""
+
+    __slots__ = ('hostname', 'heartbeats')
+
+    def __init__(self, hostname):
+        self.hostname = hostname
+        self.heartbeats = []
+
+    def event(self, type_, fields):
+        """Merge an event of the worker, e.g. ``heartbeat``."""
+        if type_ == 'offline':
+            self.heartbeats = []
+        elif fields.get('local_received'):
+            self.heartbeats = [fields['local_received']]
+
+
+class Recorder(object):
+    """Record the events of tasks in micro-batches, as they come in.
+
+    Unlike the snapshots of the :class:`~.camera.Camera` the events are
+    not folded into a :class:`celery.events.state.State` first, but
+    merged per task into small records that are written and dropped as
+    soon as a batch is full or the flush interval passed. Besides the
+    records of a batch only the names of recent tasks and the last
+    heartbeats of the workers are kept.
+
+    Arguments:
+        camera (~.camera.Camera): The camera writing the batches.
+        batch_size (int): The number of tasks after which a batch is
+            written right away.
+        flush_interval (float): The number of seconds between writes
+            of the batches.
+        name_cache_size (int): The number of task UUIDs to remember the
+            name and the received and started timestamps of, for later
+            events without them.
+    """
+
+    def __init__(self, camera, batch_size=RECORDER_BATCH_SIZE,
+                 flush_interval=RECORDER_FLUSH_INTERVAL,
+                 name_cache_size=TASK_CACHE_SIZE):
+        self.camera = camera
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        #: Mapping of task UUIDs to the records of the current batch.
+        self.tasks = {}
+        #: Mapping of hostnames to worker records.
+        self.workers = {}
+        #: Mapping of task UUIDs to their names.
+        self.names = LRUCache(limit=name_cache_size)
+        #: Mapping of task UUIDs to ``(received, started)`` timestamps,
+        #: for the queue waits of tasks spanning batches.
+        self.timestamps = LRUCache(limit=name_cache_size)
+        self._mutex = threading.Lock()
+        self._flush_mutex = threading.Lock()
+        self._tref = self._ctref = None
+
+    def install(self):
+        """Set up the camera and start flushing and cleaning up."""
+        self.camera.setup()
+        timer = self.camera.timer
+        self._tref = timer.call_repeatedly(self.flush_interval, self.flush)
+        self._ctref = timer.call_repeatedly(
+            self.camera.cleanup_freq, self.camera.cleanup,
+        )
+
+    def cancel(self):
+        """Stop flushing, writing the current batch."""
+        for tref in (self._tref, self._ctref):
+            if tref is not None:
+                tref.cancel()
+        self.flush()
+
+    def on_event(self, event):
+        """Merge an event into the current batch."""
+        group, _, subject = event['type'].partition('-')
+        with self._mutex:
+            if group == 'task':
+                self._task_event(subject, event)
+            elif group == 'worker':
+                self._worker(event['hostname']).event(subject, event)
+            full = len(self.tasks) >= self.batch_size
+        if full:
+            self.flush()
+
+    def _worker(self, hostname):
+        try:
+            return self.workers[hostname]
+        except KeyError:
+            worker = self.workers[hostname] = WorkerRecord(hostname)
+            return worker
+
+    def _task_event(self, subject, event):
+        uuid = event['uuid']
+        task = self.tasks.get(uuid)
+        if task is None:
+            task = self.tasks[uuid] = TaskRecord(
+                uuid, name=self.names.get(uuid),
+            )
+            task.received, task.started = self.timestamps.get(
+                uuid, (None, None),
+            )
+        if event.get('hostname'):
+            task.worker = self._worker(event['hostname'])
+        task.event(subject, event)
+        if task.name:
+            self.names[uuid] = task.name
+        if subject in ('received', 'started'):
+            self.timestamps[uuid] = (task.received, task.started)
+
+    def flush(self):
+        """Write the current batch, returns the number of written tasks."""
+        with self._flush_mutex:
+            with self._mutex:
+                tasks, self.tasks = self.tasks, {}
+                workers = list(self.workers.items())
+            camera = self.camera
+            worker_ids = camera.handle_workers(workers)
+            uuid_tasks = camera.get_owned_tasks(tasks.items())
+            camera.write_tasks(uuid_tasks, worker_ids)
+            if uuid_tasks:
+                debug('Recorder: Wrote %s tasks.', len(uuid_tasks))
+            return len(uuid_tasks)
+
+
+def evrecord(camera=Camera, batch_size=RECORDER_BATCH_SIZE,
+             flush_interval=RECORDER_FLUSH_INTERVAL, cleanup_freq=3600.0,
+             loglevel=0, logfile=None, pidfile=None, app=None):
+    """Record the events with a :class:`Recorder` until interrupted.
+
+    The streaming counterpart of :func:`celery.events.snapshot.evcam`.
+    """
+    app = app_or_default(app)
+
+    if pidfile:
+        platforms.create_pidlock(pidfile)
+
+    app.log.setup_logging_subsystem(loglevel, logfile)
+
+    recorder = Recorder(
+        camera(None, app=app, cleanup_freq=cleanup_freq),
+        batch_size=batch_size, flush_interval=flush_interval,
+    )
+    recorder.install()
+    conn = app.connection_for_read()
+    recv = app.events.Receiver(conn, handlers={'*': recorder.on_event})
+    try:
+        try:
+            recv.capture(limit=None)
+        except KeyboardInterrupt:
+            raise SystemExit
+    finally:
+        recorder.cancel()
+        conn.close()
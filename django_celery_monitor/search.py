@@ -0,0 +1,184 @@
+"""Full-text search index of the task states."""
+from __future__ import absolute_import, unicode_literals
+
+from celery.utils.log import get_logger
+from django.db import DatabaseError, connections, router, transaction
+from django.db.models.expressions import RawSQL
+
+#: The task state fields included in the search index.
+SEARCH_FIELDS = ('name', 'task_id', 'args', 'kwargs', 'result', 'traceback')
+
+#: The number of characters of each field indexed on PostgreSQL,
+#: since a ``tsvector`` can't be larger than 1MB.
+SEARCH_TEXT_LIMIT = 100000
+
+SEARCH_SUFFIX = '_search'
+
+logger = get_logger(__name__)
+debug = logger.debug
+
+
+class RawSubquery(RawSQL):
+    """A raw subquery usable as the right hand side of ``__in`` lookups."""
+
+    def as_sql(self, compiler, connection):
+        # The lookup wraps the subquery in parentheses already.
+        return self.sql, self.params
+
+
+class SearchIndex(object):
+    """A full-text search index of the task states.
+
+    On SQLite the task states are copied into an FTS5 table by triggers,
+    and on PostgreSQL an expression GIN index of their ``tsvector``
+    is used, so the index is updated with every write of the camera.
+    Other databases don't support the index.
+
+    Arguments:
+        TaskState (Type[~django_celery_monitor.models.TaskState]):
+            The data model the task states are stored in.
+        using (str): The alias of the database, defaults to the
+            database the task states are written to.
+    """
+
+    def __init__(self, TaskState, using=None):
+        self.TaskState = TaskState
+        self.using = using or router.db_for_write(TaskState)
+
+    @property
+    def connection(self):
+        return connections[self.using]
+
+    @property
+    def supported(self):
+        """Return whether the database supports the search index."""
+        return self.connection.vendor in ('postgresql', 'sqlite')
+
+    @property
+    def table(self):
+        return self.TaskState._meta.db_table
+
+    @property
+    def name(self):
+        """Return the name of the search table or index."""
+        return self.table + SEARCH_SUFFIX
+
+    @property
+    def columns(self):
+        return [self.TaskState._meta.get_field(name).column
+                for name in SEARCH_FIELDS]
+
+    def trigger_name(self, action):
+        return '{0}_{1}'.format(self.name, action)
+
+    def document_sql(self):
+        """Return the PostgreSQL ``tsvector`` expression of a task state."""
+        qn = self.connection.ops.quote_name
+        text = " || ' ' || ".join(
+            "left(coalesce({0}, ''), {1})".format(qn(column),
+                                                  SEARCH_TEXT_LIMIT)
+            for column in self.columns
+        )
+        return "to_tsvector('simple', {0})".format(text)
+
+    def installed(self):
+        """Return whether the search index exists and is kept in sync."""
+        if not self.supported:
+            return False
+        with self.connection.cursor() as cursor:
+            if self.connection.vendor == 'sqlite':
+                cursor.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'trigger' "
+                    "AND name = %s", [self.trigger_name('update')],
+                )
+            else:
+                cursor.execute(
+                    'SELECT 1 FROM pg_class WHERE relname = %s', [self.name],
+                )
+            return cursor.fetchone() is not None
+
+    def install(self):
+        """Create the search index if missing and fill it.
+
+        Returns whether the index was created.
+        """
+        if not self.supported:
+            debug('Search: %s has no full-text index, searching with LIKE.',
+                  self.connection.vendor)
+            return False
+        if self.installed():
+            return False
+        try:
+            with transaction.atomic(using=self.using):
+                with self.connection.cursor() as cursor:
+                    if self.connection.vendor == 'sqlite':
+                        self._install_sqlite(cursor)
+                    else:
+                        self._install_postgresql(cursor)
+        except DatabaseError as exc:
+            logger.warning('Search: Cannot create the search index: %r', exc)
+            return False
+        debug('Search: Indexed %s.', self.table)
+        return True
+
+    def _install_sqlite(self, cursor):
+        qn = self.connection.ops.quote_name
+        columns = ', '.join(qn(column) for column in self.columns)
+        values = '{0}.' + ', {0}.'.join(qn(column) for column in self.columns)
+        insert = (
+            'INSERT INTO {0} (rowid, {1}) VALUES (new.{2}, {3});'.format(
+                qn(self.name), columns, qn('id'), values.format('new'))
+        )
+        delete = (
+            "INSERT INTO {0} ({0}, rowid, {1}) "
+            "VALUES ('delete', old.{2}, {3});".format(
+                qn(self.name), columns, qn('id'), values.format('old'))
+        )
+        # Triggers get lost when migrations rebuild the table.
+        cursor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS {0} USING fts5({1}, "
+            "content='{2}', content_rowid='id')".format(
+                qn(self.name), columns, self.table),
+        )
+        for action, body in (('insert', insert),
+                             ('delete', delete),
+                             ('update', delete + ' ' + insert)):
+            cursor.execute(
+                'CREATE TRIGGER IF NOT EXISTS {0} AFTER {1} ON {2} '
+                'BEGIN {3} END'.format(
+                    qn(self.trigger_name(action)), action.upper(),
+                    qn(self.table), body),
+            )
+        cursor.execute("INSERT INTO {0} ({0}) VALUES ('rebuild')".format(
+            qn(self.name)))
+
+    def _install_postgresql(self, cursor):
+        qn = self.connection.ops.quote_name
+        cursor.execute('CREATE INDEX {0} ON {1} USING gin (({2}))'.format(
+            qn(self.name), qn(self.table), self.document_sql()))
+
+    def match_sql(self, term):
+        """Return the SQL and params selecting the ids of matching tasks.
+
+        All words of the term have to be found in a task state.
+        """
+        qn = self.connection.ops.quote_name
+        if self.connection.vendor == 'sqlite':
+            query = ' '.join(
+                '"{0}"'.format(word.replace('"', '""'))
+                for word in term.split()
+            )
+            return 'SELECT rowid FROM {0} WHERE {0} MATCH %s'.format(
+                qn(self.name)), [query]
+        return (
+            "SELECT {0} FROM {1} WHERE {2} @@ plainto_tsquery('simple', %s)"
+            .format(qn('id'), qn(self.table), self.document_sql())
+        ), [term]
+
+    def matching(self, term):
+        """Return an expression of the ids of the matching task states."""
+        return RawSubquery(*self.match_sql(term))
+
+    def search(self, queryset, term):
+        """Filter the queryset by the search term."""
+        return queryset.filter(pk__in=self.matching(term))
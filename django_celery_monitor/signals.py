@@ -0,0 +1,28 @@
+"""The signals sent by the camera around its phases.
+
+The phases are ``shutter`` (a snapshot), ``workers`` (writing the worker
+heartbeats), ``tasks`` (writing a batch of task states) and ``cleanup``
+(purging expired task states). The sender is the camera, and the signals
+are only sent while receivers are connected.
+"""
+from __future__ import absolute_import, unicode_literals
+
+from celery.utils.dispatch import Signal
+
+__all__ = ['phase_started', 'phase_finished']
+
+#: Sent before a phase, with its ``phase`` name and the ``count`` of the
+#: tasks or workers it handles, or :const:`None` if not known yet.
+phase_started = Signal(
+    name='phase_started',
+    providing_args={'phase', 'count'},
+)
+
+#: Sent after a phase, with its ``phase`` name, the ``count`` of handled
+#: tasks, workers or purged rows, its ``duration`` in seconds, the number
+#: of database ``queries`` it ran, or :const:`None` if not counted, and
+#: the ``exception`` it raised if any.
+phase_finished = Signal(
+    name='phase_finished',
+    providing_args={'phase', 'count', 'duration', 'queries', 'exception'},
+)
@@ -0,0 +1,124 @@
+"""Mergeable quantile sketches of task runtimes."""
+from __future__ import absolute_import, unicode_literals
+
+import json
+import math
+
+#: The default relative accuracy of the quantiles.
+RELATIVE_ACCURACY = 0.01
+
+#: Values up to this are counted as zero.
+MIN_VALUE = 1e-9
+
+
+class DDSketch(object):
+    """A quantile sketch with a relative accuracy guarantee.
+
+    Values are counted in logarithmically sized buckets, so that every
+    quantile is returned within ``relative_accuracy`` of the true value,
+    see "DDSketch: A Fast and Fully-Mergeable Quantile Sketch with
+    Relative-Error Guarantees" (Masson et al., 2019). Sketches of the
+    same accuracy are merged by adding up their buckets, and a sketch of
+    runtimes from a millisecond to a day needs less than a thousand
+    buckets at 1% accuracy.
+
+    Arguments:
+        relative_accuracy (float): The maximum relative error of the
+            quantiles, between 0 and 1.
+    """
+
+    def __init__(self, relative_accuracy=RELATIVE_ACCURACY):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError('relative_accuracy must be between 0 and 1')
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        #: Mapping of bucket indexes to counts.
+        self.bins = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = self.max = None
+
+    def __len__(self):
+        return self.count
+
+    def add(self, value, count=1):
+        """Add a non-negative value to the sketch."""
+        if value <= MIN_VALUE:
+            self.zero_count += count
+        else:
+            index = int(math.ceil(math.log(value) / self._log_gamma))
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.count += count
+        self.sum += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """Add the values of another sketch of the same accuracy."""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError('Cannot merge sketches of different accuracy')
+        if not other.count:
+            return self
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        if self.min is None or other.min < self.min:
+            self.min = other.min
+        if self.max is None or other.max > self.max:
+            self.max = other.max
+        return self
+
+    def quantile(self, q):
+        """Return the value at the quantile ``q`` between 0 and 1.
+
+        Returns :const:`None` for empty sketches.
+        """
+        if not self.count:
+            return None
+        if not 0 <= q <= 1:
+            raise ValueError('q must be between 0 and 1')
+        rank = q * (self.count - 1)
+        if rank >= self.count - 1:
+            return self.max
+        seen = self.zero_count
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def to_json(self):
+        """Return the sketch serialized to compact JSON."""
+        return json.dumps({
+            'a': self.relative_accuracy,
+            'b': dict((str(index), count)
+                      for index, count in self.bins.items()),
+            'z': self.zero_count,
+            'n': self.count,
+            's': self.sum,
+            'min': self.min,
+            'max': self.max,
+        }, separators=(',', ':'), sort_keys=True)
+
+    @classmethod
+    def from_json(cls, value):
+        """Return the sketch serialized with :meth:`to_json`."""
+        data = json.loads(value)
+        sketch = cls(data['a'])
+        sketch.bins = dict((int(index), count)
+                           for index, count in data['b'].items())
+        sketch.zero_count = data['z']
+        sketch.count = data['n']
+        sketch.sum = data['s']
+        sketch.min = data['min']
+        sketch.max = data['max']
+        return sketch
@@ -0,0 +1,30 @@
+"""Template tags for the monitor admin."""
+from __future__ import absolute_import, unicode_literals
+
+from django import template
+from django.contrib.admin.templatetags.admin_list import pagination
+
+from ..admin import AFTER_VAR, BEFORE_VAR
+
+register = template.Library()
+
+
+@register.inclusion_tag('django_celery_monitor/pagination.html')
+def estimated_pagination(cl):
+    """Render the admin pagination, prefixing estimated counts."""
+    return pagination(cl)
+
+
+@register.inclusion_tag('django_celery_monitor/keyset_pagination.html')
+def keyset_pagination(cl):
+    """Render links to the previous and next pages of cursor pagination."""
+    previous_url = next_url = None
+    if cl.previous_cursor:
+        previous_url = cl.get_query_string({BEFORE_VAR: cl.previous_cursor})
+    if cl.next_cursor:
+        next_url = cl.get_query_string({AFTER_VAR: cl.next_cursor})
+    return {
+        'cl': cl,
+        'previous_url': previous_url,
+        'next_url': next_url,
+    }
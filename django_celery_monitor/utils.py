@@ -3,6 +3,7 @@
 # -- a recursive loader import!
 from __future__ import absolute_import, unicode_literals
 
+import zlib
 from datetime import datetime
 from pprint import pformat
 
@@ -33,6 +34,25 @@ except ImportError:
             return self.as_sql(compiler, connection)
 
 
+#: The number of characters of the previews of long task fields.
+PREVIEW_LENGTH = 255
+
+
+def preview(value, length=PREVIEW_LENGTH):
+    """Return the start of a long text value to show in lists."""
+    if value is None:
+        return None
+    return value[:length]
+
+
+def shard_of(key, count):
+    """Return the shard of the given text key out of ``count`` shards.
+
+    Stable across processes, unlike :func:`hash` of strings.
+    """
+    return (zlib.crc32(key.encode('utf-8')) & 0xffffffff) % count
+
+
 def make_aware(value):
     """Make the given datetime aware of a timezone."""
     if settings.USE_TZ:
@@ -0,0 +1,132 @@
+"""Background writer threads of the camera."""
+from __future__ import absolute_import, unicode_literals
+
+import threading
+
+from celery.five import Full, Queue
+from celery.utils.log import get_logger
+from django.db import connections
+
+from .utils import shard_of
+
+WRITER_QUEUE_SIZE = 10  # number of jobs queued per writer thread.
+
+logger = get_logger(__name__)
+debug = logger.debug
+
+#: Put into the queues to stop the writer threads.
+STOP = object()
+
+
+class Writers(object):
+    """A pool of threads running database writes off the timer thread.
+
+    Every thread has a bounded queue of jobs, and jobs are sharded by
+    key, e.g. the task UUID, so the writes of a key always run in order
+    in the same thread. Every thread uses its own database connection.
+
+    Submitting to a full queue waits for the writer thread to catch up,
+    which holds up the caller, e.g. the snapshots of the camera and with
+    them the events consumed, instead of queuing writes without bounds.
+
+    Arguments:
+        threads (int): The number of writer threads.
+        queue_size (int): The maximum number of jobs queued per thread.
+        timeout (float): The number of seconds to wait for a full queue
+            before dropping a job, or :const:`None` to wait for good.
+    """
+
+    def __init__(self, threads=1, queue_size=WRITER_QUEUE_SIZE,
+                 timeout=None):
+        self.threads = max(threads, 1)
+        self.queue_size = queue_size or WRITER_QUEUE_SIZE
+        self.timeout = timeout
+        self.queues = [Queue(self.queue_size) for _ in range(self.threads)]
+        #: The number of jobs dropped because their queue was full.
+        self.dropped = 0
+        self._threads = []
+
+    def shard(self, key):
+        """Return the index of the writer thread writing the given key."""
+        return shard_of(key, self.threads)
+
+    def depths(self):
+        """Return the number of jobs queued per writer thread."""
+        return [queue.qsize() for queue in self.queues]
+
+    @property
+    def pending(self):
+        """Return the number of jobs queued in all writer threads."""
+        return sum(self.depths())
+
+    @property
+    def running(self):
+        """Return whether the writer threads are running."""
+        return any(thread.is_alive() for thread in self._threads)
+
+    def start(self):
+        """Start the writer threads."""
+        if self.running:
+            return
+        self._threads = [
+            threading.Thread(
+                target=self._run, args=(queue,),
+                name='celery-monitor-writer-{0}'.format(index),
+            )
+            for index, queue in enumerate(self.queues)
+        ]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def submit(self, shard, fun, *args):
+        """Queue a call to ``fun`` in the given writer thread.
+
+        Waits while the queue is full, up to the ``timeout``.
+        Returns whether the job was queued.
+        """
+        queue = self.queues[shard]
+        try:
+            queue.put((fun, args), block=False)
+        except Full:
+            debug('Writers: Queue %s is full, waiting.', shard)
+            try:
+                queue.put((fun, args), timeout=self.timeout)
+            except Full:
+                self.dropped += 1
+                logger.warning(
+                    'Writers: Queue %s still full after %ss, '
+                    'dropped a job.', shard, self.timeout,
+                )
+                return False
+        return True
+
+    def join(self):
+        """Wait for all queued jobs to be done."""
+        for queue in self.queues:
+            queue.join()
+
+    def stop(self, timeout=None):
+        """Write the queued jobs and stop the writer threads."""
+        for queue in self.queues:
+            queue.put(STOP)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self, queue):
+        try:
+            while True:
+                job = queue.get()
+                try:
+                    if job is STOP:
+                        return
+                    fun, args = job
+                    fun(*args)
+                except Exception:
+                    logger.exception('Writers: Writing failed.')
+                finally:
+                    queue.task_done()
+        finally:
+            # The thread has its own database connections.
+            connections.close_all()
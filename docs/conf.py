@@ -26,6 +26,7 @@ globals().update(conf.build_config(
         'django_celery_monitor.apps',
         'django_celery_monitor.admin',
         r'django_celery_monitor.migrations.*',
+        r'django_celery_monitor.templatetags.*',
     ],
     suppress_warnings=['image.nonlocal_uri'],
 ))
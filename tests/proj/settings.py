@@ -76,9 +76,22 @@ DATABASES = {
         'OPTIONS': {
             'timeout': 1000,
         },
+        # A file instead of a shared in-memory database, which fails
+        # concurrent writes of threads right away instead of waiting.
+        'TEST': {
+            'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3'),
+        },
     }
 }
 
+if os.environ.get('TEST_POSTGRESQL'):
+    # Run the tests on PostgreSQL, connecting with the libpq environment
+    # variables like PGHOST, PGPORT and PGUSER.
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('PGDATABASE', 'celery_monitor'),
+    }
+
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
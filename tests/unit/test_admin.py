@@ -0,0 +1,286 @@
+from __future__ import absolute_import, unicode_literals
+
+import pytest
+
+from datetime import timedelta
+
+from celery import states
+from celery.utils import gen_unique_id
+
+from django.apps import apps
+from django.contrib import admin
+from django.test import RequestFactory
+from django.utils import timezone
+
+from django_celery_monitor import models, pagination
+from django_celery_monitor.apps import update_row_counts
+from django_celery_monitor.search import SearchIndex
+from django_celery_monitor.admin import (
+    EstimatedCountMonitorList, ExceptionGroupMonitor, KeysetMonitorList,
+    MonitorList, TaskMonitor, TaskNameListFilter, TaskRollupMonitor,
+)
+
+
+@pytest.mark.usefixtures('depends_on_current_app')
+@pytest.mark.django_db
+@pytest.mark.urls('tests.proj.urls')
+class test_TaskMonitor:
+
+    @pytest.fixture(autouse=True)
+    def setup_admin(self, app, admin_user):
+        self.app = app
+        self.monitor = TaskMonitor(models.TaskState, admin.site)
+        self.admin_user = admin_user
+
+    def create_tasks(self, count, state=states.SUCCESS, name='A'):
+        now = timezone.now()
+        task_name, _ = models.TaskName.objects.get_or_create(
+            name=name, defaults={'first_seen': now, 'last_seen': now},
+        )
+        models.TaskState.objects.bulk_create([
+            models.TaskState(
+                task_id=gen_unique_id(), state=state, name=name,
+                task_name=task_name,
+                # every other task shares the timestamp of the previous one
+                tstamp=now - timedelta(seconds=i // 2),
+            ) for i in range(count)
+        ])
+
+    def changelist(self, **params):
+        request = RequestFactory().get('/', params)
+        request.user = self.admin_user
+        response = self.monitor.changelist_view(request)
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+
+    def test_changelist(self):
+        self.create_tasks(3)
+        response = self.changelist()
+        assert response.status_code == 200
+        assert isinstance(response.context_data['cl'], MonitorList)
+        assert b'3 tasks' in response.content
+
+    def test_changelist_defers_large_fields(self):
+        models.TaskState.objects.create(
+            task_id=gen_unique_id(), state=states.SUCCESS, name='A',
+            args='[' + 'x' * 1000 + ']', args_preview='[xxx',
+            tstamp=timezone.now(),
+        )
+        response = self.changelist()
+        task = response.context_data['cl'].result_list[0]
+        assert task.get_deferred_fields() == {
+            'args', 'kwargs', 'result', 'traceback',
+        }
+        assert b'[xxx' in response.content
+        assert b'x' * 300 not in response.content
+
+    def test_changelist_state_filter(self):
+        self.create_tasks(3)
+        self.create_tasks(2, state=states.FAILURE)
+        # ranked when updated without saving it too.
+        models.TaskState.objects.filter(pk=models.TaskState.objects.filter(
+            state=states.SUCCESS).values_list('pk', flat=True)[0],
+        ).update(state=states.FAILURE)
+        cl = self.changelist(state=states.FAILURE).context_data['cl']
+        assert cl.result_count == 3
+        assert 'state_rank' in str(cl.queryset.query)
+
+    def test_changelist_name_filter(self):
+        self.create_tasks(3, name='A')
+        self.create_tasks(2, name='B')
+        models.TaskName.objects.filter(name='B').delete()
+        response = self.changelist(name='A')
+        cl = response.context_data['cl']
+        assert cl.result_count == 3
+        name_filter = [f for f in cl.filter_specs
+                       if isinstance(f, TaskNameListFilter)][0]
+        assert name_filter.lookup_choices == [('A', 'A')]
+        assert self.changelist(name='B').context_data['cl'].result_count == 2
+
+    def test_changelist_queue_wait_filter(self):
+        self.create_tasks(4)
+        for queue_wait, pks in zip((0.5, 5.0, 120.0), (
+                models.TaskState.objects.values_list('pk', flat=True))):
+            models.TaskState.objects.filter(pk=pks).update(
+                queue_wait=queue_wait,
+            )
+        for value, count in (('0-1', 1), ('1-10', 1), ('10-60', 0),
+                             ('60-', 1)):
+            cl = self.changelist(queue_wait=value).context_data['cl']
+            assert cl.result_count == count
+        assert self.changelist().context_data['cl'].result_count == 4
+
+    def test_changelist_search(self):
+        self.app.conf.monitors_search_index = True
+        self.create_tasks(3)
+        worker = models.WorkerState.objects.create(hostname='cust-worker')
+        models.TaskState.objects.filter(name='A').update(worker=worker)
+        # no index installed yet, so search falls back to LIKE.
+        assert self.changelist(q='cust').context_data['cl'].result_count == 3
+        SearchIndex(models.TaskState).install()
+        models.TaskState.objects.create(
+            task_id=gen_unique_id(), state=states.SUCCESS, name='B',
+            kwargs="{'customer': 'cust-1234'}", tstamp=timezone.now(),
+        )
+        cl = self.changelist(q='cust-1234').context_data['cl']
+        assert [task.name for task in cl.result_list] == ['B']
+        cl = self.changelist(q='cust-worker').context_data['cl']
+        assert cl.result_count == 3
+
+    def test_rate_limit_tasks(self, patching):
+        rate_limit = patching('django_celery_monitor.admin.rate_limit')
+        self.create_tasks(3, name='A')
+        self.create_tasks(2, name='B')
+        # names missing from the catalog are rate limited too.
+        models.TaskName.objects.filter(name='B').delete()
+        request = RequestFactory().post('/', {
+            'post': 'yes', 'rate_limit': '10/m',
+        })
+        request.user = self.admin_user
+        self.monitor.rate_limit_tasks(request, models.TaskState.objects.all())
+        assert sorted(
+            call[0][:2] for call in rate_limit.call_args_list
+        ) == [('A', '10/m'), ('B', '10/m')]
+
+    def test_exception_groups(self):
+        now = timezone.now()
+        group = models.ExceptionGroup.objects.create(
+            fingerprint='a' * 40, exception='KeyError', traceback='KeyError',
+            count=2, first_seen=now, last_seen=now,
+        )
+        self.create_tasks(2, state=states.FAILURE)
+        self.create_tasks(1, state=states.FAILURE)
+        models.TaskState.objects.filter(pk__in=list(
+            models.TaskState.objects.values_list('pk', flat=True)[:2],
+        )).update(exception_group=group)
+        monitor = ExceptionGroupMonitor(models.ExceptionGroup, admin.site)
+        request = RequestFactory().get('/')
+        request.user = self.admin_user
+        response = monitor.changelist_view(request)
+        response.render()
+        assert '?exception_group__id__exact={0}'.format(
+            group.pk).encode() in response.content
+        cl = self.changelist(exception_group__id__exact=group.pk)
+        assert cl.context_data['cl'].result_count == 2
+
+    def test_task_rollups(self):
+        minute = timezone.now().replace(second=0, microsecond=0)
+        models.TaskRollup.objects.create(
+            name='A', state=states.SUCCESS, minute=minute, count=4,
+            runtime_sum=2.0, runtime_min=0.25, runtime_max=1.0,
+            queue_wait_sum=10.0, queue_wait_min=1.0, queue_wait_max=4.0,
+        )
+        monitor = TaskRollupMonitor(models.TaskRollup, admin.site)
+        request = RequestFactory().get('/', {'state': states.SUCCESS})
+        request.user = self.admin_user
+        response = monitor.changelist_view(request)
+        response.render()
+        assert response.context_data['cl'].result_count == 1
+        assert b'0.500' in response.content
+        assert b'2.500' in response.content
+
+    def test_changelist_estimated_counts(self, patching):
+        self.app.conf.monitors_estimate_counts = True
+        pagination.install_row_count(models.TaskState, 'default')
+        patching.object(
+            pagination.EstimatedCountPaginator, 'exact_count_limit', 5,
+        )
+        self.create_tasks(8)
+        self.create_tasks(2, state=states.FAILURE)
+
+        response = self.changelist()
+        cl = response.context_data['cl']
+        assert isinstance(cl, EstimatedCountMonitorList)
+        # SQLite maintains the row count in a table.
+        assert cl.result_count == 10
+        assert cl.result_count_estimated
+        assert b'about 10 tasks' in response.content
+
+        cl = self.changelist(state=states.SUCCESS).context_data['cl']
+        assert cl.result_count == 5
+        assert cl.result_count_estimated
+
+        cl = self.changelist(state=states.FAILURE).context_data['cl']
+        assert cl.result_count == 2
+        assert not cl.result_count_estimated
+
+    def test_estimated_count_unfiltered(self, patching):
+        patching.object(
+            pagination.EstimatedCountPaginator, 'exact_count_limit', 5,
+        )
+        pagination.install_row_count(models.TaskState, 'default')
+        self.create_tasks(8)
+        paginator = pagination.EstimatedCountPaginator(
+            models.TaskState.objects.order_by('pk'), 5,
+        )
+        assert paginator.count == 8
+        assert paginator.estimated
+        # pages past the estimated end are empty instead of invalid.
+        assert list(paginator.page(3)) == []
+
+    def test_estimate_count_maintained(self):
+        self.create_tasks(2)
+        assert pagination.install_row_count(models.TaskState, 'default')
+        self.create_tasks(2)
+        assert pagination.estimate_count(models.TaskState) == 4
+        models.TaskState.objects.delete_chunk(3)
+        assert pagination.estimate_count(models.TaskState) == 1
+
+        assert pagination.drop_row_count(models.TaskState, 'default')
+        assert not pagination.drop_row_count(models.TaskState, 'default')
+        self.create_tasks(2)
+        assert pagination.estimate_count(models.TaskState) is None
+
+    def test_update_row_counts(self):
+        config = apps.get_app_config('celery_monitor')
+        update_row_counts(config, 'default')
+        assert pagination.estimate_count(models.TaskState) is None
+        self.app.conf.monitors_estimate_counts = True
+        update_row_counts(config, 'default')
+        assert pagination.estimate_count(models.TaskState) == 0
+        self.app.conf.monitors_estimate_counts = False
+        update_row_counts(config, 'default')
+        assert pagination.estimate_count(models.TaskState) is None
+
+    def test_changelist_keyset_pagination(self):
+        self.app.conf.monitors_keyset_pagination = True
+        self.monitor.list_per_page = 4
+        self.create_tasks(10)
+        self.create_tasks(3, name='B')
+        expected = list(models.TaskState.objects.filter(
+            name='A').order_by('-tstamp', '-pk'))
+
+        response = self.changelist(name='A')
+        cl = response.context_data['cl']
+        assert isinstance(cl, KeysetMonitorList)
+        assert cl.result_list == expected[:4]
+        assert cl.previous_cursor is None
+        assert b'Older' in response.content
+
+        pages = [cl.result_list]
+        while cl.next_cursor:
+            cl = self.changelist(
+                name='A', after=cl.next_cursor).context_data['cl']
+            pages.append(cl.result_list)
+        assert pages == [expected[:4], expected[4:8], expected[8:]]
+
+        cl = self.changelist(
+            name='A', before=cl.previous_cursor).context_data['cl']
+        assert cl.result_list == expected[4:8]
+        cl = self.changelist(
+            name='A', before=cl.previous_cursor).context_data['cl']
+        assert cl.result_list == expected[:4]
+        assert cl.previous_cursor is None
+
+    def test_changelist_keyset_pagination_sorted(self):
+        self.app.conf.monitors_keyset_pagination = True
+        self.create_tasks(3)
+        cl = self.changelist(o='1').context_data['cl']
+        assert not cl.keyset
+        assert cl.result_count == 3
+
+    def test_changelist_keyset_pagination_invalid_cursor(self):
+        self.app.conf.monitors_keyset_pagination = True
+        response = self.changelist(after='foo_bar')
+        assert response.status_code == 302
@@ -15,6 +15,7 @@ from django.test.utils import override_settings
 from django.utils import timezone
 
 from django_celery_monitor import camera, models
+from django_celery_monitor.metrics import Registry
 from django_celery_monitor.utils import make_aware
 
 
@@ -43,7 +44,7 @@ class test_Camera:
     def setup_app(self, app):
         self.app = app
         self.state = State()
-        self.cam = self.Camera(self.state)
+        self.cam = self.Camera(self.state, app=app)
 
     def test_constructor(self):
         cam = self.Camera(State())
@@ -82,6 +83,41 @@ class test_Camera:
         assert str(m) == str(m.hostname)
         assert repr(m)
 
+    def test_handle_workers(self, django_assert_num_queries):
+        worker1 = Worker(hostname='fuzzie')
+        worker1.event('online', time(), time(), {})
+        worker2 = Worker(hostname='wuzzie')
+        worker2.event('online', time(), time(), {})
+        workers = [(w.hostname, w) for w in (worker1, worker2)]
+
+        worker_ids = self.cam.handle_workers(workers)
+        assert worker_ids == dict(
+            models.WorkerState.objects.values_list('hostname', 'pk'),
+        )
+        with django_assert_num_queries(0):
+            assert self.cam.handle_workers(workers) == worker_ids
+
+        # heartbeats are not written more often than worker_update_freq
+        worker1.event('heartbeat', time(), time(), {})
+        with django_assert_num_queries(0):
+            assert self.cam.handle_workers(workers) == worker_ids
+
+        # but workers going offline are written right away
+        worker1.event('offline', time(), time(), {})
+        assert self.cam.handle_workers(workers) == worker_ids
+        assert not models.WorkerState.objects.get(
+            hostname='fuzzie').is_alive()
+        assert models.WorkerState.objects.get(hostname='wuzzie').is_alive()
+
+    def test_handle_workers_cache_size(self):
+        self.cam.worker_cache.limit = 2
+        workers = [Worker(hostname='w{0}'.format(i)) for i in range(5)]
+        worker_ids = self.cam.handle_workers(
+            (worker.hostname, worker) for worker in workers
+        )
+        assert len(worker_ids) == 5
+        assert len(self.cam.worker_cache) == 2
+
     def test_handle_task_received(self):
         worker = Worker(hostname='fuzzie')
         worker.event('online', time(), time(), {})
@@ -125,6 +161,46 @@ class test_Camera:
         mt = self.cam.handle_task((task3.uuid, task3))
         assert mt is None
 
+    def test_handle_task_previews(self):
+        task = self.create_task(Worker(hostname='fuzzie'))
+        task.event('received', time(), time(), {
+            'args': repr(list(range(1000))), 'kwargs': '{}',
+        })
+        mt = self.cam.handle_task((task.uuid, task))
+        assert mt.args_preview == task.args[:255]
+        assert mt.kwargs_preview == '{}'
+
+        task.event('succeeded', time(), time(), {'result': 42})
+        self.cam.handle_task((task.uuid, task))
+        mt = models.TaskState.objects.get(task_id=task.uuid)
+        assert mt.args_preview == task.args[:255]
+
+    def test_handle_task_payload_limits(self):
+        self.app.conf.monitors_payload_limits = [
+            ('proj.*', {'args': 0, 'kwargs': 10}),
+        ]
+        task = self.create_task(Worker(hostname='fuzzie'), name='proj.add')
+        task.event('received', time(), time(), {
+            'args': '[1, 2]', 'kwargs': repr({'x': 'y' * 100}),
+        })
+        mt = self.cam.handle_task((task.uuid, task))
+        assert mt.args == '[dropped, 6 bytes]'
+        assert mt.args_preview == mt.args
+        assert mt.kwargs == "{'x': 'yyy... [truncated, 109 bytes]"
+
+    def test_handle_task_search_index(self):
+        self.app.conf.monitors_search_index = True
+        traceback = 'KeyError: "cust-1234"\n' * 100
+        task = self.create_task(Worker(hostname='fuzzie'))
+        task.event('failed', time(), time(), {
+            'exception': 'KeyError()', 'traceback': traceback,
+        })
+        self.cam.handle_task((task.uuid, task))
+        self.cam.search_index.install()
+        assert self.cam.search_index.search(
+            models.TaskState.objects.all(), 'cust-1234',
+        ).get().traceback == traceback
+
     def test_handle_task_timezone(self):
         worker = Worker(hostname='fuzzie')
         worker.event('online', time(), time(), {})
@@ -202,9 +278,347 @@ class test_Camera:
     def test_on_cleanup_does_not_expire_new(self, dec=0):
         self.assert_expires(dec, 0)
 
+    def test_on_cleanup_in_background(self, patching):
+        self.app.conf.monitors_purge_in_background = True
+        start = patching('django_celery_monitor.purge.Purger.start')
+        assert self.cam.on_cleanup() == 0
+        start.assert_called_with(self.cam.expire_task_states)
+
+    def test_on_cleanup_partitioned(self):
+        self.app.conf.monitors_partitioned = True
+        self.app.conf.monitors_partition_retention = timedelta(days=7)
+        self.app.conf.monitors_expire_success = None
+        worker = Worker(hostname='fuzzie')
+        for dec in (8 * 24 * 3600, 0):
+            task = self.create_task(worker)
+            task.event('succeeded', time() - dec, time() - dec, {})
+            assert self.cam.handle_task((task.uuid, task))
+        self.cam.on_cleanup()
+        assert models.TaskState.objects.count() == 1
+
+    def test_upsert(self, patching):
+        self.app.conf.monitors_partitioned = True
+        # tables of databases without native partitioning stay unique.
+        assert self.cam.upsert
+        is_partitioned = patching(
+            'django_celery_monitor.partitions.Partitions.is_partitioned',
+        )
+        is_partitioned.return_value = True
+        cam = self.Camera(self.state, app=self.app)
+        assert not cam.upsert
+        assert not cam.upsert
+        is_partitioned.assert_called_once_with()
+
     def test_on_shutter(self):
+        self.assert_on_shutter()
+
+    def test_on_shutter_batch_writes(self):
+        self.app.conf.monitors_batch_writes = True
+        self.assert_on_shutter()
+
+    def test_on_shutter_batch_writes_without_upsert(self):
+        self.app.conf.monitors_batch_writes = True
+        supports_upsert = self.patching(
+            'django_celery_monitor.managers.supports_upsert',
+        )
+        supports_upsert.return_value = False
+        self.assert_on_shutter()
+        supports_upsert.assert_called()
+
+    @pytest.mark.parametrize('batch_writes', [False, True])
+    def test_on_shutter_lifecycle(self, batch_writes):
+        self.app.conf.monitors_batch_writes = batch_writes
+        uuid, now = gen_unique_id(), time()
+        self.state.event(Event('task-received', uuid=uuid, name='A',
+                               hostname='fuzzie', timestamp=now - 10))
+        self.cam.on_shutter(self.state)
+        task = models.TaskState.objects.get(task_id=uuid)
+        assert task.received == camera.fromtimestamp(now - 10)
+        assert task.started is None
+        assert task.queue_wait is None
+        list(map(self.state.event, [
+            Event('task-started', uuid=uuid, hostname='fuzzie',
+                  timestamp=now - 7.5),
+            Event('task-failed', uuid=uuid, hostname='fuzzie',
+                  timestamp=now - 5),
+        ]))
+        self.cam.on_shutter(self.state)
+        task = models.TaskState.objects.get(task_id=uuid)
+        assert task.received == camera.fromtimestamp(now - 10)
+        assert task.started == camera.fromtimestamp(now - 7.5)
+        assert task.failed == camera.fromtimestamp(now - 5)
+        assert task.succeeded is None
+        assert task.queue_wait == pytest.approx(2.5)
+        assert models.TaskState.objects.filter(
+            queue_wait__gte=2, received__lt=timezone.now(),
+        ).count() == 1
+
+    @pytest.mark.parametrize('batch_writes', [False, True])
+    def test_on_shutter_metrics(self, batch_writes):
+        self.app.conf.monitors_batch_writes = batch_writes
+        self.app.conf.monitors_metrics = True
+        self.cam.metrics_registry = registry = Registry()
+        self.assert_on_shutter()
+        metrics = self.cam.metrics
+        assert metrics.tasks.values() == {
+            ('A', states.STARTED): 1,
+            ('A', states.SUCCESS): 1,
+            ('B', states.RECEIVED): 1,
+            ('B', states.FAILURE): 1,
+            ('C', states.REVOKED): 1,
+        }
+        # three shutters, the last one without changes.
+        assert metrics.tasks_written.values() == {(): 5}
+        assert metrics.tasks_skipped.values() == {(): 4}
+        assert metrics.queries.values()[('tasks',)] > 0
+        assert metrics.queries.values()[('workers',)] > 0
+        durations = metrics.shutter_duration.values()[()]
+        assert sum(durations[:-1]) == 3
+        assert metrics.writer_queue_depth.values() == {}
+        assert metrics.cleanup_rows.values() == {(): 0}
+        models.TaskState.objects.update(hidden=True)
+        assert self.cam.on_cleanup() == 3
+        assert metrics.cleanup_rows.values() == {(): 3}
+        assert metrics.queries.values()[('cleanup',)] > 0
+        output = registry.render()
+        assert (
+            'celery_monitor_tasks_total{name="A",state="STARTED"} 1.0'
+        ) in output
+        assert 'celery_monitor_cleanup_rows_total 3.0' in output
+        assert 'celery_monitor_shutter_duration_seconds_count 3.0' in output
+
+    def test_metrics_disabled(self):
+        assert self.cam.metrics is None
+        assert self.cam.phase('tasks') is camera.NO_PHASE
+
+    def test_metrics_server(self, patching):
+        self.app.conf.monitors_metrics = True
+        self.app.conf.monitors_metrics_port = 0
+        self.app.conf.monitors_metrics_addr = '127.0.0.1'
+        self.cam.metrics_registry = Registry()
+        self.cam.setup()
+        try:
+            assert self.cam.metrics_server.address[1]
+        finally:
+            self.cam.cancel()
+        assert self.cam.metrics_server._server is None
+
+    @pytest.mark.parametrize('batch_writes', [False, True])
+    def test_on_shutter_rollups(self, batch_writes):
+        self.app.conf.monitors_batch_writes = batch_writes
+        self.app.conf.monitors_rollups = True
+        uus = [gen_unique_id() for i in range(3)]
+        now = time()
+        list(map(self.state.event, [
+            Event('task-received', uuid=uuid, name='A', hostname='fuzzie',
+                  timestamp=now - 2)
+            for uuid in uus
+        ]))
+        self.cam.on_shutter(self.state)
+        # unchanged states don't count again.
+        self.state.event(Event('task-started', uuid=uus[0],
+                               hostname='fuzzie', timestamp=now - 1))
+        self.cam.on_shutter(self.state)
+        list(map(self.state.event, [
+            Event('task-succeeded', uuid=uus[0], hostname='fuzzie',
+                  runtime=0.5),
+            Event('task-succeeded', uuid=uus[1], hostname='fuzzie',
+                  runtime=1.5),
+        ]))
+        self.cam.on_shutter(self.state)
+        totals = dict(
+            (total['state'], total) for total in
+            models.TaskRollup.objects.totals('name', 'state')
+        )
+        assert totals[states.RECEIVED]['tasks'] == 3
+        assert totals[states.STARTED]['tasks'] == 1
+        assert totals[states.SUCCESS]['tasks'] == 2
+        assert totals[states.SUCCESS]['total_runtime'] == 2.0
+        assert totals[states.SUCCESS]['min_runtime'] == 0.5
+        assert totals[states.SUCCESS]['max_runtime'] == 1.5
+        assert totals[states.STARTED]['total_queue_wait'] == pytest.approx(1)
+        assert totals[states.SUCCESS]['max_queue_wait'] == pytest.approx(1)
+        assert totals[states.RECEIVED]['max_queue_wait'] is None
+        assert not self.cam.rollups
+
+    @pytest.mark.parametrize('batch_writes', [False, True])
+    def test_on_shutter_runtime_sketches(self, batch_writes):
+        self.app.conf.monitors_batch_writes = batch_writes
+        self.app.conf.monitors_runtime_sketches = True
+        uus = [gen_unique_id() for i in range(10)]
+        list(map(self.state.event, [
+            Event('task-received', uuid=uuid, name='A', hostname='fuzzie')
+            for uuid in uus
+        ]))
+        self.cam.on_shutter(self.state)
+        list(map(self.state.event, [
+            Event('task-succeeded', uuid=uuid, hostname='fuzzie',
+                  runtime=float(i + 1))
+            for i, uuid in enumerate(uus)
+        ]))
+        self.cam.on_shutter(self.state)
+        # unchanged states don't count again.
+        self.cam.on_shutter(self.state)
+        sketch = models.RuntimeSketch.objects.get(name='A')
+        assert sketch.count == 10
+        assert sketch.window.minute == 0
+        quantiles = models.RuntimeSketch.objects.filter(
+            name='A').quantiles([0, 1])
+        assert quantiles == {0: 1.0, 1: 10.0}
+        assert not self.cam.runtime_sketches
+
+    @pytest.mark.parametrize('batch_writes', [False, True])
+    def test_on_shutter_sharded(self, batch_writes):
+        self.app.conf.monitors_batch_writes = batch_writes
+        self.app.conf.monitors_shard_count = 2
+        uus = [gen_unique_id() for i in range(20)]
+        list(map(self.state.event, [
+            Event('worker-online', hostname='fuzzie'),
+            Event('worker-online', hostname='wuzzie'),
+        ] + [
+            Event('task-received', uuid=uuid, name='A', hostname='fuzzie')
+            for uuid in uus
+        ]))
+        owned = [uuid for uuid in uus if camera.shard_of(uuid, 2) == 1]
+        assert 0 < len(owned) < len(uus)
+
+        self.app.conf.monitors_shard_index = 1
+        other = self.Camera(self.state, app=self.app)
+        assert not other.owns_workers
+        other.on_shutter(self.state)
+        assert set(models.TaskState.objects.values_list(
+            'task_id', flat=True)) == set(owned)
+        # the workers of the tasks are added, without their heartbeats.
+        fuzzie = models.WorkerState.objects.get()
+        assert fuzzie.hostname == 'fuzzie'
+        assert fuzzie.last_heartbeat is None
+        assert models.TaskState.objects.filter(worker=fuzzie).count() == len(
+            owned)
+        assert other.on_cleanup() == 0
+
+        self.app.conf.monitors_shard_index = 0
+        assert self.cam.owns_workers
+        self.cam.on_shutter(self.state)
+        assert models.TaskState.objects.count() == len(uus)
+        assert models.WorkerState.objects.count() == 2
+        assert models.WorkerState.objects.get(hostname='fuzzie').is_alive()
+
+    def test_install_shard_index(self):
+        self.app.conf.monitors_shard_count = 2
+        self.app.conf.monitors_shard_index = 2
+        with pytest.raises(ValueError):
+            self.cam.install()
+
+    @pytest.mark.django_db(transaction=True)
+    @pytest.mark.parametrize('batch_writes', [False, True])
+    def test_on_shutter_writer_threads(self, batch_writes):
+        self.app.conf.monitors_batch_writes = batch_writes
+        self.app.conf.monitors_writer_threads = 2
+        self.cam.writers.start()
+        try:
+            self.assert_on_shutter()
+        finally:
+            self.cam.writers.stop()
+        assert self.cam.writers.pending == 0
+        assert not self.cam.writers.running
+
+    @pytest.mark.parametrize('batch_writes', [False, True])
+    def test_on_shutter_skips_unchanged(self, batch_writes,
+                                        django_assert_num_queries):
+        self.app.conf.monitors_batch_writes = batch_writes
+        uus = [gen_unique_id() for i in range(3)]
+        events = [Event('worker-online', hostname='fuzzie')] + [
+            Event('task-received', uuid=uuid, name='A', hostname='fuzzie')
+            for uuid in uus
+        ] + [Event('task-started', uuid=uus[0], hostname='fuzzie')]
+        list(map(self.state.event, events))
+        assert self.cam.on_shutter(self.state) == 0
+
+        with django_assert_num_queries(0):
+            assert self.cam.on_shutter(self.state) == 3
+
+        self.state.event(Event(
+            'task-succeeded', uuid=uus[0], hostname='fuzzie', result=42,
+        ))
+        assert self.cam.on_shutter(self.state) == 2
+        t1 = models.TaskState.objects.get(task_id=uus[0])
+        assert t1.state == states.SUCCESS
+        assert t1.name == 'A'
+
+    @pytest.mark.parametrize('batch_writes', [False, True])
+    def test_on_shutter_task_names(self, batch_writes):
+        self.app.conf.monitors_batch_writes = batch_writes
+        uus = [gen_unique_id() for i in range(3)]
+        list(map(self.state.event, [
+            Event('task-received', uuid=uus[0], name='A', hostname='fuzzie'),
+            Event('task-received', uuid=uus[1], name='A', hostname='fuzzie'),
+        ]))
+        self.cam.on_shutter(self.state)
+        list(map(self.state.event, [
+            Event('task-started', uuid=uus[0], hostname='fuzzie'),
+            Event('task-received', uuid=uus[2], name='B', hostname='fuzzie'),
+        ]))
+        self.cam.on_shutter(self.state)
+        assert not self.cam.task_names
+        names = dict(models.TaskName.objects.values_list('name', 'count'))
+        assert names == {'A': 2, 'B': 1}
+        a = models.TaskName.objects.get(name='A')
+        assert a.last_seen == models.TaskState.objects.get(
+            task_id=uus[0]).tstamp
+        assert set(models.TaskState.objects.filter(
+            task_name=a).values_list('task_id', flat=True)) == set(uus[:2])
+
+    @pytest.mark.parametrize('batch_writes', [False, True])
+    def test_on_shutter_group_exceptions(self, batch_writes):
+        self.app.conf.monitors_batch_writes = batch_writes
+        self.app.conf.monitors_group_exceptions = True
+        traceback = (
+            'Traceback (most recent call last):\n'
+            '  File "proj/tasks.py", line 12, in charge\n'
+            '    customer = customers[{0!r}]\n'
+            'KeyError: {0!r}\n'
+        )
+        uus = [gen_unique_id() for i in range(3)]
+        list(map(self.state.event, [
+            Event('task-received', uuid=uuid, name='A', hostname='fuzzie')
+            for uuid in uus
+        ] + [
+            Event('task-failed', uuid=uus[0], hostname='fuzzie',
+                  exception="KeyError('cust-1')",
+                  traceback=traceback.format('cust-1')),
+            Event('task-retried', uuid=uus[1], hostname='fuzzie',
+                  exception="KeyError('cust-2')",
+                  traceback=traceback.format('cust-2')),
+        ]))
+        self.cam.on_shutter(self.state)
+        group = models.ExceptionGroup.objects.get()
+        assert group.exception == 'KeyError'
+        assert group.traceback == traceback.format('cust-1')
+        assert group.count == 2
+
+        self.state.event(Event(
+            'task-started', uuid=uus[2], hostname='fuzzie'))
+        self.cam.on_shutter(self.state)
+        self.state.event(Event(
+            'task-failed', uuid=uus[1], hostname='fuzzie',
+            exception="KeyError('cust-2')",
+            traceback=traceback.format('cust-2')))
+        self.cam.on_shutter(self.state)
+        group = models.ExceptionGroup.objects.get()
+        assert group.count == 3
+        failed = models.TaskState.objects.filter(exception_group=group)
+        assert set(failed.values_list('task_id', flat=True)) == set(uus[:2])
+        assert not failed.filter(traceback__isnull=False).exists()
+        assert failed.get(task_id=uus[0]).result == "KeyError('cust-1')"
+
+    def shutter(self, state):
+        skipped = self.cam.on_shutter(state)
+        if self.app.conf.monitors_writer_threads:
+            self.cam.writers.join()
+        return skipped
+
+    def assert_on_shutter(self):
         state = self.state
-        cam = self.cam
 
         ws = ['worker1.ex.com', 'worker2.ex.com', 'worker3.ex.com']
         uus = [gen_unique_id() for i in range(50)]
@@ -224,7 +638,7 @@ class test_Camera:
         for event in events:
             event['local_received'] = time()
             state.event(event)
-        cam.on_shutter(state)
+        self.shutter(state)
 
         for host in ws:
             worker = models.WorkerState.objects.get(hostname=host)
@@ -249,7 +663,7 @@ class test_Camera:
         models.WorkerState.objects.all().update(
             last_update=timezone.now() - timedelta(hours=1)
         )
-        cam.on_shutter(state)
+        self.shutter(state)
 
         w1 = models.WorkerState.objects.get(hostname=ws[0])
         assert not w1.is_alive()
@@ -264,4 +678,4 @@ class test_Camera:
         assert t2.result == "KeyError('foo')"
         assert t2.worker.hostname == ws[1]
 
-        cam.on_shutter(state)
+        self.shutter(state)
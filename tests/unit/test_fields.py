@@ -0,0 +1,145 @@
+from __future__ import absolute_import, unicode_literals
+
+from importlib import import_module
+
+import pytest
+
+from celery import states
+from celery.utils import gen_unique_id
+
+from django.apps import apps
+from django.db import connection
+from django.utils import timezone
+
+from django_celery_monitor import models
+from django_celery_monitor.fields import (
+    COMPRESSED_HEADER, Uncompressed, compress, decompress,
+)
+from django_celery_monitor.search import SearchIndex
+
+TRACEBACK = 'Traceback (most recent call last):\n' + (
+    '  File "proj/tasks.py", line 42, in add\n    return x + y\n' * 100
+)
+
+
+def raw_traceback(task_id):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT traceback FROM celery_monitor_taskstate '
+            'WHERE task_id = %s', [task_id],
+        )
+        return cursor.fetchone()[0]
+
+
+def test_compress():
+    assert compress('short') == 'short'
+    compressed = compress(TRACEBACK)
+    assert compressed.startswith(COMPRESSED_HEADER)
+    assert len(compressed) < len(TRACEBACK) / 5
+    assert compress(compressed) == compressed
+    assert decompress(compressed) == TRACEBACK
+    assert decompress('short') == 'short'
+    assert compress(Uncompressed(TRACEBACK)) == TRACEBACK
+    assert decompress(COMPRESSED_HEADER + 'not base64') == (
+        COMPRESSED_HEADER + 'not base64'
+    )
+
+
+@pytest.mark.django_db
+class test_CompressedTextField:
+
+    def create_task(self, **kwargs):
+        return models.TaskState.objects.create(
+            task_id=gen_unique_id(), state=states.FAILURE,
+            tstamp=timezone.now(), **kwargs
+        )
+
+    def test_roundtrip(self):
+        task = self.create_task(traceback=TRACEBACK, result='KeyError()')
+        assert raw_traceback(task.task_id).startswith(COMPRESSED_HEADER)
+        task = models.TaskState.objects.get(pk=task.pk)
+        assert task.traceback == TRACEBACK
+        assert task.result == 'KeyError()'
+
+    def test_uncompressed(self):
+        task = self.create_task(traceback=Uncompressed(TRACEBACK))
+        assert raw_traceback(task.task_id) == TRACEBACK
+
+    def test_bulk_update_state(self):
+        task_id = gen_unique_id()
+        models.TaskState.objects.bulk_update_state([(task_id, {
+            'state': states.FAILURE, 'tstamp': timezone.now(),
+            'traceback': TRACEBACK,
+        })])
+        assert raw_traceback(task_id).startswith(COMPRESSED_HEADER)
+        task = models.TaskState.objects.get(task_id=task_id)
+        assert task.traceback == TRACEBACK
+
+    def create_raw_task(self):
+        task = self.create_task()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'UPDATE celery_monitor_taskstate SET traceback = %s '
+                'WHERE id = %s', [TRACEBACK, task.pk],
+            )
+        return task
+
+    def test_migration(self):
+        task = self.create_raw_task()
+        migration = import_module(
+            'django_celery_monitor.migrations.0006_taskstate_compressed',
+        )
+        with connection.schema_editor() as schema_editor:
+            migration.compress_task_states(apps, schema_editor)
+        assert raw_traceback(task.task_id).startswith(COMPRESSED_HEADER)
+        with connection.schema_editor() as schema_editor:
+            migration.decompress_task_states(apps, schema_editor)
+        assert raw_traceback(task.task_id) == TRACEBACK
+
+    def test_migration_search_index(self):
+        assert SearchIndex(models.TaskState).install()
+        task = self.create_raw_task()
+        migration = import_module(
+            'django_celery_monitor.migrations.0006_taskstate_compressed',
+        )
+        with connection.schema_editor() as schema_editor:
+            migration.compress_task_states(apps, schema_editor)
+        # the search index is built from the stored text.
+        assert raw_traceback(task.task_id) == TRACEBACK
+
+
+@pytest.mark.django_db
+class test_StateRankField:
+
+    def test_pre_save(self):
+        task = models.TaskState.objects.create(
+            task_id=gen_unique_id(), state=states.SUCCESS,
+            tstamp=timezone.now(),
+        )
+        assert task.state_rank == states.precedence(states.SUCCESS)
+        task.state = 'CUSTOM'
+        task.save()
+        assert models.TaskState.objects.get(pk=task.pk).state_rank == (
+            states.precedence(None)
+        )
+
+    def test_migration(self):
+        now = timezone.now()
+        name = models.TaskName.objects.create(
+            name='A', first_seen=now, last_seen=now,
+        )
+        task = models.TaskState.objects.create(
+            task_id=gen_unique_id(), state=states.FAILURE, name='A',
+            tstamp=now,
+        )
+        models.TaskState.objects.update(
+            state_rank=states.precedence(None),
+        )
+        migration = import_module(
+            'django_celery_monitor.migrations.0008_taskstate_codes',
+        )
+        with connection.schema_editor() as schema_editor:
+            migration.fill_codes(apps, schema_editor)
+        task = models.TaskState.objects.get(pk=task.pk)
+        assert task.state_rank == states.precedence(states.FAILURE)
+        assert task.task_name == name
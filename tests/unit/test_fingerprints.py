@@ -0,0 +1,42 @@
+from __future__ import absolute_import, unicode_literals
+
+from django_celery_monitor.fingerprints import (
+    exception_name, fingerprint, normalize,
+)
+
+TRACEBACK = '''Traceback (most recent call last):
+  File "/app/celery/app/trace.py", line 367, in trace_task
+    R = retval = fun(*args, **kwargs)
+  File "/app/proj/tasks.py", line 12, in charge
+    customer = customers[{0!r}]
+KeyError: {0!r}
+'''
+
+
+def test_exception_name():
+    assert exception_name(TRACEBACK.format('cust-1')) == 'KeyError'
+    assert exception_name(
+        'Traceback (most recent call last):\nproj.errors.Error\n',
+    ) == 'proj.errors.Error'
+    assert exception_name('') == ''
+
+
+def test_normalize():
+    assert normalize(TRACEBACK.format('cust-1')) == '\n'.join([
+        'File "/app/celery/app/trace.py", line 367, in trace_task',
+        'File "/app/proj/tasks.py", line 12, in charge',
+        'KeyError',
+    ])
+    assert normalize(
+        '  File "<object at 0x7f3a>", line 1, in f\nValueError: x\n',
+    ) == 'File "<object at 0x>", line 1, in f\nValueError'
+
+
+def test_fingerprint():
+    assert fingerprint(TRACEBACK.format('cust-1')) == fingerprint(
+        TRACEBACK.format('cust-2'),
+    )
+    assert len(fingerprint(TRACEBACK)) == 40
+    assert fingerprint(TRACEBACK) != fingerprint(
+        TRACEBACK.replace('line 12', 'line 13'),
+    )
@@ -0,0 +1,148 @@
+from __future__ import absolute_import, unicode_literals
+
+import json
+import logging
+from itertools import count
+from time import time
+
+import pytest
+
+from celery import states
+from celery.events import Event as _Event
+from celery.events.state import State
+from celery.five import monotonic
+from celery.utils import gen_unique_id
+from django.utils import timezone
+
+from django_celery_monitor import models
+from django_celery_monitor.camera import Camera
+from django_celery_monitor.instrumentation import (
+    NO_PHASE, Hooks, Phase, PhaseLogger, SamplingProfiler,
+)
+
+_clock = count(1)
+
+
+def Event(*args, **kwargs):
+    kwargs.setdefault('clock', next(_clock))
+    kwargs.setdefault('local_received', time())
+    return _Event(*args, **kwargs)
+
+
+class Recorded(Hooks):
+
+    def __init__(self):
+        self.events = []
+
+    def on_phase_started(self, sender, phase, count=None, **kwargs):
+        self.events.append(('started', phase, count))
+
+    def on_phase_finished(self, sender, phase, count=None, duration=None,
+                          queries=None, exception=None, **kwargs):
+        assert duration >= 0
+        self.events.append(('finished', phase, count, queries, exception))
+
+
+def busy(seconds):
+    deadline = monotonic() + seconds
+    while monotonic() < deadline:
+        pass
+
+
+@pytest.mark.usefixtures('depends_on_current_app')
+@pytest.mark.django_db
+class test_Hooks:
+
+    @pytest.fixture(autouse=True)
+    def setup_app(self, app):
+        self.app = app
+        self.state = State()
+        self.cam = Camera(self.state, app=app)
+
+    def test_on_shutter(self):
+        uuids = [gen_unique_id() for i in range(2)]
+        for uuid in uuids:
+            self.state.event(Event(
+                'task-received', uuid=uuid, name='A', hostname='fuzzie',
+            ))
+        with Recorded() as hooks:
+            self.cam.on_shutter(self.state)
+        queries = [event[3] for event in hooks.events
+                   if event[0] == 'finished']
+        assert [event[:3] for event in hooks.events] == [
+            ('started', 'shutter', 2),
+            ('started', 'workers', 1),
+            ('finished', 'workers', 1),
+            ('started', 'tasks', 2),
+            ('finished', 'tasks', 2),
+            ('finished', 'shutter', 2),
+        ]
+        assert queries[0] > 0
+        assert queries[1] > 0
+        assert queries[2] is None
+        # nothing is sent once disconnected.
+        assert self.cam.phase('tasks') is NO_PHASE
+
+    def test_on_cleanup(self):
+        models.TaskState.objects.create(
+            task_id=gen_unique_id(), state=states.SUCCESS, name='A',
+            tstamp=timezone.now(), hidden=True,
+        )
+        with Recorded() as hooks:
+            assert self.cam.on_cleanup() == 1
+        assert hooks.events[0] == ('started', 'cleanup', None)
+        assert hooks.events[1][:3] == ('finished', 'cleanup', 1)
+
+    def test_exception(self):
+        with Recorded() as hooks:
+            with pytest.raises(KeyError):
+                with self.cam.phase('tasks', 3):
+                    raise KeyError('foo')
+        assert isinstance(hooks.events[1][4], KeyError)
+
+    def test_phase_logger(self, caplog):
+        test_logger = logging.getLogger('test_instrumentation')
+        with caplog.at_level(logging.INFO, logger='test_instrumentation'):
+            with PhaseLogger(logger=test_logger):
+                with self.cam.phase('tasks', 3, count_queries=False):
+                    pass
+        record, = caplog.records
+        fields = json.loads(record.getMessage())
+        assert fields['event'] == 'camera.phase'
+        assert fields['phase'] == 'tasks'
+        assert fields['count'] == 3
+        assert fields['queries'] is None
+        assert record.camera_phase == fields
+
+    def test_sampling_profiler(self):
+        with SamplingProfiler(interval=0.001) as profiler:
+            with Phase(self.cam, 'tasks'):
+                busy(0.2)
+            # outside of phases nothing is sampled.
+            busy(0.05)
+        functions = profiler.functions('tasks')
+        assert functions
+        names = [name for name, own, total in functions]
+        assert any(name.endswith(':busy') for name in names)
+        assert profiler.functions('cleanup') == []
+        phases = set(phase for phase, _ in profiler.samples)
+        assert phases == {'tasks'}
+
+    def test_sampling_profiler_functions(self):
+        profiler = SamplingProfiler()
+        main = ('main.py', 1, 'main')
+        profiler.samples.update({
+            ('tasks', (('tasks.py', 2, 'hot'), main)): 3,
+            ('tasks', (('tasks.py', 3, 'cold'), main)): 1,
+            ('tasks', (main,)): 1,
+            ('cleanup', (('purge.py', 4, 'purge'), main)): 2,
+        })
+        assert profiler.functions('tasks') == [
+            ('tasks.py:hot', 3, 3),
+            ('main.py:main', 1, 5),
+            ('tasks.py:cold', 1, 1),
+        ]
+        report = profiler.report('tasks', limit=1)
+        assert 'tasks.py:hot' in report
+        assert 'main.py:main' not in report
+        assert profiler.functions()[0] == ('tasks.py:hot', 3, 3)
@@ -0,0 +1,473 @@
+from __future__ import absolute_import, unicode_literals
+
+from datetime import timedelta
+from importlib import import_module
+
+import pytest
+
+from celery import states
+from celery.utils import gen_unique_id
+
+from django.apps import apps
+from django.db import connection
+from django.db.models import F
+from django.db.backends.utils import CursorWrapper
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from django_celery_monitor import managers, models
+from django_celery_monitor.sketches import DDSketch
+
+
+@pytest.fixture(params=[True, False], ids=['upsert', 'fallback'])
+def upsert(request, patching):
+    if not request.param:
+        patching(
+            'django_celery_monitor.managers.supports_upsert',
+        ).return_value = False
+    return request.param
+
+
+@pytest.mark.django_db
+class test_WorkerStateQuerySet:
+
+    def test_update_heartbeats(self, upsert):
+        heartbeat = timezone.now() - timedelta(minutes=1)
+        existing = models.WorkerState.objects.create(
+            hostname='fuzzie', last_heartbeat=heartbeat,
+        )
+        worker_ids = models.WorkerState.objects.update_heartbeats({
+            'fuzzie': heartbeat + timedelta(seconds=30),
+            'wuzzie': heartbeat,
+        })
+        assert worker_ids['fuzzie'] == existing.pk
+        assert set(worker_ids) == {'fuzzie', 'wuzzie'}
+        fuzzie = models.WorkerState.objects.get(pk=existing.pk)
+        assert fuzzie.last_heartbeat == heartbeat + timedelta(seconds=30)
+        assert fuzzie.last_update > existing.last_update
+        wuzzie = models.WorkerState.objects.get(pk=worker_ids['wuzzie'])
+        assert wuzzie.last_heartbeat == heartbeat
+
+    def test_update_heartbeats_update_freq(self, upsert):
+        heartbeat = timezone.now() - timedelta(minutes=1)
+        stale, recent, offline = [
+            models.WorkerState.objects.create(
+                hostname=hostname, last_heartbeat=heartbeat,
+            )
+            for hostname in ('stale', 'recent', 'offline')
+        ]
+        models.WorkerState.objects.filter(pk=stale.pk).update(
+            last_update=timezone.now() - timedelta(minutes=5),
+        )
+        new_heartbeat = heartbeat + timedelta(seconds=30)
+        worker_ids = models.WorkerState.objects.update_heartbeats({
+            'stale': new_heartbeat,
+            'recent': new_heartbeat,
+            'offline': None,
+            'new': new_heartbeat,
+        }, update_freq=60)
+        assert worker_ids == dict(
+            models.WorkerState.objects.values_list('hostname', 'pk'),
+        )
+        heartbeats = dict(models.WorkerState.objects.values_list(
+            'hostname', 'last_heartbeat',
+        ))
+        assert heartbeats == {
+            'stale': new_heartbeat,
+            'recent': heartbeat,
+            'offline': None,
+            'new': new_heartbeat,
+        }
+
+    def test_update_heartbeats_single_statement(self):
+        worker_ids = models.WorkerState.objects.update_heartbeats({
+            'fuzzie': timezone.now(),
+        })
+        with CaptureQueriesContext(connection) as captured:
+            assert models.WorkerState.objects.update_heartbeats({
+                'fuzzie': timezone.now(),
+                'wuzzie': timezone.now(),
+            }, update_freq=60)['fuzzie'] == worker_ids['fuzzie']
+        queries = [query['sql'] for query in captured.captured_queries
+                   if 'SAVEPOINT' not in query['sql']]
+        assert len(queries) == 1
+
+    def test_update_heartbeats_many(self, patching):
+        params = []
+        execute = CursorWrapper.execute
+
+        def counting_execute(cursor, sql, args=None):
+            params.append(len(args or ()))
+            return execute(cursor, sql, args)
+        patching.object(CursorWrapper, 'execute', counting_execute)
+        heartbeats = {
+            'worker{0}'.format(i): timezone.now() for i in range(400)
+        }
+        worker_ids = models.WorkerState.objects.update_heartbeats(
+            heartbeats, update_freq=60,
+        )
+        assert len(worker_ids) == 400
+        # 3 columns per worker and 2 cutoffs fit SQLite's limit.
+        assert max(params) <= managers.SQLITE_MAX_QUERY_PARAMS
+
+    def test_worker_ids(self):
+        heartbeat = timezone.now()
+        existing = models.WorkerState.objects.create(
+            hostname='fuzzie', last_heartbeat=heartbeat,
+        )
+        worker_ids = models.WorkerState.objects.worker_ids(
+            ['fuzzie', 'wuzzie'],
+        )
+        assert worker_ids['fuzzie'] == existing.pk
+        wuzzie = models.WorkerState.objects.get(pk=worker_ids['wuzzie'])
+        assert wuzzie.last_heartbeat is None
+        assert models.WorkerState.objects.get(
+            pk=existing.pk).last_update == existing.last_update
+        assert models.WorkerState.objects.worker_ids([]) == {}
+
+    def test_update_heartbeats_empty(self):
+        assert models.WorkerState.objects.update_heartbeats({}) == {}
+
+
+@pytest.mark.django_db
+class test_TaskNameQuerySet:
+
+    def test_update_names(self, upsert):
+        now = timezone.now()
+        existing = models.TaskName.objects.create(
+            name='A', count=3, first_seen=now, last_seen=now,
+        )
+        written = models.TaskName.objects.update_names({
+            'A': (2, now - timedelta(hours=1), now + timedelta(hours=1)),
+            'B': (1, now, now),
+        })
+        assert written == 2
+        a = models.TaskName.objects.get(pk=existing.pk)
+        assert a.count == 5
+        assert a.first_seen == now - timedelta(hours=1)
+        assert a.last_seen == now + timedelta(hours=1)
+        models.TaskName.objects.update_names({
+            'A': (0, now, now),
+        })
+        a = models.TaskName.objects.get(pk=existing.pk)
+        assert a.count == 5
+        assert a.first_seen == now - timedelta(hours=1)
+        assert a.last_seen == now + timedelta(hours=1)
+        assert models.TaskName.objects.get(name='B').count == 1
+
+    def test_update_names_empty(self):
+        assert models.TaskName.objects.update_names({}) == 0
+
+
+@pytest.mark.django_db
+class test_ExceptionGroupQuerySet:
+
+    def test_update_groups(self, upsert):
+        now = timezone.now()
+        existing = models.ExceptionGroup.objects.create(
+            fingerprint='a' * 40, exception='KeyError', traceback='KeyError',
+            count=1, first_seen=now, last_seen=now,
+        )
+        group_ids = models.ExceptionGroup.objects.update_groups({
+            'a' * 40: ('ValueError', 'ValueError', 2, now, now),
+            'b' * 40: ('TypeError', 'TypeError', 0, now, now),
+        })
+        assert group_ids['a' * 40] == existing.pk
+        assert set(group_ids) == {'a' * 40, 'b' * 40}
+        a = models.ExceptionGroup.objects.get(pk=existing.pk)
+        assert (a.exception, a.count) == ('KeyError', 3)
+        b = models.ExceptionGroup.objects.get(pk=group_ids['b' * 40])
+        assert (b.exception, b.count) == ('TypeError', 0)
+
+    def test_update_groups_empty(self):
+        assert models.ExceptionGroup.objects.update_groups({}) == {}
+
+
+@pytest.mark.django_db
+class test_TaskRollupQuerySet:
+
+    def test_update_rollups(self, upsert):
+        minute = timezone.now().replace(second=0, microsecond=0)
+        assert models.TaskRollup.objects.update_rollups({
+            ('A', states.SUCCESS, minute): (2, 1.5, 0.5, 1.0, 3.0, 1.0, 2.0),
+            ('A', states.STARTED, minute): (
+                3, 0.0, None, None, 0.0, None, None),
+        }) == 2
+        models.TaskRollup.objects.update_rollups({
+            ('A', states.SUCCESS, minute): (1, 2.0, 2.0, 2.0, 0.5, 0.5, 0.5),
+            ('A', states.STARTED, minute): (
+                1, 0.0, None, None, 4.0, 4.0, 4.0),
+            ('B', states.SUCCESS, minute): (1, 0.1, 0.1, 0.1, 0.0, 0.0, 0.0),
+        })
+        success = models.TaskRollup.objects.get(name='A', state='SUCCESS')
+        assert success.count == 3
+        assert success.runtime_sum == 3.5
+        assert success.runtime_min == 0.5
+        assert success.runtime_max == 2.0
+        assert success.queue_wait_sum == 3.5
+        assert success.queue_wait_min == 0.5
+        assert success.queue_wait_max == 2.0
+        started = models.TaskRollup.objects.get(name='A', state='STARTED')
+        assert started.count == 4
+        assert started.runtime_min is None
+        assert started.queue_wait_sum == 4.0
+        assert started.queue_wait_min == 4.0
+        assert models.TaskRollup.objects.get(name='B').queue_wait_min == 0.0
+        assert models.TaskRollup.objects.count() == 3
+
+    def test_update_rollups_empty(self):
+        assert models.TaskRollup.objects.update_rollups({}) == 0
+
+    def test_totals(self):
+        minute = timezone.now().replace(second=0, microsecond=0)
+        models.TaskRollup.objects.update_rollups({
+            ('A', states.SUCCESS, minute): (2, 1.5, 0.5, 1.0, 1.0, 0.0, 1.0),
+            ('A', states.SUCCESS, minute - timedelta(minutes=1)): (
+                1, 0.25, 0.25, 0.25, 2.0, 2.0, 2.0),
+            ('A', states.SUCCESS, minute - timedelta(hours=2)): (
+                5, 5.0, 1.0, 1.0, 5.0, 1.0, 1.0),
+            ('A', states.FAILURE, minute): (
+                1, 0.0, None, None, 0.0, None, None),
+        })
+        totals = list(models.TaskRollup.objects.between(
+            minute - timedelta(hours=1),
+        ).totals('name', 'state'))
+        assert totals == [
+            {'name': 'A', 'state': states.FAILURE, 'tasks': 1,
+             'total_runtime': 0.0, 'min_runtime': None,
+             'max_runtime': None, 'total_queue_wait': 0.0,
+             'min_queue_wait': None, 'max_queue_wait': None},
+            {'name': 'A', 'state': states.SUCCESS, 'tasks': 3,
+             'total_runtime': 1.75, 'min_runtime': 0.25,
+             'max_runtime': 1.0, 'total_queue_wait': 3.0,
+             'min_queue_wait': 0.0, 'max_queue_wait': 2.0},
+        ]
+
+
+@pytest.mark.django_db
+class test_RuntimeSketchQuerySet:
+
+    def sketch(self, *values):
+        sketch = DDSketch()
+        for value in values:
+            sketch.add(value)
+        return sketch
+
+    def test_update_sketches(self):
+        window = timezone.now().replace(minute=0, second=0, microsecond=0)
+        assert models.RuntimeSketch.objects.update_sketches({
+            ('A', window): self.sketch(1.0, 2.0),
+            ('B', window): self.sketch(5.0),
+        }) == 2
+        models.RuntimeSketch.objects.update_sketches({
+            ('A', window): self.sketch(3.0),
+        })
+        stored = models.RuntimeSketch.objects.get(name='A')
+        assert stored.count == 3
+        assert stored.get_sketch().max == 3.0
+        assert models.RuntimeSketch.objects.count() == 2
+        assert models.RuntimeSketch.objects.update_sketches({}) == 0
+
+    def test_quantiles(self):
+        window = timezone.now().replace(minute=0, second=0, microsecond=0)
+        models.RuntimeSketch.objects.update_sketches({
+            ('A', window): self.sketch(*range(1, 51)),
+            ('A', window - timedelta(hours=1)): self.sketch(*range(51, 101)),
+            ('A', window - timedelta(hours=5)): self.sketch(1000),
+            ('B', window): self.sketch(1000),
+        })
+        quantiles = models.RuntimeSketch.objects.filter(name='A').between(
+            window - timedelta(hours=1), window + timedelta(hours=1),
+        ).quantiles([0.5, 0.99])
+        assert quantiles[0.5] == pytest.approx(50, rel=0.01)
+        assert quantiles[0.99] == pytest.approx(99, rel=0.01)
+        assert models.RuntimeSketch.objects.filter(
+            name='C').quantiles([0.5]) == {0.5: None}
+
+
+@pytest.mark.django_db
+class test_TaskStateQuerySet:
+
+    def defaults(self, state, **kwargs):
+        return dict({'state': state, 'tstamp': timezone.now()}, **kwargs)
+
+    @pytest.mark.parametrize('queryset,index', [
+        (lambda objects: objects.expired(
+            states.READY_STATES, timedelta(days=1),
+        ), 'celery_mon_rank_tstamp_idx'),
+        (lambda objects: objects.filter(hidden=True).order_by('pk'),
+         'celery_mon_hidden_id_idx'),
+        (lambda objects: objects.filter(
+            task_name_id=1).order_by('-tstamp'),
+         'celery_mon_tname_tstamp_idx'),
+        (lambda objects: objects.filter(worker_id=1).order_by('-tstamp'),
+         'celery_mon_worker_tstamp_idx'),
+        (lambda objects: objects.filter(
+            eta__gte=timezone.now(),
+            eta__lt=timezone.now() + timedelta(days=1),
+        ), 'celery_mon_eta_partial_idx'),
+    ])
+    def test_query_plan(self, queryset, index):
+        if connection.vendor != 'sqlite':
+            pytest.skip('requires SQLite')
+        query = queryset(models.TaskState.objects).query
+        sql, params = query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = ' '.join(row[-1] for row in cursor.fetchall())
+        assert index in plan
+
+    @pytest.mark.parametrize('queryset,index', [
+        (lambda objects: objects.expired(
+            states.READY_STATES, timedelta(days=1),
+        ), 'celery_mon_rank_tstamp_idx'),
+        (lambda objects: objects.filter(hidden=True),
+         'celery_mon_hidden_id_idx'),
+    ])
+    def test_delete_chunk_query_plan(self, queryset, index):
+        if connection.vendor != 'sqlite':
+            pytest.skip('requires SQLite')
+        with CaptureQueriesContext(connection) as queries:
+            queryset(models.TaskState.objects).delete_chunk(1000)
+        plan = ''
+        with connection.cursor() as cursor:
+            for query in queries:
+                if query['sql'].startswith(('SELECT', 'DELETE')):
+                    cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                    plan += ' '.join(row[-1] for row in cursor.fetchall())
+        assert index in plan
+        # the chunk is taken as the index yields it, not sorted.
+        assert 'TEMP B-TREE' not in plan
+
+    def test_drop_eta_index(self):
+        migration = import_module(
+            'django_celery_monitor.migrations.0003_taskstate_indexes',
+        )
+        with connection.schema_editor() as schema_editor:
+            migration.drop_eta_index(apps, schema_editor)
+            # e.g. after the table was rebuilt on SQLite.
+            migration.drop_eta_index(apps, schema_editor)
+
+    def test_update_ranks_state(self):
+        task = models.TaskState.objects.create(
+            task_id=gen_unique_id(), state=states.RECEIVED,
+            tstamp=timezone.now() - timedelta(days=2),
+        )
+        models.TaskState.objects.filter(pk=task.pk).update(
+            state=states.SUCCESS,
+        )
+        assert models.TaskState.objects.get(pk=task.pk).state_rank == (
+            states.precedence(states.SUCCESS)
+        )
+        assert models.TaskState.objects.expired(
+            states.READY_STATES, timedelta(days=1),
+        ).count() == 1
+        with pytest.raises(ValueError):
+            models.TaskState.objects.update(state=F('name'))
+
+    def test_bulk_update_ranks_state(self):
+        task = models.TaskState.objects.create(
+            task_id=gen_unique_id(), state=states.RECEIVED,
+            tstamp=timezone.now(),
+        )
+        task.state = states.FAILURE
+        models.TaskState.objects.bulk_update([task], ['state'])
+        assert models.TaskState.objects.get(pk=task.pk).state_rank == (
+            states.precedence(states.FAILURE)
+        )
+
+    def test_update_state(self, upsert):
+        task_id = gen_unique_id()
+        created = models.TaskState.objects.update_state(
+            states.RECEIVED, task_id,
+            self.defaults(states.RECEIVED, name='A', args='(1,)'),
+        )
+        assert created.pk is not None
+        updated = models.TaskState.objects.update_state(
+            states.SUCCESS, task_id,
+            self.defaults(states.SUCCESS, name='A', result='42'),
+        )
+        assert updated.pk == created.pk
+        task = models.TaskState.objects.get(task_id=task_id)
+        assert task.state == states.SUCCESS
+        assert task.state_rank == states.precedence(states.SUCCESS)
+        assert task.args == '(1,)'
+        assert task.result == '42'
+
+    def test_update_state_merge_rules(self, upsert):
+        task_id = gen_unique_id()
+        models.TaskState.objects.update_state(
+            states.SUCCESS, task_id,
+            self.defaults(states.SUCCESS, name='A', args='(1,)'),
+        )
+        models.TaskState.objects.update_state(
+            states.RECEIVED, task_id,
+            self.defaults(states.RECEIVED, name='B', args='(2,)', runtime=1.0),
+        )
+        task = models.TaskState.objects.get(task_id=task_id)
+        assert task.state == states.RECEIVED
+        assert task.name == 'A'
+        assert task.args == '(1,)'
+        assert task.runtime == 1.0
+
+    def test_update_state_without_lock(self):
+        task_id = gen_unique_id()
+        models.TaskState.objects.update_state(
+            states.RECEIVED, task_id, self.defaults(states.RECEIVED, name='A'),
+        )
+        with CaptureQueriesContext(connection) as captured:
+            models.TaskState.objects.update_state(
+                states.STARTED, task_id,
+                self.defaults(states.STARTED, name='A'),
+            )
+        queries = [query['sql'] for query in captured.captured_queries
+                   if 'SAVEPOINT' not in query['sql']]
+        assert len(queries) == 1
+        assert 'SELECT' not in queries[0]
+
+    def test_bulk_update_state(self, upsert):
+        ids = [gen_unique_id() for i in range(3)]
+        written = models.TaskState.objects.bulk_update_state([
+            (ids[0], self.defaults(states.RECEIVED, name='A', args='(1,)')),
+            (ids[1], self.defaults(states.STARTED, name='B')),
+            (ids[2], self.defaults(states.SUCCESS, name='C', result='42')),
+        ])
+        assert written == 3
+        assert models.TaskState.objects.count() == 3
+
+        models.TaskState.objects.bulk_update_state([
+            (ids[0], self.defaults(states.SUCCESS, name='A', result='1')),
+            (ids[1], self.defaults(states.SUCCESS, runtime=0.5)),
+        ])
+        t1 = models.TaskState.objects.get(task_id=ids[0])
+        assert t1.state == states.SUCCESS
+        assert t1.args == '(1,)'
+        assert t1.result == '1'
+        t2 = models.TaskState.objects.get(task_id=ids[1])
+        assert t2.name == 'B'
+        assert t2.runtime == 0.5
+        assert models.TaskState.objects.count() == 3
+
+    def test_bulk_update_state_merge_rules(self, upsert):
+        task_id = gen_unique_id()
+        models.TaskState.objects.bulk_update_state([
+            (task_id, self.defaults(states.SUCCESS, name='A', args='(1,)')),
+        ])
+        models.TaskState.objects.bulk_update_state([
+            (task_id, self.defaults(
+                states.RECEIVED, name='B', args='(2,)', runtime=1.0,
+            )),
+        ])
+        task = models.TaskState.objects.get(task_id=task_id)
+        assert task.name == 'A'
+        assert task.args == '(1,)'
+        assert task.runtime == 1.0
+
+    def test_bulk_update_state_batch_size(self, upsert):
+        ids = [gen_unique_id() for i in range(25)]
+        models.TaskState.objects.bulk_update_state(
+            [(task_id, self.defaults(states.RECEIVED, name='A'))
+             for task_id in ids],
+            batch_size=10,
+        )
+        assert models.TaskState.objects.filter(task_id__in=ids).count() == 25
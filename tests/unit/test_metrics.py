@@ -0,0 +1,107 @@
+from __future__ import absolute_import, unicode_literals
+
+from contextlib import closing
+
+import pytest
+
+from django.db import connection, connections
+
+from django_celery_monitor import models
+from django_celery_monitor.metrics import (
+    CONTENT_TYPE, QueryCounter, MetricsServer, Registry,
+)
+
+try:
+    from urllib.request import urlopen
+except ImportError:  # pragma: no cover
+    from urllib2 import urlopen
+
+
+class test_Registry:
+
+    def setup(self):
+        self.registry = Registry()
+
+    def test_counter(self):
+        counter = self.registry.counter(
+            'tasks_total', 'Tasks.', ['name', 'state'],
+        )
+        counter.inc(labels=('A', 'SUCCESS'))
+        counter.inc(2, labels=('A', 'SUCCESS'))
+        counter.inc(labels=('say "hi"\n', 'FAILURE'))
+        assert self.registry.render() == (
+            '# HELP tasks_total Tasks.\n'
+            '# TYPE tasks_total counter\n'
+            'tasks_total{name="A",state="SUCCESS"} 3.0\n'
+            'tasks_total{name="say \\"hi\\"\\n",state="FAILURE"} 1.0\n'
+        )
+
+    def test_gauge_function(self):
+        depths = [1, 4]
+        self.registry.gauge(
+            'depth', 'Depth.', ['shard'], function=lambda: dict(
+                (('{0}'.format(i),), depth) for i, depth in enumerate(depths)
+            ),
+        )
+        self.registry.gauge('up', 'Up.', function=lambda: 1)
+        depths[1] = 2
+        assert self.registry.render().splitlines()[2:] == [
+            'depth{shard="0"} 1.0',
+            'depth{shard="1"} 2.0',
+            '# HELP up Up.',
+            '# TYPE up gauge',
+            'up 1.0',
+        ]
+
+    def test_histogram(self):
+        histogram = self.registry.histogram(
+            'duration_seconds', 'Duration.', buckets=[0.1, 1],
+        )
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value)
+        assert self.registry.render().splitlines()[2:] == [
+            'duration_seconds_bucket{le="0.1"} 2.0',
+            'duration_seconds_bucket{le="1.0"} 3.0',
+            'duration_seconds_bucket{le="+Inf"} 4.0',
+            'duration_seconds_sum 3.65',
+            'duration_seconds_count 4.0',
+        ]
+
+    def test_register_replaces(self):
+        self.registry.counter('tasks_total', 'Tasks.').inc(5)
+        self.registry.counter('tasks_total', 'Tasks.')
+        assert self.registry.render().splitlines()[2:] == []
+
+
+@pytest.mark.django_db
+def test_QueryCounter():
+    with QueryCounter(connection) as queries:
+        models.TaskName.objects.count()
+        with QueryCounter(connection) as inner:
+            list(models.TaskState.objects.all())
+    assert inner.count == 1
+    assert queries.count == 2
+    assert 'make_cursor' not in connections['default'].__dict__
+    assert not connection.queries_logged
+
+
+@pytest.mark.django_db
+def test_QueryCounter_many():
+    with QueryCounter(connection) as queries:
+        for i in range(connection.queries_limit + 100):
+            models.TaskName.objects.exists()
+    assert queries.count == connection.queries_limit + 100
+
+
+def test_MetricsServer():
+    registry = Registry()
+    registry.counter('tasks_total', 'Tasks.').inc()
+    server = MetricsServer(registry, addr='127.0.0.1')
+    addr, port = server.start()
+    try:
+        url = 'http://{0}:{1}/metrics'.format(addr, port)
+        with closing(urlopen(url)) as response:
+            assert response.headers['Content-Type'] == CONTENT_TYPE
+            assert b'tasks_total 1.0' in response.read()
+    finally:
+        server.stop()
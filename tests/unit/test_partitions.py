@@ -0,0 +1,103 @@
+from __future__ import absolute_import, unicode_literals
+
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from celery import states
+from celery.utils import gen_unique_id
+
+from django.db import connection
+from django.utils import timezone
+
+from django_celery_monitor import models
+from django_celery_monitor.partitions import Partitions, day_start
+
+
+@pytest.mark.django_db
+class test_Partitions:
+
+    def create_tasks(self, count, age):
+        models.TaskState.objects.bulk_create([
+            models.TaskState(
+                task_id=gen_unique_id(), state=states.SUCCESS,
+                tstamp=timezone.now() - age,
+            ) for i in range(count)
+        ])
+
+    def test_day_start(self):
+        assert day_start(date(2016, 6, 1)) == datetime(
+            2016, 6, 1, tzinfo=timezone.utc,
+        )
+        assert day_start(datetime(2016, 6, 1, 15, 16, 17)) == datetime(
+            2016, 6, 1, tzinfo=timezone.utc,
+        )
+
+    def test_partition_name(self):
+        partitions = Partitions(models.TaskState)
+        assert partitions.partition_name(date(2016, 6, 1)) == (
+            'celery_monitor_taskstate_p20160601'
+        )
+
+    def test_emulated(self):
+        if connection.vendor == 'postgresql':
+            pytest.skip('PostgreSQL has native partitioning')
+        partitions = Partitions(models.TaskState)
+        assert not partitions.native
+        assert not partitions.install()
+        assert not partitions.is_partitioned()
+        assert partitions.ensure() == 0
+        assert partitions.partitions() == []
+
+    def test_install_postgresql(self):
+        if connection.vendor != 'postgresql':
+            pytest.skip('needs PostgreSQL, set TEST_POSTGRESQL')
+        self.create_tasks(3, timedelta(days=3))
+        self.create_tasks(2, timedelta(0))
+        with connection.cursor() as cursor:
+            # the checks of the foreign keys block altering the table.
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        partitions = Partitions(models.TaskState)
+        today = timezone.now().date()
+        assert partitions.install()
+        assert partitions.is_partitioned()
+        assert not partitions.install()
+        # the existing table is the partition of today.
+        assert partitions.partitions() == [today]
+        assert partitions.ensure() == 2
+        assert partitions.ensure() == 0
+        assert partitions.partitions() == [
+            today, today + timedelta(days=1), today + timedelta(days=2),
+        ]
+        self.create_tasks(1, timedelta(days=-1))
+        self.create_tasks(1, timedelta(days=-5))
+        assert models.TaskState.objects.count() == 7
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT indexname FROM pg_indexes WHERE tablename = %s',
+                [partitions.table],
+            )
+            indexes = {row[0] for row in cursor.fetchall()}
+            cursor.execute(
+                "SELECT COUNT(*) FROM pg_constraint WHERE contype = 'f' "
+                'AND conrelid = %s::regclass', [partitions.table],
+            )
+            assert cursor.fetchone()[0] == 3
+        assert 'celery_mon_eta_partial_idx_p' in indexes
+        assert 'celery_monitor_taskstate_task_id_key_p' in indexes
+
+        assert partitions.drop_before(
+            timezone.now() + timedelta(days=1)) == 1
+        # the tasks of tomorrow and the default partition are left.
+        assert models.TaskState.objects.count() == 2
+
+    def test_drop_before(self):
+        self.create_tasks(3, timedelta(days=3))
+        self.create_tasks(12, timedelta(days=2))
+        self.create_tasks(4, timedelta(0))
+        partitions = Partitions(models.TaskState)
+        cutoff = timezone.now() - timedelta(days=1)
+        assert partitions.drop_before(cutoff, chunk_size=5) == 2
+        assert models.TaskState.objects.count() == 4
+        assert partitions.drop_before(cutoff) == 0
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from django_celery_monitor.payload import PayloadLimits, truncate
+
+
+def test_truncate():
+    assert truncate('abc', 3) == 'abc'
+    assert truncate('abcdef', 3) == 'abc... [truncated, 6 bytes]'
+    assert truncate('abcdef', 0) == '[dropped, 6 bytes]'
+    # multi-byte characters are not cut in half.
+    assert truncate('äöü', 3) == 'ä... [truncated, 6 bytes]'
+
+
+class test_PayloadLimits:
+
+    def test_limits(self):
+        limits = PayloadLimits([
+            ('proj.tasks.noisy', {'args': 0, 'result': None}),
+            ('proj.tasks.*', {'args': 10, 'traceback': 100, 'other': 1}),
+        ])
+        assert limits
+        assert limits.limits('proj.tasks.noisy') == {'args': 0}
+        assert limits.limits('proj.tasks.add') == {
+            'args': 10, 'traceback': 100,
+        }
+        assert limits.limits('other.add') == {}
+        assert not PayloadLimits()
+
+    def test_apply(self):
+        limits = PayloadLimits({'proj.*': {'args': 0, 'result': 5}})
+        defaults = {'args': '[1, 2]', 'result': '123456', 'kwargs': '{}'}
+        assert limits.apply('proj.add', defaults) == {
+            'args': '[dropped, 6 bytes]',
+            'result': '12345... [truncated, 6 bytes]',
+            'kwargs': '{}',
+        }
+        assert limits.apply(None, {'args': '[1, 2]'}) == {'args': '[1, 2]'}
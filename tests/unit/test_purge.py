@@ -0,0 +1,71 @@
+from __future__ import absolute_import, unicode_literals
+
+from datetime import timedelta
+
+import pytest
+
+from celery import states
+from celery.utils import gen_unique_id
+
+from django.utils import timezone
+
+from django_celery_monitor import models
+from django_celery_monitor.purge import Purger
+
+EXPIRE_TASK_STATES = (
+    (frozenset([states.SUCCESS]), timedelta(days=1)),
+    (states.EXCEPTION_STATES, None),
+)
+
+
+@pytest.mark.django_db
+class test_Purger:
+
+    def create_tasks(self, count, state=states.SUCCESS, age=timedelta(days=2),
+                     **kwargs):
+        models.TaskState.objects.bulk_create([
+            models.TaskState(
+                task_id=gen_unique_id(), state=state,
+                tstamp=timezone.now() - age, **kwargs
+            ) for i in range(count)
+        ])
+
+    def test_purge(self):
+        self.create_tasks(25)
+        self.create_tasks(3, hidden=True, age=timedelta(0))
+        self.create_tasks(4, age=timedelta(0))
+        self.create_tasks(5, state=states.FAILURE)
+        purger = Purger(models.TaskState, chunk_size=10)
+        assert purger.purge(EXPIRE_TASK_STATES) == 28
+        assert purger.rate > 0
+        assert models.TaskState.objects.count() == 9
+        assert not models.TaskState.objects.filter(hidden=True).exists()
+        assert purger.purge(EXPIRE_TASK_STATES) == 0
+
+    def test_purge_time_budget(self):
+        self.create_tasks(25)
+        purger = Purger(models.TaskState, chunk_size=10, time_budget=0)
+        assert purger.purge(EXPIRE_TASK_STATES) == 10
+        assert models.TaskState.objects.count() == 15
+        assert purger.purge(EXPIRE_TASK_STATES) == 10
+        assert purger.purge(EXPIRE_TASK_STATES) == 5
+
+    def test_delete_chunk(self):
+        self.create_tasks(15)
+        assert models.TaskState.objects.delete_chunk(10) == 10
+        assert models.TaskState.objects.count() == 5
+        assert models.TaskState.objects.delete_chunk(10) == 5
+        assert models.TaskState.objects.delete_chunk(10) == 0
+
+    def test_start(self, patching):
+        purge = patching.object(Purger, 'purge')
+        purger = Purger(models.TaskState)
+        assert purger.start(EXPIRE_TASK_STATES)
+        purger.join()
+        assert not purger.running
+        purge.assert_called_with(EXPIRE_TASK_STATES)
+
+    def test_start_while_running(self, patching):
+        purger = Purger(models.TaskState)
+        patching.object(Purger, 'running', True)
+        assert not purger.start(EXPIRE_TASK_STATES)
@@ -0,0 +1,137 @@
+from __future__ import absolute_import, unicode_literals
+
+from datetime import datetime, timedelta
+from itertools import count
+from time import time
+
+import pytest
+
+from celery import states
+from celery.events import Event as _Event
+from celery.utils import gen_unique_id
+
+from django.utils.timezone import make_aware, utc
+
+from django_celery_monitor import models
+from django_celery_monitor.camera import Camera
+from django_celery_monitor.recorder import Recorder, TaskRecord
+
+_clock = count(1)
+
+
+def Event(*args, **kwargs):
+    kwargs.setdefault('clock', next(_clock))
+    kwargs.setdefault('local_received', time())
+    return _Event(*args, **kwargs)
+
+
+class test_TaskRecord:
+
+    def test_event(self):
+        task = TaskRecord(gen_unique_id())
+        task.event('received', Event(
+            'task-received', name='A', args='(1,)', hostname='fuzzie',
+        ))
+        assert task.state == states.RECEIVED
+        assert task.name == 'A'
+        task.event('succeeded', Event(
+            'task-succeeded', result='42', runtime=0.1,
+        ))
+        assert task.state == states.SUCCESS
+        assert task.result == '42'
+        assert task.args == '(1,)'
+
+    def test_event_merges_lower_precedence(self):
+        task = TaskRecord(gen_unique_id())
+        succeeded = Event('task-succeeded', result='42')
+        task.event('succeeded', succeeded)
+        task.event('received', Event('task-received', name='A', args='()'))
+        assert task.state == states.SUCCESS
+        assert task.timestamp == succeeded['timestamp']
+        assert task.name == 'A'
+        assert task.args == '()'
+
+
+@pytest.mark.usefixtures('depends_on_current_app')
+@pytest.mark.django_db
+class test_Recorder:
+
+    @pytest.fixture(autouse=True)
+    def setup_app(self, app):
+        self.app = app
+        self.recorder = Recorder(Camera(None, app=app), batch_size=10)
+
+    def test_flush(self):
+        uuid = gen_unique_id()
+        for event in [
+            Event('worker-online', hostname='fuzzie'),
+            Event('task-received', uuid=uuid, name='A', hostname='fuzzie'),
+            Event('task-started', uuid=uuid, hostname='fuzzie'),
+        ]:
+            self.recorder.on_event(event)
+        assert self.recorder.flush() == 1
+        assert not self.recorder.tasks
+        task = models.TaskState.objects.get(task_id=uuid)
+        assert task.state == states.STARTED
+        assert task.name == 'A'
+        assert task.worker.hostname == 'fuzzie'
+        assert task.worker.is_alive()
+
+        # the name is remembered for the events of later batches.
+        self.recorder.on_event(Event(
+            'task-succeeded', uuid=uuid, hostname='fuzzie', result='42',
+        ))
+        assert self.recorder.flush() == 1
+        task = models.TaskState.objects.get(task_id=uuid)
+        assert task.state == states.SUCCESS
+        assert task.name == 'A'
+        assert task.result == '42'
+
+        self.recorder.on_event(Event('worker-offline', hostname='fuzzie'))
+        assert self.recorder.flush() == 0
+        assert not models.WorkerState.objects.get(hostname='fuzzie').is_alive()
+
+    def test_flush_queue_wait(self):
+        uuid, now = gen_unique_id(), time()
+        self.recorder.on_event(Event(
+            'task-received', uuid=uuid, name='A', hostname='fuzzie',
+            timestamp=now - 3,
+        ))
+        self.recorder.flush()
+        # the received timestamp is remembered for later batches.
+        self.recorder.on_event(Event(
+            'task-started', uuid=uuid, hostname='fuzzie', timestamp=now - 1,
+        ))
+        self.recorder.flush()
+        task = models.TaskState.objects.get(task_id=uuid)
+        assert task.state == states.STARTED
+        assert task.queue_wait == pytest.approx(2)
+        assert task.received is not None
+
+    def test_flush_expires(self):
+        uuid = gen_unique_id()
+        expires = datetime.utcnow().replace(microsecond=0) + timedelta(1)
+        self.recorder.on_event(Event(
+            'task-received', uuid=uuid, name='A', hostname='fuzzie',
+            expires=expires.isoformat(),
+        ))
+        self.recorder.flush()
+        # the events of later batches carry no expires.
+        self.recorder.on_event(Event(
+            'task-started', uuid=uuid, hostname='fuzzie',
+        ))
+        self.recorder.flush()
+        task = models.TaskState.objects.get(task_id=uuid)
+        assert task.state == states.STARTED
+        assert task.expires == make_aware(expires, utc)
+
+    def test_batch_size(self):
+        uuids = [gen_unique_id() for i in range(15)]
+        for uuid in uuids:
+            self.recorder.on_event(Event(
+                'task-received', uuid=uuid, name='A', hostname='fuzzie',
+            ))
+        assert models.TaskState.objects.count() == 10
+        assert len(self.recorder.tasks) == 5
+        self.recorder.cancel()
+        assert models.TaskState.objects.count() == 15
@@ -0,0 +1,50 @@
+from __future__ import absolute_import, unicode_literals
+
+import pytest
+
+from celery import states
+from celery.utils import gen_unique_id
+
+from django.utils import timezone
+
+from django_celery_monitor import models
+from django_celery_monitor.search import SearchIndex
+
+
+@pytest.mark.django_db
+class test_SearchIndex:
+
+    @pytest.fixture(autouse=True)
+    def setup_index(self):
+        self.index = SearchIndex(models.TaskState)
+
+    def create_task(self, **kwargs):
+        return models.TaskState.objects.create(
+            task_id=gen_unique_id(), state=states.SUCCESS, name='A',
+            tstamp=timezone.now(), **kwargs
+        )
+
+    def search(self, term):
+        return set(self.index.search(models.TaskState.objects.all(), term))
+
+    def test_install(self):
+        existing = self.create_task(kwargs="{'customer': 'cust-1234'}")
+        assert not self.index.installed()
+        assert self.index.install()
+        assert self.index.installed()
+        assert not self.index.install()
+        assert self.search('cust-1234') == {existing}
+
+    def test_kept_in_sync(self):
+        self.index.install()
+        t1 = self.create_task(args="['cust-1234']")
+        t2 = self.create_task(traceback='KeyError: "cust-1234"')
+        self.create_task(args="['cust-4321']")
+        assert self.search('cust-1234') == {t1, t2}
+        assert self.search('keyerror 1234') == {t2}
+
+        t1.args = "['cust-4321']"
+        t1.save()
+        assert self.search('cust-1234') == {t2}
+        t2.delete()
+        assert self.search('cust-1234') == set()
@@ -0,0 +1,70 @@
+from __future__ import absolute_import, unicode_literals
+
+import random
+
+import pytest
+
+from django_celery_monitor.sketches import DDSketch
+
+
+def exact_quantile(values, q):
+    values = sorted(values)
+    return values[int(q * (len(values) - 1))]
+
+
+class test_DDSketch:
+
+    def test_quantile(self):
+        rng = random.Random(42)
+        values = [rng.lognormvariate(0, 2) for i in range(10000)]
+        sketch = DDSketch(0.01)
+        for value in values:
+            sketch.add(value)
+        assert len(sketch) == 10000
+        for q in (0, 0.25, 0.5, 0.95, 0.99, 1):
+            exact = exact_quantile(values, q)
+            assert abs(sketch.quantile(q) - exact) <= 0.01 * exact
+        assert sketch.quantile(0) == min(values)
+        assert sketch.quantile(1) == max(values)
+        assert len(sketch.bins) < 2000
+
+    def test_merge(self):
+        rng = random.Random(7)
+        values = [rng.expovariate(1) for i in range(2000)]
+        whole, first, second = DDSketch(), DDSketch(), DDSketch()
+        for i, value in enumerate(values):
+            whole.add(value)
+            (first if i % 2 else second).add(value)
+        merged = first.merge(second)
+        assert merged.bins == whole.bins
+        assert merged.count == whole.count
+        assert merged.quantile(0.5) == whole.quantile(0.5)
+        assert merged.min == whole.min
+        assert merged.max == whole.max
+        with pytest.raises(ValueError):
+            merged.merge(DDSketch(0.05))
+
+    def test_zero(self):
+        sketch = DDSketch()
+        assert sketch.quantile(0.5) is None
+        for value in (0, 0, 0, 1.0):
+            sketch.add(value)
+        assert sketch.quantile(0.5) == 0.0
+        assert sketch.quantile(1) == 1.0
+        with pytest.raises(ValueError):
+            sketch.quantile(2)
+
+    def test_json(self):
+        sketch = DDSketch(0.02)
+        for value in (0.001, 0.5, 0.5, 3.0, 0):
+            sketch.add(value)
+        loaded = DDSketch.from_json(sketch.to_json())
+        assert loaded.relative_accuracy == 0.02
+        assert loaded.bins == sketch.bins
+        assert loaded.zero_count == 1
+        assert loaded.sum == sketch.sum
+        assert loaded.quantile(0.75) == sketch.quantile(0.75)
+
+    def test_relative_accuracy(self):
+        with pytest.raises(ValueError):
+            DDSketch(0)
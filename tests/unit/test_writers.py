@@ -0,0 +1,62 @@
+from __future__ import absolute_import, unicode_literals
+
+import threading
+
+from django_celery_monitor.writers import Writers
+
+
+class test_Writers:
+
+    def test_shard(self):
+        writers = Writers(threads=4)
+        shards = set(writers.shard('task-{0}'.format(i)) for i in range(100))
+        assert shards == {0, 1, 2, 3}
+        assert writers.shard('task-1') == writers.shard('task-1')
+
+    def test_submit(self):
+        writers = Writers(threads=2)
+        writers.start()
+        written = []
+        for i in range(10):
+            assert writers.submit(i % 2, written.append, i)
+        writers.join()
+        assert sorted(written) == list(range(10))
+        assert [i for i in written if i % 2] == [1, 3, 5, 7, 9]
+        writers.stop()
+        assert not writers.running
+
+    def test_submit_full(self):
+        writers = Writers(threads=1, queue_size=1, timeout=0.01)
+        assert writers.submit(0, list)
+        assert writers.depths() == [1]
+        assert not writers.submit(0, list)
+        assert writers.dropped == 1
+        assert writers.pending == 1
+
+    def test_submit_backpressure(self):
+        writers = Writers(threads=1, queue_size=1)
+        writers.start()
+        release = threading.Event()
+        written = []
+        writers.submit(0, release.wait)
+        writers.submit(0, written.append, 1)
+        submitter = threading.Thread(
+            target=writers.submit, args=(0, written.append, 2),
+        )
+        submitter.start()
+        submitter.join(0.05)
+        # waits for the writer thread since the queue is full.
+        assert submitter.is_alive()
+        release.set()
+        submitter.join()
+        writers.stop()
+        assert written == [1, 2]
+
+    def test_failing_job(self):
+        writers = Writers(threads=1)
+        writers.start()
+        written = []
+        writers.submit(0, lambda: 1 / 0)
+        writers.submit(0, written.append, 1)
+        writers.stop()
+        assert written == [1]